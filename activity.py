@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+  Users' posting activity over time, as sparse user x period post count matrices.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  A daily matrix is counted in one grouped pass over posts; weekly ones are summed from it, rather than re-counted.
+"""
+
+import datetime
+
+import numpy
+import scipy.sparse
+
+from dbquery import Query
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def parseDay(day):
+  """
+  Returns the date of a 'YYYY-MM-DD' string (or of a date).
+  """
+  if isinstance(day, datetime.date):
+    return day
+  return datetime.date(int(day[0:4]), int(day[5:7]), int(day[8:10]))
+
+def localDays(dates, timezone=None):
+  """
+  Returns the day ordinals of an array of unix times, in timezone (a pytz time zone; UTC if None).
+  Offsets are looked up once per distinct hour rather than per time, since zones only change offset on the hour.
+  """
+  dates = numpy.asarray(dates, dtype=numpy.int64)
+  if timezone is not None and len(dates):
+    hours, hourIndices = numpy.unique(dates // 3600, return_inverse=True)
+    offsets = numpy.asarray([timedeltaSeconds(datetime.datetime.fromtimestamp(int(hour) * 3600, timezone).utcoffset()) for hour in hours], dtype=numpy.int64)
+    dates = dates + offsets[hourIndices]
+  return dates // 86400 + EPOCH_ORDINAL
+
+def timedeltaSeconds(delta):
+  return delta.days * 86400 + delta.seconds
+
+def weekKey(day):
+  """
+  Returns the week a date falls in, as MySQL's FROM_UNIXTIME(date, '%Y-%U') would: the year, and the week of it
+  starting on Sunday, the days before the first Sunday being week 00.
+  """
+  return day.strftime('%Y-%U')
+
+def weekStart(key):
+  """
+  Returns the Sunday starting a week key. Week 00's Sunday can fall in the previous year, sharing its date with that
+  year's last week.
+  """
+  return datetime.datetime.strptime(key + '-0', '%Y-%U-%w').date()
+
+class ActivityMatrix(object):
+  '''
+  Post counts of users (rows, in userIDs order) in consecutive periods (columns, starting on the dates in periods).
+  '''
+  def __init__(self, userIDs, periods, counts):
+    self.userIDs = numpy.asarray(userIDs, dtype=numpy.int64)
+    self.periods = list(periods)
+    self.counts = scipy.sparse.csr_matrix(counts, dtype=numpy.int32)
+    self._rows = dict([(int(userID), row) for row, userID in enumerate(self.userIDs)])
+
+  def __len__(self):
+    return len(self.userIDs)
+
+  def __contains__(self, userID):
+    return int(userID) in self._rows
+
+  @classmethod
+  def load(cls, db, userIDs=None):
+    """
+    Counts the posts of every user (or of userIDs) on every day in one grouped pass over posts.
+    Days are in the database's time zone, as FROM_UNIXTIME gives them.
+    """
+    postQuery = Query("posts").fields("userid", "FROM_UNIXTIME(date, '%%Y-%%m-%%d') AS day", "COUNT(*) AS count").group("userid, day")
+    if userIDs is not None:
+      postQuery = postQuery.where(userid=[str(int(userID)) for userID in userIDs])
+    return cls.fromRows(postQuery.query(db))
+
+  @classmethod
+  def fromRows(cls, rows, userField='userid', dayField='day', countField='count'):
+    """
+    Builds a daily matrix from rows of a user id, a day ('YYYY-MM-DD' or a date) and a count, in any order.
+    Its columns run from the first day with a post to the last.
+    """
+    users = []
+    days = []
+    counts = []
+    for row in rows:
+      users.append(int(row[userField]))
+      days.append(parseDay(row[dayField]).toordinal())
+      counts.append(int(row[countField]))
+    if not users:
+      return cls([], [], scipy.sparse.csr_matrix((0, 0)))
+    userIDs, rowIndices = numpy.unique(users, return_inverse=True)
+    days = numpy.asarray(days)
+    firstDay = int(days.min())
+    numDays = int(days.max()) - firstDay + 1
+    matrix = scipy.sparse.coo_matrix((counts, (rowIndices, days - firstDay)), shape=(len(userIDs), numDays))
+    return cls(userIDs, [datetime.date.fromordinal(firstDay + offset) for offset in xrange(numDays)], matrix)
+
+  @classmethod
+  def fromPosts(cls, postUsers, postDates, userIDs=None, timezone=None):
+    """
+    Builds a daily matrix from arrays of each post's user id and unix time, counting days in timezone (see localDays()).
+    Only the posts of userIDs are counted, if it's given. Its columns run from the first day with a post to the last.
+    """
+    postUsers = numpy.asarray(postUsers, dtype=numpy.int64)
+    postDates = numpy.asarray(postDates, dtype=numpy.int64)
+    if userIDs is not None:
+      counted = numpy.in1d(postUsers, numpy.asarray(list(userIDs), dtype=numpy.int64))
+      postUsers = postUsers[counted]
+      postDates = postDates[counted]
+    if not len(postUsers):
+      return cls([], [], scipy.sparse.csr_matrix((0, 0)))
+    userIDs, rowIndices = numpy.unique(postUsers, return_inverse=True)
+    days = localDays(postDates, timezone=timezone)
+    firstDay = int(days.min())
+    numDays = int(days.max()) - firstDay + 1
+    # duplicate (user, day) entries are summed into that day's count.
+    matrix = scipy.sparse.coo_matrix((numpy.ones(len(days), dtype=numpy.int32), (rowIndices, days - firstDay)), shape=(len(userIDs), numDays))
+    return cls(userIDs, [datetime.date.fromordinal(firstDay + offset) for offset in xrange(numDays)], matrix)
+
+  def weekly(self):
+    """
+    Returns the weekly matrix of a daily one, with a column for every week key (see weekKey()) its days span.
+    """
+    keys = [weekKey(day) for day in self.periods]
+    weekKeys = sorted(set(keys))
+    weekColumns = dict([(key, column) for column, key in enumerate(weekKeys)])
+    # a days x weeks matrix of which week each day falls in; multiplying by it sums each week's days.
+    dayWeeks = scipy.sparse.csr_matrix((numpy.ones(len(keys), dtype=numpy.int32), (numpy.arange(len(keys)), [weekColumns[key] for key in keys])), shape=(len(keys), len(weekKeys)))
+    return ActivityMatrix(self.userIDs, [weekStart(key) for key in weekKeys], self.counts.dot(dayWeeks))
+
+  def row(self, userID):
+    return self._rows[int(userID)]
+
+  def dense(self, dtype=numpy.float64):
+    """
+    Returns the counts as a dense numpy array.
+    """
+    return self.counts.toarray().astype(dtype)
+
+  def series(self, userID):
+    """
+    Returns the (period start date, count) pairs of a user's periods with posts, in order, or [] for an unknown user.
+    """
+    if userID not in self:
+      return []
+    userRow = self.counts.getrow(self.row(userID))
+    return [(self.periods[column], int(count)) for column, count in sorted(zip(userRow.indices, userRow.data)) if count]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+  Scores alts against candidate users on a pool of processes, for determine_alt.py.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  The candidates' dense weekly matrix is saved once to a .npy file, which every worker memory-maps read-only. The OS
+  shares the file's pages between them, so no worker is sent or copies the matrix; each gets only the alts it scores,
+  and sends back their similarities, which are merged by alt id.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy
+
+import altscore
+
+# the memory-mapped matrix and week days of the worker process, set by initWorker().
+_worker = {}
+
+def initWorker(countsPath, days, windowRadius):
+  _worker['counts'] = numpy.load(countsPath, mmap_mode='r')
+  _worker['days'] = days
+  _worker['windowRadius'] = windowRadius
+
+def scoreAlt(task):
+  """
+  Runs in a worker. Returns the alt id of task, an (alt id, alt's weekly counts) pair, with its similarities().
+  """
+  altID, altCounts = task
+  return altID, altscore.similarities(_worker['counts'], _worker['days'], altCounts, windowRadius=_worker['windowRadius'])
+
+class AltPool(object):
+  '''
+  Scores alts against an altscore.AltScorer's candidates across processes (by default, one per core).
+  The matrix file lives in a temporary directory (under directory, if given) until the pool's closed.
+  '''
+  def __init__(self, scorer, processes=None, directory=None):
+    self.scorer = scorer
+    self.processes = processes or multiprocessing.cpu_count()
+    self._directory = tempfile.mkdtemp(prefix='altpool-', dir=directory)
+    self.countsPath = os.path.join(self._directory, 'counts.npy')
+    numpy.save(self.countsPath, scorer.counts)
+    self._pool = multiprocessing.Pool(self.processes, initWorker, (self.countsPath, scorer.days, scorer.windowRadius))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.close()
+
+  def rows(self, altIDs, chunkSize=1):
+    """
+    Returns a dict mapping each of altIDs to its rows, as AltScorer.rows() gives them.
+    Alts are handed to workers chunkSize at a time, as they free up.
+    """
+    tasks = ((altID, self.scorer.altCounts(altID)) for altID in altIDs)
+    altRows = {}
+    for altID, similarities in self._pool.imap_unordered(scoreAlt, tasks, chunkSize):
+      altRows[altID] = self.scorer.scoredRows(*similarities)
+    return altRows
+
+  def close(self):
+    """
+    Stops the workers and deletes the matrix file.
+    """
+    self._pool.close()
+    self._pool.join()
+    shutil.rmtree(self._directory, ignore_errors=True)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+  Batched scoring of how closely users' weekly activity tracks a suspected alt's, for determine_alt.py.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  For an alt and each candidate user, looking only at weeks the user posted in:
+    change: the mean of the user's and alt's combined posts in the alt's first weeks, minus the user's mean in the
+      weeks just before the alt started posting.
+    normalized change: change over the standard deviation of those prior weeks.
+    correlation: the Pearson correlation of the user's and alt's posts over every week both posted in, from the alt's
+      start on.
+  Users with fewer than two prior weeks, or no posterior ones, aren't scored.
+  Every candidate is scored at once with masked array arithmetic over a dense users x weeks matrix.
+"""
+
+import datetime
+
+import numpy
+
+def similarities(counts, days, altCounts, windowRadius=28):
+  """
+  Scores every row of counts, a users x weeks array of post counts, against an alt.
+  days holds the day ordinal each week starts on, ascending; altCounts holds the alt's posts in each week.
+  windowRadius is in days.
+  Returns (which rows were scored, change, normalized change, correlation), each an array with a value per row.
+  Unscored rows' values are nan, as are undefined ones, like the correlation over fewer than two weeks.
+  """
+  counts = numpy.asarray(counts, dtype=numpy.float64)
+  days = numpy.asarray(days, dtype=numpy.int64)
+  altCounts = numpy.asarray(altCounts, dtype=numpy.float64)
+  numUsers = counts.shape[0]
+  altWeeks = altCounts > 0
+  if not altWeeks.any():
+    nans = numpy.full(numUsers, numpy.nan)
+    return numpy.zeros(numUsers, dtype=bool), nans, nans.copy(), nans.copy()
+  altStarted = days[altWeeks].min()
+
+  # only the weeks around the alt's start, and the alt's own weeks, can count; work on just those columns.
+  priorColumns = numpy.flatnonzero((days < altStarted) & (altStarted - days < windowRadius))
+  coincidingColumns = numpy.flatnonzero(altWeeks & (days >= altStarted))
+  posteriorColumns = coincidingColumns[days[coincidingColumns] - altStarted < windowRadius]
+  priors = counts[:, priorColumns]
+  posteriors = counts[:, posteriorColumns] + altCounts[posteriorColumns]
+  coinciding = counts[:, coincidingColumns]
+  priorWeeks = priors > 0
+  posteriorWeeks = counts[:, posteriorColumns] > 0
+  coincidingWeeks = coinciding > 0
+
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    numPriors = priorWeeks.sum(axis=1)
+    priorMean = numpy.where(priorWeeks, priors, 0).sum(axis=1) / numPriors
+    priorStdev = numpy.sqrt(numpy.where(priorWeeks, (priors - priorMean[:, None]) ** 2, 0).sum(axis=1) / numPriors)
+    numPosteriors = posteriorWeeks.sum(axis=1)
+    posteriorMean = numpy.where(posteriorWeeks, posteriors, 0).sum(axis=1) / numPosteriors
+    change = posteriorMean - priorMean
+    normedChange = change / priorStdev
+    correlation = maskedPearson(coinciding, altCounts[coincidingColumns], coincidingWeeks)
+
+  scored = (numPriors >= 2) & (numPosteriors > 0)
+  return scored, numpy.where(scored, change, numpy.nan), numpy.where(scored, normedChange, numpy.nan), numpy.where(scored, correlation, numpy.nan)
+
+def maskedPearson(x, y, mask):
+  """
+  Returns the Pearson correlation of each row of x with y, over only the weeks in that row of mask, clipped to
+  [-1, 1] as scipy.stats.pearsonr does. Rows with fewer than two weeks, or no variance, get nan.
+  """
+  n = mask.sum(axis=1).astype(numpy.float64)
+  xMean = numpy.where(mask, x, 0).sum(axis=1) / n
+  yMean = numpy.where(mask, y, 0).sum(axis=1) / n
+  xDeviations = numpy.where(mask, x - xMean[:, None], 0)
+  yDeviations = numpy.where(mask, y - yMean[:, None], 0)
+  numerator = (xDeviations * yDeviations).sum(axis=1)
+  denominator = numpy.sqrt((xDeviations ** 2).sum(axis=1) * (yDeviations ** 2).sum(axis=1))
+  correlation = numpy.clip(numerator / denominator, -1.0, 1.0)
+  return numpy.where(n >= 2, correlation, numpy.nan)
+
+class AltScorer(object):
+  '''
+  Scores candidate users against alts, from a weekly activity.ActivityMatrix.
+  The candidates' dense matrix is built once, and shared by every alt scored.
+  '''
+  def __init__(self, weekly, candidates=None, windowRadius=datetime.timedelta(weeks=4)):
+    self.weekly = weekly
+    self.candidates = numpy.asarray(candidates if candidates is not None else weekly.userIDs, dtype=numpy.int64)
+    self.windowRadius = windowRadius.days
+    self.days = numpy.asarray([day.toordinal() for day in weekly.periods], dtype=numpy.int64)
+    self.counts = weekly.counts[[weekly.row(userID) for userID in self.candidates]].toarray().astype(numpy.float64)
+
+  def altCounts(self, altID):
+    """
+    Returns the alt's posts in each week. Weeks are matched by start date, so two weeks starting on the same Sunday
+    (a year's last, and the next's week 00) both get the later one's posts.
+    """
+    altDates = dict(self.weekly.series(altID))
+    return numpy.asarray([altDates.get(day, 0) for day in self.weekly.periods], dtype=numpy.float64)
+
+  def score(self, altID):
+    """
+    Returns similarities() of every candidate against altID.
+    """
+    return similarities(self.counts, self.days, self.altCounts(altID), windowRadius=self.windowRadius)
+
+  def rows(self, altID):
+    """
+    Returns [user id, change, normalized change, correlation] for each scored candidate, in candidate order.
+    """
+    return self.scoredRows(*self.score(altID))
+
+  def scoredRows(self, scored, change, normedChange, correlation):
+    """
+    Returns [user id, change, normalized change, correlation] for each scored candidate of a similarities() result.
+    """
+    return [[int(self.candidates[row]), change[row], normedChange[row], correlation[row]] for row in numpy.flatnonzero(scored)]
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+"""
+  Measures how alt scoring throughput scales with altpool's process count.
+  Scores numAlts alts against synthetic weekly activity for numUsers users (see alt_scoring.py), first in this process,
+  then on pools of 1 up to one process per core, checking every pool's rows match the serial ones.
+  Usage: python benchmarks/alt_pool.py [numUsers] [numAlts]
+"""
+
+import multiprocessing
+import random
+import sys
+
+import numpy
+
+import common
+import alt_scoring
+import altpool
+import altscore
+
+def main(numUsers, numAlts):
+  weekly = alt_scoring.build(numUsers)
+  candidates = list(weekly.userIDs)
+  alts = random.sample(candidates, numAlts)
+  scorer = altscore.AltScorer(weekly, candidates, windowRadius=alt_scoring.WINDOW_RADIUS)
+  numpy.seterr(all='ignore')
+  serialTime, serialRows = common.timed(lambda: dict([(altID, scorer.rows(altID)) for altID in alts]), repeat=1)
+  common.report("serial, %d alts x %d users" % (numAlts, numUsers), serialTime)
+  print "  %.1f alts/s" % (numAlts / serialTime)
+
+  processCounts = sorted(set([1, 2, 4, 8, 16, 32, multiprocessing.cpu_count()]))
+  for processes in [count for count in processCounts if count <= multiprocessing.cpu_count()]:
+    with altpool.AltPool(scorer, processes=processes) as pool:
+      poolTime, poolRows = common.timed(lambda: pool.rows(alts), repeat=1)
+    common.report("%d processes, %d alts x %d users" % (processes, numAlts, numUsers), poolTime)
+    print "  %.1f alts/s, %.1fx serial" % (numAlts / poolTime, serialTime / poolTime)
+    if any([not alt_scoring.same(serialRows[altID], poolRows[altID]) for altID in alts]):
+      print "MISMATCH between serial and pooled scores with %d processes" % processes
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000, int(sys.argv[2]) if len(sys.argv) > 2 else 64)
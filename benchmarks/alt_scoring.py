@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+  Compares determine_alt.py's per-pair alt similarity loop against the batched scorer in altscore.
+  Builds synthetic weekly activity for numUsers users over ten years, then scores a few alts against every user each
+  way, checking that both give the same numbers.
+  Usage: python benchmarks/alt_scoring.py [numUsers]
+"""
+
+import datetime
+import random
+import sys
+
+import numpy
+import scipy.sparse
+import scipy.stats
+
+import common
+import activity
+import altscore
+
+NUM_WEEKS = 520
+NUM_ALTS = 3
+WINDOW_RADIUS = datetime.timedelta(weeks=4)
+
+def build(numUsers):
+  firstSunday = datetime.date(2004, 1, 4)
+  periods = [firstSunday + datetime.timedelta(weeks=week) for week in range(NUM_WEEKS)]
+  rows, columns, counts = [], [], []
+  for row in range(numUsers):
+    start = random.randint(0, NUM_WEEKS - 10)
+    end = random.randint(start + 5, NUM_WEEKS)
+    rate = random.paretovariate(1.5)
+    for week in range(start, end):
+      if random.random() < 0.7:
+        rows.append(row)
+        columns.append(week)
+        counts.append(1 + int(random.expovariate(1.0 / rate)))
+  matrix = scipy.sparse.coo_matrix((counts, (rows, columns)), shape=(numUsers, NUM_WEEKS))
+  return activity.ActivityMatrix(range(1, numUsers + 1), periods, matrix)
+
+def loopScores(weekly, altID, candidates):
+  """
+  The per-pair loop from determine_alt.py.
+  """
+  alt_dates = {daily_tuple[0]: daily_tuple[1] for daily_tuple in weekly.series(altID)}
+  alt_started = min(alt_dates.keys())
+  alt_similarities = []
+  for user_id in candidates:
+    user_similarities = [user_id]
+    user_priors = []
+    user_posteriors = []
+    user_coincide_posteriors = []
+    for post_tuple in weekly.series(user_id):
+      if post_tuple[0] < alt_started:
+        if alt_started - post_tuple[0] < WINDOW_RADIUS:
+          user_priors.append(post_tuple[1])
+      else:
+        if post_tuple[0] in alt_dates:
+          user_coincide_posteriors.append((post_tuple[1], alt_dates[post_tuple[0]]))
+          if post_tuple[0] - alt_started < WINDOW_RADIUS:
+            total_sum = post_tuple[1] + alt_dates[post_tuple[0]]
+            user_posteriors.append(total_sum)
+    if len(user_priors) < 2 or not user_posteriors:
+      continue
+    user_prior_mean = float(sum(user_priors)) / len(user_priors)
+    user_prior_stdev = numpy.std(user_priors)
+    user_posterior_mean = float(sum(user_posteriors)) / len(user_posteriors)
+    user_posterior_change = user_posterior_mean - user_prior_mean
+    user_posterior_change_normed = user_posterior_change / user_prior_stdev
+    user_similarities.extend([user_posterior_change, user_posterior_change_normed])
+    user_correlation = scipy.stats.pearsonr(*zip(*user_coincide_posteriors))[0]
+    user_similarities.append(user_correlation)
+    alt_similarities.append(user_similarities)
+  return alt_similarities
+
+def same(loopRows, batchRows):
+  if [row[0] for row in loopRows] != [row[0] for row in batchRows]:
+    return False
+  loopValues = numpy.array([row[1:] for row in loopRows], dtype=numpy.float64)
+  batchValues = numpy.array([row[1:] for row in batchRows], dtype=numpy.float64)
+  return loopValues.shape == batchValues.shape and numpy.allclose(loopValues, batchValues, equal_nan=True)
+
+def main(numUsers):
+  weekly = build(numUsers)
+  candidates = list(weekly.userIDs)
+  alts = random.sample(candidates, NUM_ALTS)
+  setupTime, scorer = common.timed(lambda: altscore.AltScorer(weekly, candidates, windowRadius=WINDOW_RADIUS), repeat=1)
+  common.report("batched setup, %d users" % numUsers, setupTime)
+  numpy.seterr(all='ignore')
+  for altID in alts:
+    loopTime, loopRows = common.timed(lambda: loopScores(weekly, altID, candidates), repeat=1)
+    batchTime, batchRows = common.timed(lambda: scorer.rows(altID))
+    common.report("loop, 1 alt x %d users" % numUsers, loopTime)
+    common.report("batched, 1 alt x %d users" % numUsers, batchTime)
+    print "  %d users scored, %.0fx faster" % (len(batchRows), loopTime / batchTime)
+    if not same(loopRows, batchRows):
+      print "MISMATCH between loop and batched scores for alt", altID
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
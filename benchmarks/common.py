@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+  Shared helpers for the ETI unofficial API benchmark scripts.
+  Scripts are run from the repository root, e.g. python benchmarks/page_numbers.py
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+  sys.path.insert(0, ROOT)
+
+def connect():
+  """
+  Opens a DbConn using the API server's config.txt credentials.
+  """
+  import DbConn
+  with open(os.path.join(ROOT, "config.txt"), 'r') as f:
+    username, password, database = f.readline().strip().split(',')
+  return DbConn.DbConn(username, password, database)
+
+class SqliteConn(object):
+  '''
+  Just enough of the DbConn builder for Query to run simple selects against a sqlite3 connection.
+  '''
+  def __init__(self, db):
+    self.conn = db
+    self._reset()
+
+  def _reset(self):
+    self._table = None
+    self._fields = []
+    self._joins = []
+    self._wheres = []
+    self._params = []
+    self._order = self._start = self._limit = None
+
+  def table(self, table):
+    self._table = table
+    return self
+  def fields(self, *fields):
+    self._fields.extend(fields)
+    return self
+  def join(self, join, joinType='INNER'):
+    self._joins.append(joinType + " JOIN " + join)
+    return self
+  def where(self, *args, **kwargs):
+    for clause in args:
+      if isinstance(clause, tuple):
+        self._wheres.append(clause[0].replace("%s", "?"))
+        self._params.extend(clause[1:])
+      else:
+        self._wheres.append(clause)
+    for field, value in kwargs.iteritems():
+      if isinstance(value, list):
+        self._wheres.append(field + " IN (" + ", ".join(["?"] * len(value)) + ")")
+        self._params.extend(value)
+      else:
+        self._wheres.append(field + " = ?")
+        self._params.append(value)
+    return self
+  def order(self, order):
+    self._order = order
+    return self
+  def start(self, start):
+    self._start = start
+    return self
+  def limit(self, limit):
+    self._limit = limit
+    return self
+  def query(self, newCursor=False):
+    sql = "SELECT " + (", ".join(self._fields) or "*") + " FROM " + self._table
+    for join in self._joins:
+      sql += " " + join
+    if self._wheres:
+      sql += " WHERE " + " AND ".join(self._wheres)
+    if self._order is not None:
+      sql += " ORDER BY " + self._order
+    if self._limit is not None:
+      sql += " LIMIT " + str(int(self._limit)) + " OFFSET " + str(int(self._start or 0))
+    params = self._params
+    self._reset()
+    cursor = self.conn.execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+class QueryCounter(object):
+  '''
+  Counts the queries a DbConn executes, by wrapping its query() method.
+  '''
+  def __init__(self, db):
+    self.db = db
+    self.count = 0
+    self._query = db.query
+    db.query = self._countedQuery
+
+  def _countedQuery(self, *args, **kwargs):
+    self.count += 1
+    return self._query(*args, **kwargs)
+
+  def reset(self):
+    self.count = 0
+
+def timed(f, repeat=3):
+  """
+  Runs f() repeat times, returning (best wall time in seconds, last result).
+  """
+  best = None
+  result = None
+  for i in range(repeat):
+    start = time.time()
+    result = f()
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+def report(label, seconds, queries=None):
+  line = "%-40s %10.2f ms" % (label, seconds * 1000)
+  if queries is not None:
+    line += " %8d queries" % queries
+  print line
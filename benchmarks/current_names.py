@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+  Compares resolving current usernames with the user_names anti-join against the current name index.
+  Builds a SQLite user_names table with several renames per user, prints both query plans, then times
+  resolving the names of a page of posts' authors each way. Runs once with only a user_id index, and once
+  with a (user_id, date) index that the anti-join can use.
+  Usage: python benchmarks/current_names.py [numUsers]
+"""
+
+import datetime
+import random
+import sqlite3
+import sys
+
+import common
+import eti
+
+BATCH_SIZES = [50, 1000]
+INDEXES = ["user_id", "user_id, date"]
+
+ANTI_JOIN = """SELECT user_names.user_id, user_names.name FROM user_names
+  LEFT OUTER JOIN user_names un2 ON un2.user_id = user_names.user_id AND user_names.date < un2.date
+  WHERE un2.date IS NULL AND user_names.user_id IN (%s)"""
+
+PROJECTION = "SELECT user_id, name, date FROM user_names WHERE user_id IN (%s)"
+
+def build(numUsers, index):
+  db = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+  db.execute("CREATE TABLE user_names (user_id INT, name TEXT, date TIMESTAMP)")
+  rows = []
+  start = datetime.datetime(2004, 1, 1)
+  for userID in xrange(1, numUsers + 1):
+    for rename, day in enumerate(random.sample(xrange(4000), random.randint(1, 6))):
+      rows.append((userID, "user%d_%d" % (userID, rename), start + datetime.timedelta(days=day)))
+  db.executemany("INSERT INTO user_names VALUES (?, ?, ?)", rows)
+  db.execute("CREATE INDEX user_names_index ON user_names (" + index + ")")
+  db.commit()
+  return db
+
+def main(numUsers):
+  for index in INDEXES:
+    print "index on (%s):" % index
+    compare(build(numUsers, index), numUsers)
+
+def compare(db, numUsers):
+  sampleIDs = ",".join(str(userID) for userID in range(1, 51))
+  print "anti-join plan:"
+  for step in db.execute("EXPLAIN QUERY PLAN " + ANTI_JOIN % sampleIDs):
+    print "  ", step[-1]
+  print "projection plan:"
+  for step in db.execute("EXPLAIN QUERY PLAN " + PROJECTION % sampleIDs):
+    print "  ", step[-1]
+
+  conn = common.SqliteConn(db)
+  for batchSize in BATCH_SIZES:
+    userIDs = random.sample(xrange(1, numUsers + 1), batchSize)
+    inList = ",".join(str(userID) for userID in userIDs)
+    antiJoinTime, antiJoinNames = common.timed(lambda: dict(db.execute(ANTI_JOIN % inList).fetchall()))
+
+    coldTime, coldNames = common.timed(lambda: eti.CurrentNameIndex(refreshInterval=None).names(conn, userIDs))
+    warmIndex = eti.CurrentNameIndex(refreshInterval=None)
+    warmIndex.names(conn, userIDs)
+    warmTime, warmNames = common.timed(lambda: warmIndex.names(conn, userIDs))
+
+    common.report("anti-join x %d users" % batchSize, antiJoinTime)
+    common.report("name index (cold) x %d users" % batchSize, coldTime)
+    common.report("name index (warm) x %d users" % batchSize, warmTime)
+    if antiJoinNames != coldNames or coldNames != warmNames:
+      print "MISMATCH between anti-join and name index at", batchSize
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
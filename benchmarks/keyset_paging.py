@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+  Compares offset paging against keyset (cursor) paging over a synthetic posts table.
+  Builds a single-topic, 1M-post SQLite table indexed the same way as the posts listing order,
+  then times fetching a 50-post page at increasing depths with both query shapes.
+  Usage: python benchmarks/keyset_paging.py [numPosts]
+"""
+
+import random
+import sqlite3
+import sys
+import time
+
+import common
+
+PAGE_SIZE = 50
+DEPTHS = [0, 1000, 10000, 100000, 500000, 990000]
+
+def build(numPosts):
+  db = sqlite3.connect(':memory:')
+  db.execute("CREATE TABLE posts (ll_messageid INTEGER PRIMARY KEY, ll_topicid INT, userid INT, date INT)")
+  rows = []
+  date = 1000000000
+  for messageID in xrange(1, numPosts + 1):
+    # several posts share a timestamp, so the id tie-breaker matters.
+    date += random.randint(0, 2)
+    rows.append((messageID, 1, random.randint(1, 5000), date))
+  db.executemany("INSERT INTO posts VALUES (?, ?, ?, ?)", rows)
+  db.execute("CREATE INDEX topic_date ON posts (ll_topicid, date, ll_messageid)")
+  db.commit()
+  return db
+
+def offsetPage(db, depth):
+  return db.execute("SELECT * FROM posts WHERE ll_topicid = 1 ORDER BY date DESC, ll_messageid DESC LIMIT ? OFFSET ?", (PAGE_SIZE, depth)).fetchall()
+
+def keysetPage(db, cursor):
+  if cursor is None:
+    return db.execute("SELECT * FROM posts WHERE ll_topicid = 1 ORDER BY date DESC, ll_messageid DESC LIMIT ?", (PAGE_SIZE,)).fetchall()
+  date, messageID = cursor
+  return db.execute("SELECT * FROM posts WHERE ll_topicid = 1 AND date <= ? AND (date < ? OR ll_messageid < ?) ORDER BY date DESC, ll_messageid DESC LIMIT ?", (date, date, messageID, PAGE_SIZE)).fetchall()
+
+def main(numPosts):
+  start = time.time()
+  db = build(numPosts)
+  print "built %d posts in %.1f s" % (numPosts, time.time() - start)
+  for depth in [depth for depth in DEPTHS if depth < numPosts]:
+    # the cursor a client would hold after reading everything up to depth.
+    cursor = None
+    if depth > 0:
+      previous = offsetPage(db, depth - 1)[0]
+      cursor = (previous[3], previous[0])
+    offsetTime, offsetRows = common.timed(lambda: offsetPage(db, depth))
+    keysetTime, keysetRows = common.timed(lambda: keysetPage(db, cursor))
+    common.report("offset page at %d" % depth, offsetTime)
+    common.report("keyset page at %d" % depth, keysetTime)
+    if offsetRows != keysetRows:
+      print "MISMATCH between offset and keyset pages at depth", depth
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
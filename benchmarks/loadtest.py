@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+  Load-test harness for a running API server. Runs 50 and then 500 concurrent clients, each looping over the
+  read-only routes, and reports requests per second and latency percentiles for each level.
+  Run it once against ./start-server and once against ./start-server-gevent to compare serving modes.
+  Every client shares one IP, so raise LIMIT_REQUEST_NUM in server.py first or most responses will be rate-limited.
+  Usage: python benchmarks/loadtest.py <base url> <topicid> <postid> <userid> <tag> [seconds]
+"""
+
+import collections
+import sys
+import threading
+import time
+import urllib
+import urllib2
+
+CONCURRENCY = [50, 500]
+
+def routes(topicID, postID, userID, tag):
+  return [
+    '/topics',
+    '/topics/%d' % topicID,
+    '/topics/%d/posts' % topicID,
+    '/posts/%d' % postID,
+    '/users/%d' % userID,
+    '/tags/%s' % urllib.quote(tag)
+  ]
+
+def client(baseURL, paths, deadline, latencies, statuses, lock):
+  index = 0
+  while time.time() < deadline:
+    path = paths[index % len(paths)]
+    index += 1
+    start = time.time()
+    try:
+      status = urllib2.urlopen(baseURL + path, timeout=30).getcode()
+    except urllib2.HTTPError, e:
+      status = e.code
+    except Exception, e:
+      status = 'error'
+    elapsed = time.time() - start
+    with lock:
+      latencies.append(elapsed)
+      statuses[status] += 1
+
+def run(baseURL, paths, concurrency, seconds):
+  latencies = []
+  statuses = collections.Counter()
+  lock = threading.Lock()
+  deadline = time.time() + seconds
+  clients = [threading.Thread(target=client, args=(baseURL, paths, deadline, latencies, statuses, lock)) for i in range(concurrency)]
+  start = time.time()
+  for thread in clients:
+    thread.start()
+  for thread in clients:
+    thread.join()
+  elapsed = time.time() - start
+  latencies.sort()
+  percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+  print "%4d clients: %8.1f req/s  p50 %7.1f ms  p99 %7.1f ms  statuses %s" % (concurrency, len(latencies) / elapsed, percentile(0.5), percentile(0.99), dict(statuses))
+
+def main(baseURL, topicID, postID, userID, tag, seconds):
+  paths = routes(topicID, postID, userID, tag)
+  for concurrency in CONCURRENCY:
+    run(baseURL.rstrip('/'), paths, concurrency, seconds)
+
+if __name__ == '__main__':
+  if len(sys.argv) < 6:
+    print __doc__
+    sys.exit(1)
+  main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), sys.argv[5], int(sys.argv[6]) if len(sys.argv) > 6 else 30)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+  Microbenchmark of model object construction and serialization, without a database.
+  Times turning synthetic joined post rows into Posts (with their Topic and User) and back into dicts, and reports
+  objects per second for each step and the bytes each Post and its nested objects occupy. Posts are built with and
+  without an identity map shared between them, and serialized nested, nested with a memo, and normalized, along with
+  the size of the JSON each shape makes.
+  Usage: python benchmarks/model_objects.py [numRows]
+"""
+
+import json
+import sys
+
+import common
+import eti
+
+def row(messageID):
+  return {
+    'll_messageid': messageID, 'll_topicid': messageID // 50 + 1, 'userid': messageID % 40 + 1, 'date': 1300000000 + messageID,
+    'messagetext': u'<b>hello</b> world post %d' % messageID, 'sig': u'---<br />sig',
+    'title': u'topic title', 'postCount': 50, 'lastPostTime': 1300000000,
+    'id': messageID % 40 + 1, 'name': u'user', 'created': 1100000000, 'lastactive': 1300000000, 'good_tokens': 3, 'bad_tokens': 0,
+    'contrib_tokens': 1, 'signature': u'sig', 'quote': 'NULL', 'email': u'user@example.com', 'im': 'NULL', 'picture': 'NULL', 'status': 0
+  }
+
+def footprint(obj, seen):
+  """
+  Returns the bytes held by obj and the model objects nested in it that aren't in seen, not counting the field values
+  they share.
+  """
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if hasattr(obj, '__dict__'):
+    size += sys.getsizeof(obj.__dict__)
+  for attr in ('topic', 'user'):
+    nested = getattr(obj, attr, None)
+    if isinstance(nested, eti.BaseObject):
+      size += footprint(nested, seen)
+  return size
+
+def postFootprint(posts):
+  seen = set()
+  return sum([footprint(post, seen) for post in posts]) / len(posts)
+
+def serializeAll(posts, normalized=False, memo=None):
+  included = {} if normalized else None
+  dicts = [post.dict(included=included, memo=memo) for post in posts]
+  return {'posts': dicts, 'topics': included['topics'], 'users': included['users']} if normalized else {'posts': dicts}
+
+def main(numRows):
+  rows = [row(messageID) for messageID in xrange(1, numRows + 1)]
+  buildTime, posts = common.timed(lambda: [eti.Post(None, postRow['ll_messageid']).setDB(dict(postRow)) for postRow in rows])
+  common.report("build %d posts" % numRows, buildTime)
+  print "  %d posts/s" % (numRows / buildTime)
+  print "  %d bytes per post, with its topic and user" % postFootprint(posts)
+  def buildShared():
+    identities = eti.IdentityMap()
+    return [eti.Post(None, postRow['ll_messageid']).setDB(dict(postRow), identities=identities) for postRow in rows]
+  buildTime, posts = common.timed(buildShared)
+  common.report("build %d posts, identity map" % numRows, buildTime)
+  print "  %d posts/s" % (numRows / buildTime)
+  print "  %d bytes per post, with its topic and user" % postFootprint(posts)
+
+  for label, serialize in [("nested", lambda: serializeAll(posts)), ("nested, memo", lambda: serializeAll(posts, memo={})),
+                           ("normalized", lambda: serializeAll(posts, normalized=True))]:
+    serializeTime, output = common.timed(serialize)
+    common.report("serialize %d posts, %s" % (numRows, label), serializeTime)
+    print "  %d posts/s, %d bytes of JSON" % (numRows / serializeTime, len(json.dumps(output)))
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
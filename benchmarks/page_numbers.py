@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+  Compares page-number lookups for a topic's posts:
+    one COUNT(*) per post (the original Post.getPage() query),
+    PostList.getPages() with the topic not in the post ordinal index (one grouped query), and
+    PostList.getPages() with the topic indexed, as after a Post.getPage() in it (no queries).
+  Usage: python benchmarks/page_numbers.py <topicid>
+"""
+
+import sys
+
+import common
+import eti
+
+LIMITS = [50, 500, 1000]
+
+def countPage(db, post):
+  numPosts = int(db.table("posts").fields("COUNT(*)").where("ll_messageid < " + str(int(post.id)), ll_topicid=str(post.topic.id)).firstValue(newCursor=True))
+  return int(numPosts * 1.0 / eti.POSTS_PER_PAGE) + 1
+
+def main(topicID):
+  db = common.connect()
+  counter = common.QueryCounter(db)
+  for limit in LIMITS:
+    posts = eti.PostList(db).topic(eti.Topic(db, topicID)).limit(limit).search(includes=['user'])
+
+    counter.reset()
+    countTime, countPages = common.timed(lambda: [countPage(db, post) for post in posts], repeat=1)
+    common.report("COUNT(*) x %d" % len(posts), countTime, counter.count)
+
+    eti.postOrdinals.invalidate(topicID)
+    counter.reset()
+    coldTime, coldPosts = common.timed(lambda: eti.PostList(db).getPages(posts), repeat=1)
+    common.report("grouped query (cold) x %d" % len(posts), coldTime, counter.count)
+    coldPages = [post.page for post in coldPosts]
+
+    eti.postOrdinals.ordinal(db, topicID, posts[-1].id)
+    counter.reset()
+    warmTime, warmPosts = common.timed(lambda: eti.PostList(db).getPages(posts))
+    common.report("ordinal index (warm) x %d" % len(posts), warmTime, counter.count / 3)
+
+    if countPages != coldPages:
+      print "MISMATCH between COUNT(*) and the grouped query at limit", limit
+    if countPages != [post.page for post in warmPosts]:
+      print "MISMATCH between COUNT(*) and the ordinal index at limit", limit
+  db.close()
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2:
+    print __doc__
+    sys.exit(1)
+  main(int(sys.argv[1]))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+  Measures post search latency on a synthetic corpus.
+  Builds a SQLite posts table of HTML posts drawn from a skewed vocabulary, indexes it with the post index, then times
+  common, rare and multi-term queries (and one filtered by topic) against a LIKE scan that finds the same posts unranked.
+  Searches run against the index as workers get it: saved to a file, then re-loaded.
+  Usage: python benchmarks/post_search.py [numPosts]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+import common
+import postsearch
+
+VOCABULARY_SIZE = 50000
+NUM_TOPICS = 2000
+
+def word(rank):
+  return "w%d" % rank
+
+def build(numPosts):
+  db = sqlite3.connect(':memory:')
+  db.execute("CREATE TABLE posts (ll_messageid INTEGER PRIMARY KEY, ll_topicid INT, userid INT, date INT, messagetext TEXT)")
+  rows = []
+  date = 1000000000
+  for messageID in xrange(1, numPosts + 1):
+    date += random.randint(0, 60)
+    words = [word(min(int(random.paretovariate(0.6)), VOCABULARY_SIZE)) for i in range(random.randint(5, 80))]
+    text = "<b>" + " ".join(words[:3]) + "</b><br />" + " ".join(words[3:]) + "<br />---<br />sig"
+    rows.append((messageID, random.randint(1, NUM_TOPICS), random.randint(1, 5000), date, text))
+  db.executemany("INSERT INTO posts VALUES (?, ?, ?, ?, ?)", rows)
+  db.commit()
+  return db
+
+def likeScan(db, terms, topicID=None):
+  sql = "SELECT ll_messageid, messagetext FROM posts WHERE " + " AND ".join(["messagetext LIKE ?"] * len(terms))
+  params = ["%" + term + "%" for term in terms]
+  if topicID is not None:
+    sql += " AND ll_topicid = ?"
+    params.append(topicID)
+  # LIKE also matches inside longer words; keep only whole-word matches, as the index does.
+  return set([row[0] for row in db.execute(sql, params) if all(term in postsearch.tokenize(postsearch.stripHTML(row[1])) for term in terms)])
+
+def main(numPosts):
+  db = build(numPosts)
+  conn = common.SqliteConn(db)
+  path = os.path.join(tempfile.mkdtemp(), "postindex.bin")
+  indexTime, built = common.timed(lambda: postsearch.PostIndex(path, refreshInterval=None, batchSize=10000).build(conn), repeat=1)
+  common.report("index %d posts" % numPosts, indexTime)
+  saveTime, result = common.timed(built.save, repeat=1)
+  common.report("save to file", saveTime)
+  loadTime, index = common.timed(lambda: postsearch.PostIndex(path, refreshInterval=None).load(), repeat=1)
+  common.report("load from file", loadTime)
+
+  queries = [
+    ("common term", [word(1)], None),
+    ("rare term", [word(400)], None),
+    ("2 terms", [word(2), word(30)], None),
+    ("3 terms", [word(3), word(10), word(50)], None),
+    ("2 terms in a topic", [word(2), word(5)], 7)
+  ]
+  for label, terms, topicID in queries:
+    query = " ".join(terms)
+    topicIDs = [topicID] if topicID is not None else None
+    scanTime, scanPosts = common.timed(lambda: likeScan(db, terms, topicID))
+    searchTime, searchPosts = common.timed(lambda: index.search(conn, query, topicIDs=topicIDs, limit=50))
+    allTime, allPosts = common.timed(lambda: index.search(conn, query, topicIDs=topicIDs, limit=numPosts))
+    common.report("LIKE scan, %s" % label, scanTime)
+    common.report("index, top 50, %s" % label, searchTime)
+    common.report("index, all %d, %s" % (len(allPosts), label), allTime)
+    if scanPosts != set([postID for postID, score in allPosts]):
+      print "MISMATCH between LIKE scan and index for", label
+  os.unlink(path)
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+  Compares counting a year of users' daily posts with a grouped query against reading it from a columnar snapshot.
+  Builds a SQLite posts table of numPosts posts over five years, exports it to a snapshot in a temporary directory,
+  times an incremental export of a day's new posts, then times the last year's daily activity matrix from a grouped
+  query and from a freshly opened snapshot, checking both give the same counts.
+  Usage: python benchmarks/snapshot_reads.py [numPosts]
+"""
+
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import common
+import activity
+import snapshot
+
+NUM_USERS = 5000
+START = 1104537600
+SPAN = 5 * 365 * 86400
+YEAR = 365 * 86400
+
+ACTIVITY_QUERY = """SELECT userid, date(date, 'unixepoch') AS day, COUNT(*) AS count FROM posts
+  WHERE date >= ? AND date < ? GROUP BY userid, day"""
+
+def build(numPosts):
+  db = sqlite3.connect(':memory:')
+  db.execute("CREATE TABLE posts (ll_messageid INTEGER PRIMARY KEY, ll_topicid INT, userid INT, date INT)")
+  addPosts(db, 1, numPosts, START, SPAN)
+  db.execute("CREATE INDEX posts_date ON posts (date)")
+  return db
+
+def addPosts(db, firstID, numPosts, start, span):
+  interval = float(span) / numPosts
+  db.executemany("INSERT INTO posts VALUES (?, ?, ?, ?)", ((firstID + offset, random.randint(1, numPosts // 200 + 1),
+    int(random.paretovariate(1.2)) % NUM_USERS + 1, start + int(offset * interval)) for offset in xrange(numPosts)))
+  db.commit()
+
+def main(numPosts):
+  db = build(numPosts)
+  conn = common.SqliteConn(db)
+  directory = tempfile.mkdtemp(prefix='snapshot-')
+  try:
+    exportTime, written = common.timed(lambda: snapshot.Snapshot(directory).export(conn, tables=['posts']), repeat=1)
+    common.report("export %d posts" % written['posts'], exportTime)
+    addPosts(db, numPosts + 1, numPosts // (5 * 365), START + SPAN, 86400)
+    appendTime, written = common.timed(lambda: snapshot.Snapshot(directory).export(conn, tables=['posts']), repeat=1)
+    common.report("append %d posts" % written['posts'], appendTime)
+
+    end = START + SPAN + 86400
+    queryTime, queried = common.timed(lambda: activity.ActivityMatrix.fromRows(db.execute(ACTIVITY_QUERY, (end - YEAR, end)).fetchall(), 0, 1, 2))
+    common.report("year of activity, grouped query", queryTime)
+    mappedTime, mapped = common.timed(lambda: snapshot.Snapshot(directory).activity(start=end - YEAR, end=end))
+    common.report("year of activity, snapshot", mappedTime)
+    print "  %d users, %d days, %.1fx faster" % (len(mapped), len(mapped.periods), queryTime / mappedTime)
+    if list(queried.userIDs) != list(mapped.userIDs) or queried.periods != mapped.periods or (queried.counts != mapped.counts).nnz:
+      print "MISMATCH between queried and snapshot activity"
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
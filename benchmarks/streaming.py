@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+  Compares peak RSS and time-to-first-byte of buffered (stream=0) and streamed (stream=1) listing responses.
+  Each measurement runs in a fresh process so peak RSS isn't shared between runs.
+  Usage (from the repository root, with config.txt and redis available):
+    python benchmarks/streaming.py <topicid>
+"""
+
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import common
+
+LIMITS = [50, 500, 1000]
+
+def measure(url):
+  """
+  Requests url through the Flask test client, returning TTFB, total time and RSS growth.
+  """
+  import server
+  client = server.app.test_client()
+  startRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  start = time.time()
+  response = client.get(url, buffered=False)
+  chunks = iter(response.response)
+  firstChunk = next(chunks)
+  ttfb = time.time() - start
+  size = len(firstChunk) + sum(len(chunk) for chunk in chunks)
+  response.close()
+  total = time.time() - start
+  peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return {'ttfb': ttfb, 'total': total, 'bytes': size, 'rss_kb': peakRSS - startRSS}
+
+def main(topicID):
+  for limit in LIMITS:
+    for stream in ['0', '1']:
+      url = '/topics/%d/posts?limit=%d&stream=%s' % (topicID, limit, stream)
+      output = subprocess.check_output([sys.executable, __file__, '--measure', url], cwd=common.ROOT)
+      result = json.loads(output.strip().splitlines()[-1])
+      print "%-45s ttfb %8.2f ms  total %8.2f ms  peak rss +%6d KB  %8d bytes" % (url, result['ttfb'] * 1000, result['total'] * 1000, result['rss_kb'], result['bytes'])
+
+if __name__ == '__main__':
+  if len(sys.argv) == 3 and sys.argv[1] == '--measure':
+    print json.dumps(measure(sys.argv[2]))
+  elif len(sys.argv) == 2:
+    main(int(sys.argv[1]))
+  else:
+    print __doc__
+    sys.exit(1)
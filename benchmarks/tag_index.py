@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+  Compares tag queries in SQL against the in-process bitmap tag index.
+  Builds a SQLite topics and tags_topics table with skewed tag popularity, then times fetching the 50 most recently
+  posted-in topics for 1-, 3- and 5-tag queries each way, plus building, saving and re-loading the index.
+  Usage: python benchmarks/tag_index.py [numTopics]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+
+import common
+import tagindex
+
+NUM_TAGS = 300
+PAGE_SIZE = 50
+
+# (include any, require all, exclude) tag ids. Low ids are the popular tags.
+QUERIES = [
+  ("1 tag", [1], [], []),
+  ("3 tags", [1, 2], [], [3]),
+  ("5 tags", [1, 5], [2], [3, 4])
+]
+
+def build(numTopics):
+  db = sqlite3.connect(':memory:')
+  db.execute("CREATE TABLE topics (ll_topicid INTEGER PRIMARY KEY, lastPostTime INT)")
+  db.execute("CREATE TABLE tags_topics (tag_id INT, topic_id INT, PRIMARY KEY (tag_id, topic_id))")
+  topics = []
+  tags = []
+  for topicID in xrange(1, numTopics + 1):
+    topics.append((topicID, random.randint(1000000000, 1400000000)))
+    for tagID in set([min(int(random.paretovariate(0.8)), NUM_TAGS) for i in range(random.randint(1, 5))]):
+      tags.append((tagID, topicID))
+  db.executemany("INSERT INTO topics VALUES (?, ?)", topics)
+  db.executemany("INSERT INTO tags_topics VALUES (?, ?)", tags)
+  db.execute("CREATE INDEX topic_tags ON tags_topics (topic_id, tag_id)")
+  db.execute("CREATE INDEX last_post ON topics (lastPostTime, ll_topicid)")
+  db.commit()
+  return db
+
+def sqlPage(db, include, require, exclude):
+  clauses = []
+  params = []
+  subquery = "SELECT topic_id FROM tags_topics WHERE tag_id IN (%s)"
+  if include:
+    clauses.append("ll_topicid IN (" + subquery % ", ".join(["?"] * len(include)) + ")")
+    params.extend(include)
+  for tagID in require:
+    clauses.append("ll_topicid IN (" + subquery % "?" + ")")
+    params.append(tagID)
+  if exclude:
+    clauses.append("ll_topicid NOT IN (" + subquery % ", ".join(["?"] * len(exclude)) + ")")
+    params.extend(exclude)
+  sql = "SELECT ll_topicid FROM topics WHERE " + " AND ".join(clauses) + " ORDER BY lastPostTime DESC, ll_topicid DESC LIMIT ?"
+  return [row[0] for row in db.execute(sql, params + [PAGE_SIZE])]
+
+def main(numTopics):
+  db = build(numTopics)
+  conn = common.SqliteConn(db)
+  path = os.path.join(tempfile.mkdtemp(), "tagindex.bin")
+
+  buildTime, built = common.timed(lambda: tagindex.TagIndex(path, refreshInterval=None).build(conn).save(), repeat=1)
+  common.report("build and save %d topics" % numTopics, buildTime)
+  loadTime, loaded = common.timed(lambda: tagindex.TagIndex(path, refreshInterval=None).load(), repeat=1)
+  common.report("load from file", loadTime)
+
+  for label, include, require, exclude in QUERIES:
+    sqlTime, sqlTopics = common.timed(lambda: sqlPage(db, include, require, exclude))
+    firstTime, firstTopics = common.timed(lambda: loaded.topics(conn, include=include, require=require, exclude=exclude, limit=PAGE_SIZE), repeat=1)
+    indexTime, indexTopics = common.timed(lambda: loaded.topics(conn, include=include, require=require, exclude=exclude, limit=PAGE_SIZE))
+    common.report("SQL, %s" % label, sqlTime)
+    common.report("index (first, decoding), %s" % label, firstTime)
+    common.report("index, %s" % label, indexTime)
+    if sqlTopics != indexTopics or sqlTopics != firstTopics:
+      print "MISMATCH between SQL and index for", label
+  os.unlink(path)
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""
+  Compares hydrating users one at a time with User.load() against UserList.load().
+  Usage: python benchmarks/user_hydration.py
+"""
+
+import common
+import eti
+from dbquery import Query
+
+SIZES = [10, 1000, 10000]
+
+def main():
+  db = common.connect()
+  counter = common.QueryCounter(db)
+  for size in SIZES:
+    userIDs = [int(userID) for userID in Query("users").fields("id").order("id ASC").limit(size).list(db, valField='id')]
+
+    counter.reset()
+    singleTime, singleUsers = common.timed(lambda: [eti.User(db, userID).load() for userID in userIDs], repeat=1)
+    common.report("User.load() x %d" % len(userIDs), singleTime, counter.count)
+
+    counter.reset()
+    bulkTime, bulkUsers = common.timed(lambda: eti.UserList(db, userIDs).load(), repeat=1)
+    common.report("UserList.load() x %d" % len(userIDs), bulkTime, counter.count)
+
+    if [user.dict() for user in singleUsers] != [user.dict() for user in bulkUsers]:
+      print "MISMATCH between User.load() and UserList.load() at", size
+  db.close()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+  Read-through cache of serialized API objects for the ETI unofficial API.
+  An in-process LRU tier sits in front of a shared redis tier.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+"""
+
+import collections
+import json
+import threading
+import time
+
+from dbquery import Query
+
+class LRUCache(object):
+  '''
+  Bounded in-process cache whose entries expire after a TTL.
+  '''
+  def __init__(self, size=1000, ttl=30):
+    self.size = size
+    self.ttl = ttl
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    """
+    Returns (found, value).
+    """
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        return False, None
+      expires, value = entry
+      if expires < time.time():
+        return False, None
+      self._entries[key] = entry
+      return True, value
+
+  def set(self, key, value, ttl=None):
+    ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (time.time() + ttl, value)
+      while len(self._entries) > self.size:
+        self._entries.popitem(last=False)
+
+  def delete(self, key):
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+class ObjectCache(object):
+  '''
+  Read-through cache of serialized objects, keyed by kind (e.g. 'post') and id.
+  Lookups try the local LRU, then redis, then call the loader and store its result in both tiers.
+  Each kind has its own TTL. The local tier never holds an entry for longer than localTTL, which bounds how
+  long other workers can serve an object after it has been invalidated.
+  Variants of an object, such as its sparse fieldsets, are keyed under the object's generation, which invalidate()
+  moves on, so they're dropped with it without being listed anywhere.
+  If redis is unreachable, lookups fall through to the loader.
+  '''
+  def __init__(self, redis, ttls=None, defaultTTL=300, localSize=1000, localTTL=30, prefix='cache/'):
+    self.redis = redis
+    self.ttls = ttls if ttls is not None else {}
+    self.defaultTTL = defaultTTL
+    self.prefix = prefix
+    self.local = LRUCache(size=localSize, ttl=localTTL)
+    self._stats = collections.defaultdict(int)
+    self._statsLock = threading.Lock()
+
+  def key(self, kind, key):
+    return self.prefix + kind + '/' + unicode(key)
+
+  def generationKey(self, kind, key):
+    return self.prefix + 'generation/' + kind + '/' + unicode(key)
+
+  def generation(self, kind, key):
+    """
+    Returns the generation of (kind, key): '0' until it's first invalidated, then the time it last was.
+    """
+    generationKey = self.generationKey(kind, key)
+    found, generation = self.local.get(generationKey)
+    if found:
+      return generation
+    try:
+      generation = self.redis.get(generationKey) or '0'
+    except Exception:
+      self._count(kind, 'redis_errors')
+      return '0'
+    self.local.set(generationKey, generation, ttl=self.ttl(kind))
+    return generation
+
+  def variantKey(self, kind, key, variant):
+    return self.key(kind, key) + '@' + self.generation(kind, key) + '?' + variant
+
+  def ttl(self, kind):
+    return self.ttls.get(kind, self.defaultTTL)
+
+  def get(self, kind, key, loader, variant=None):
+    """
+    Returns the cached value for (kind, key), or for its variant if one's given, calling loader() to produce it on a miss.
+    Exceptions raised by loader() propagate, and nothing is cached for them.
+    """
+    cacheKey = self.key(kind, key) if variant is None else self.variantKey(kind, key, variant)
+    found, value = self.local.get(cacheKey)
+    if found:
+      self._count(kind, 'local_hits')
+      return value
+
+    try:
+      serialized = self.redis.get(cacheKey)
+    except Exception:
+      self._count(kind, 'redis_errors')
+      serialized = None
+    if serialized is not None:
+      value = json.loads(serialized)
+      self.local.set(cacheKey, value, ttl=self.ttl(kind))
+      self._count(kind, 'redis_hits')
+      return value
+
+    self._count(kind, 'misses')
+    value = loader()
+    self.set(kind, key, value, variant=variant)
+    return value
+
+  def set(self, kind, key, value, variant=None):
+    cacheKey = self.key(kind, key) if variant is None else self.variantKey(kind, key, variant)
+    ttl = self.ttl(kind)
+    self.local.set(cacheKey, value, ttl=ttl)
+    try:
+      self.redis.setex(cacheKey, ttl, json.dumps(value))
+    except Exception:
+      self._count(kind, 'redis_errors')
+
+  def invalidate(self, kind, key):
+    """
+    Drops (kind, key) from this worker's LRU and from redis, and moves its generation on, orphaning its variants.
+    The generation expires with the variants it orphaned, since none can outlive the kind's TTL.
+    """
+    cacheKey = self.key(kind, key)
+    generationKey = self.generationKey(kind, key)
+    self.local.delete(cacheKey)
+    self.local.delete(generationKey)
+    try:
+      self.redis.delete(cacheKey)
+      self.redis.setex(generationKey, self.ttl(kind), repr(time.time()))
+    except Exception:
+      self._count(kind, 'redis_errors')
+    self._count(kind, 'invalidations')
+
+  def stats(self):
+    with self._statsLock:
+      stats = {}
+      for (kind, stat), count in self._stats.iteritems():
+        stats.setdefault(kind, {})[stat] = count
+    stats['local_entries'] = len(self.local)
+    return stats
+
+  def _count(self, kind, stat):
+    with self._statsLock:
+      self._stats[(kind, stat)] += 1
+
+class ChangeWatcher(object):
+  '''
+  Invalidates cached objects as their rows change in the database. Each source is (kind, table, id column, change
+  column, other columns), where the change column moves forward whenever the object does, like a topic's lastPostTime.
+  At most every interval seconds, rows whose change column has reached the newest value seen are read, and their
+  objects invalidated. Change columns have one-second resolution, so rows at the newest value are read again, skipping
+  the ones already seen; the other columns, like a topic's postCount, tell apart changes made within one second.
+  '''
+  def __init__(self, cache, sources, interval=10):
+    self.cache = cache
+    self.sources = sources
+    self.interval = interval
+    self._marks = {}
+    self._lastPoll = 0
+    self._lock = threading.Lock()
+
+  def poll(self, db):
+    """
+    Invalidates the objects changed since the last poll, if interval has passed. The first poll only finds where to start.
+    If another thread is already polling, returns at once.
+    """
+    if time.time() - self._lastPoll < self.interval or not self._lock.acquire(False):
+      return
+    try:
+      self._lastPoll = time.time()
+      for kind, table, idField, changeField, otherFields in self.sources:
+        if table not in self._marks:
+          self._marks[table] = (Query(table).fields(changeField).order(changeField + " DESC").limit(1).firstValue(db), None)
+        mark, seen = self._marks[table]
+        changeQuery = Query(table).fields(idField, changeField, *otherFields)
+        if mark is not None:
+          changeQuery = changeQuery.where((changeField + " >= %s", mark))
+        newSeen = set()
+        for row in changeQuery.list(db):
+          change = tuple([row[field] for field in [idField, changeField] + list(otherFields)])
+          if row[changeField] is None or (seen is not None and change in seen):
+            continue
+          if seen is not None:
+            self.cache.invalidate(kind, row[idField])
+          if mark is None or row[changeField] > mark:
+            mark = row[changeField]
+            newSeen = set()
+          if row[changeField] == mark:
+            newSeen.add(change)
+        if seen is not None and mark == self._marks[table][0]:
+          newSeen |= seen
+        self._marks[table] = (mark, newSeen)
+    finally:
+      self._lock.release()
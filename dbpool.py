@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+  Bounded, per-process database connection pool for the ETI unofficial API.
+  Works with DbConn objects, or any connection with a ping() method or a DB-API cursor (e.g. sqlite3).
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+"""
+
+import collections
+import contextlib
+import os
+import threading
+import time
+
+class PoolTimeoutError(Exception):
+  def __init__(self, pool):
+    super(PoolTimeoutError, self).__init__()
+    self.pool = pool
+  def __str__(self):
+    return "\n".join([
+      super(PoolTimeoutError, self).__str__(),
+      "Pool size: " + unicode(self.pool.size),
+      "Timeout: " + unicode(self.pool.timeout)
+      ])
+
+def pingConnection(db):
+  """
+  Default health check. Pings the MySQL connection underlying a DbConn (or a raw connection),
+  falling back to running a trivial query for connections without ping().
+  """
+  conn = getattr(db, 'conn', db)
+  try:
+    if hasattr(conn, 'ping'):
+      conn.ping()
+    else:
+      conn.cursor().execute("SELECT 1")
+  except Exception:
+    return False
+  return True
+
+def closeConnection(db):
+  try:
+    db.close()
+  except Exception:
+    pass
+
+class DbPool(object):
+  '''
+  Hands out at most size open connections, creating them lazily with connect().
+  Connections that have sat idle for longer than recycle seconds are health-checked on checkout,
+  and replaced if the check fails. Connections opened in a parent process are never handed out
+  in a forked child (e.g. gunicorn --preload), so each worker gets its own pool.
+  '''
+  def __init__(self, connect, size=2, timeout=10, recycle=60, ping=pingConnection, close=closeConnection):
+    self.connect = connect
+    self.size = size
+    self.timeout = timeout
+    self.recycle = recycle
+    self.ping = ping
+    self.close = close
+    self._cond = threading.Condition()
+    self._reset()
+
+  def _reset(self):
+    self._pid = os.getpid()
+    self._idle = collections.deque()
+    self._open = 0
+    self._stats = {
+      'checkouts': 0,
+      'waits': 0,
+      'wait_time': 0.0,
+      'max_wait_time': 0.0,
+      'timeouts': 0,
+      'connects': 0,
+      'reconnects': 0,
+      'discards': 0
+    }
+
+  def get(self):
+    """
+    Checks out a connection, blocking for up to timeout seconds if all of them are in use.
+    """
+    start = time.time()
+    with self._cond:
+      if self._pid != os.getpid():
+        # forked since the pool was used; the parent's connections aren't ours to share.
+        self._reset()
+      waited = False
+      while not self._idle and self._open >= self.size:
+        remaining = self.timeout - (time.time() - start)
+        if remaining <= 0:
+          self._stats['timeouts'] += 1
+          raise PoolTimeoutError(self)
+        waited = True
+        self._cond.wait(remaining)
+      if self._idle:
+        conn, lastUsed = self._idle.pop()
+      else:
+        conn = lastUsed = None
+        self._open += 1
+      waitTime = time.time() - start
+      self._stats['checkouts'] += 1
+      self._stats['wait_time'] += waitTime
+      self._stats['max_wait_time'] = max(self._stats['max_wait_time'], waitTime)
+      if waited:
+        self._stats['waits'] += 1
+
+    try:
+      if conn is None:
+        conn = self.connect()
+        self._count('connects')
+      elif self.recycle is not None and time.time() - lastUsed > self.recycle and not self.ping(conn):
+        self.close(conn)
+        conn = self.connect()
+        self._count('reconnects')
+    except:
+      self._release()
+      raise
+    return conn
+
+  def put(self, conn, discard=False):
+    """
+    Returns a checked-out connection. Discarded connections (e.g. ones left mid-query by an error) are closed instead.
+    """
+    if discard:
+      self.close(conn)
+      self._count('discards')
+      self._release()
+      return
+    with self._cond:
+      self._idle.append((conn, time.time()))
+      self._cond.notify()
+
+  @contextlib.contextmanager
+  def connection(self):
+    conn = self.get()
+    try:
+      yield conn
+    except:
+      self.put(conn, discard=True)
+      raise
+    self.put(conn)
+
+  def closeAll(self):
+    """
+    Closes every idle connection.
+    """
+    with self._cond:
+      while self._idle:
+        conn, lastUsed = self._idle.pop()
+        self.close(conn)
+        self._open -= 1
+      self._cond.notify_all()
+
+  def stats(self):
+    with self._cond:
+      stats = dict(self._stats)
+      stats.update({
+        'size': self.size,
+        'open': self._open,
+        'idle': len(self._idle),
+        'mean_wait_time': stats['wait_time'] / stats['checkouts'] if stats['checkouts'] else 0.0
+      })
+    return stats
+
+  def _count(self, stat):
+    with self._cond:
+      self._stats[stat] += 1
+
+  def _release(self):
+    with self._cond:
+      self._open -= 1
+      self._cond.notify()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+  Immutable SELECT query objects for the ETI unofficial API.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+"""
+
+import threading
+import weakref
+
+_locks = weakref.WeakKeyDictionary()
+_locksLock = threading.Lock()
+
+def connectionLock(db):
+  """
+  Returns the lock that serializes query building and execution on a DbConn.
+  """
+  with _locksLock:
+    lock = _locks.get(db)
+    if lock is None:
+      lock = _locks[db] = threading.RLock()
+  return lock
+
+class Query(object):
+  '''
+  Immutable description of a SELECT query.
+  Every builder method returns a new Query and leaves the original untouched, so a query can be built in stages and shared.
+  Executing a query replays it onto a DbConn's builder and runs it on a fresh cursor while holding that connection's lock.
+  Other queries therefore can't clobber it, and can safely run while its results are being iterated over.
+  '''
+  def __init__(self, table=None):
+    self._table = table
+    self._fields = ()
+    self._joins = ()
+    self._wheres = ()
+    self._matches = ()
+    self._group = None
+    self._order = None
+    self._start = None
+    self._limit = None
+
+  def _copy(self, **changes):
+    query = Query.__new__(Query)
+    query.__dict__.update(self.__dict__)
+    for attr in changes:
+      setattr(query, '_' + attr, changes[attr])
+    return query
+
+  def table(self, table):
+    return self._copy(table=table)
+
+  def fields(self, *fields):
+    return self._copy(fields=self._fields + fields)
+
+  def join(self, join, joinType="INNER"):
+    return self._copy(joins=self._joins + ((join, joinType),))
+
+  def where(self, *args, **kwargs):
+    # copy list values (IN clauses) so later changes to the caller's list can't leak in.
+    frozenKwargs = tuple((key, tuple(value) if isinstance(value, list) else value) for key, value in kwargs.iteritems())
+    return self._copy(wheres=self._wheres + ((args, frozenKwargs),))
+
+  def match(self, fields, query):
+    return self._copy(matches=self._matches + ((tuple(fields), query),))
+
+  def group(self, group):
+    return self._copy(group=group)
+
+  def order(self, order):
+    return self._copy(order=order)
+
+  def start(self, start):
+    return self._copy(start=int(start))
+
+  def limit(self, limit):
+    return self._copy(limit=int(limit))
+
+  def _build(self, db):
+    db.table(self._table)
+    if self._fields:
+      db.fields(*self._fields)
+    for join, joinType in self._joins:
+      db.join(join, joinType=joinType)
+    for args, kwargs in self._wheres:
+      db.where(*args, **dict((key, list(value) if isinstance(value, tuple) else value) for key, value in kwargs))
+    for fields, query in self._matches:
+      db.match(list(fields), query)
+    if self._group is not None:
+      db.group(self._group)
+    if self._order is not None:
+      db.order(self._order)
+    if self._start is not None:
+      db.start(self._start)
+    if self._limit is not None:
+      db.limit(self._limit)
+    return db
+
+  def query(self, db):
+    """
+    Runs this query on db, returning a cursor of its own.
+    """
+    with connectionLock(db):
+      return self._build(db).query(newCursor=True)
+
+  def firstRow(self, db):
+    query = self if self._limit is not None else self.limit(1)
+    for row in query.query(db):
+      return row
+    return None
+
+  def firstValue(self, db):
+    row = self.firstRow(db)
+    if not row:
+      return None
+    return row.values()[0]
+
+  def list(self, db, valField=None):
+    if valField is None:
+      return [row for row in self.query(db)]
+    return [row[valField] for row in self.query(db)]
+
+  def dict(self, db, keyField, valField=None):
+    if valField is None:
+      return dict((row[keyField], row) for row in self.query(db))
+    return dict((row[keyField], row[valField]) for row in self.query(db))
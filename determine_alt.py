@@ -1,9 +1,14 @@
+import activity
+import altpool
+import altscore
 import eti
 import configobj
 import DbConn
 import datetime
 import pytz
 import random
+import snapshot
+import sys
 
 import numpy
 import scipy
@@ -37,20 +42,28 @@ def dict_corr(a, b):
       [a.get(x, 0) for x in keys],
       [b.get(x, 0) for x in keys])[0, 1]
 
+# days of activity are counted in this time zone when reading from a snapshot; the database's FROM_UNIXTIME is assumed to use it too.
+activity_timezone = pytz.timezone('America/Chicago')
+
 config = configobj.ConfigObj(infile=open('/home/shaldengeki/llAnimuBot/config.txt', 'r'))
-db = DbConn.DbConn(username=config['DB']['llBackup']['username'], password=config['DB']['llBackup']['password'], database=config['DB']['llBackup']['name'])
+
+# read posts, topics and users from a columnar snapshot (see snapshot.py) if a directory is given, rather than llBackup.
+archive = snapshot.Snapshot(sys.argv[1]) if len(sys.argv) > 1 else None
+if archive is None:
+  db = DbConn.DbConn(username=config['DB']['llBackup']['username'], password=config['DB']['llBackup']['password'], database=config['DB']['llBackup']['name'])
 
 # assemble a list of topics.
 sat_db = DbConn.DbConn(username=config['DB']['llAnimu']['username'], password=config['DB']['llAnimu']['password'], database=config['DB']['llAnimu']['name'])
-sats = [eti.Topic(db, topic_id).load() for topic_id in sat_db.table('sats').fields('ll_topicid').where(completed=1).order('ll_topicid ASC').list(valField='ll_topicid')]
+sat_ids = sat_db.table('sats').fields('ll_topicid').where(completed=1).order('ll_topicid ASC').list(valField='ll_topicid')
+sats = [archive.topic(topic_id) if archive is not None else eti.Topic(db, topic_id).load() for topic_id in sat_ids]
 
 # assemble a dict of all users and their post counts in each SAT.
 users = {}
 for sat in sats:
-  sat_post_counts = sat.users
+  sat_post_counts = archive.topicUsers(sat.id) if archive is not None else sat.users
   for post_count in sat_post_counts:
     if post_count['user'].id not in users:
-      users[post_count['user'].id] = {'user': post_count['user'].load(), 'posts': {sat.id: post_count['posts']}}
+      users[post_count['user'].id] = {'user': post_count['user'], 'posts': {sat.id: post_count['posts']}}
     else:
       users[post_count['user'].id]['posts'][sat.id] = post_count['posts']
 
@@ -59,59 +72,20 @@ for user_id in users:
 
 filtered_users = [user_id for user_id in users if users[user_id]['total_posts'] >= min_user_posts]
 
-# construct day-by-day and week-by-week post counts for each user.
-user_daily_posts = {}
-for user_id in users:
-  posts = db.table('posts').fields("FROM_UNIXTIME(date, '%%Y-%%m-%%d') AS new_date", "COUNT(*) AS count").where(userid=user_id).group('new_date').order('new_date ASC').dict(keyField='new_date', valField='count')
-  user_daily_posts[user_id] = sorted([(datetime.datetime.strptime(time_string, '%Y-%m-%d').date(), posts[time_string]) for time_string in posts], key=lambda x: x[0])
-
-user_weekly_posts = {}
-for user_id in users:
-  posts = db.table('posts').fields("FROM_UNIXTIME(date, '%%Y-%%U') AS new_date", "COUNT(*) AS count").where(userid=user_id).group('new_date').order('new_date ASC').dict(keyField='new_date', valField='count')
-  user_weekly_posts[user_id] = sorted([(datetime.datetime.strptime(time_string + '-0', '%Y-%U-%w').date(), posts[time_string]) for time_string in posts], key=lambda x: x[0])
-
-for alt_id in alts:
-  alt_dates = {daily_tuple[0]: daily_tuple[1] for daily_tuple in user_weekly_posts[alt_id]}
-  alt_started = min(alt_dates.keys())
-
-  alt_similarities = []
-  for user_id in filtered_users:
-    # for each user, get this user's mean activity right up to the point that the alt started posting.
-    user_similarities = [user_id]
-    user_priors = []
-    user_posteriors = []
-    user_coincide_posteriors = []
-    for post_tuple in user_weekly_posts[user_id]:
-      if post_tuple[0] < alt_started:
-        # this is prior to the alt starting posting.
-        # restrict this analysis to N months on either side of alt_started.
-        if alt_started - post_tuple[0] < alt_started_window_radius:
-          user_priors.append(post_tuple[1])
-      else:
-        # this is after the alt started posting.
-        if post_tuple[0] in alt_dates:
-          user_coincide_posteriors.append((post_tuple[1], alt_dates[post_tuple[0]]))
-          if post_tuple[0] - alt_started < alt_started_window_radius:
-          # only append this to the posteriors if it's within the window radius.
-            total_sum = post_tuple[1] + alt_dates[post_tuple[0]]
-            user_posteriors.append(total_sum)
-    if len(user_priors) < 2 or not user_posteriors:
-      # user started posting after this alt. skip them.
-      # print "User ID",user_id,"has less than two posts on at least one side of this window. Skipping."
-      continue
-    user_prior_mean = float(sum(user_priors)) / len(user_priors)
-    user_prior_stdev = numpy.std(user_priors)
-    # user_posterior_stdev = numpy.std(user_posteriors)
-    user_posterior_mean = float(sum(user_posteriors)) / len(user_posteriors)
-    user_posterior_change = user_posterior_mean - user_prior_mean
-    user_posterior_change_normed = user_posterior_change / user_prior_stdev
-    # user_posterior_change_normed_alt = user_posterior_change / user_posterior_stdev
-    user_similarities.extend([user_posterior_change,user_posterior_change_normed])
-    # now find correlation between these two users' post vectors.
-    user_correlation = scipy.stats.pearsonr(*zip(*user_coincide_posteriors))[0]
-    user_similarities.append(user_correlation)
-    # finally, append this row of similarities.
-    alt_similarities.append(user_similarities)
+# construct day-by-day and week-by-week post counts for each user, in one grouped pass over posts.
+if archive is not None:
+  daily_activity = archive.activity(userIDs=users.keys(), timezone=activity_timezone)
+else:
+  daily_activity = activity.ActivityMatrix.load(db, userIDs=users.keys())
+weekly_activity = daily_activity.weekly()
+user_daily_posts = {user_id: daily_activity.series(user_id) for user_id in users}
+user_weekly_posts = {user_id: weekly_activity.series(user_id) for user_id in users}
+
+# score every filtered user against each alt: how much their activity changed when the alt started posting, and how
+# closely it tracked the alt's afterwards. alts are fanned out across cores, sharing one memory-mapped activity matrix.
+alt_scorer = altscore.AltScorer(weekly_activity, filtered_users, windowRadius=alt_started_window_radius)
+with altpool.AltPool(alt_scorer) as alt_pool:
+  alt_similarities = alt_pool.rows([alt_id for alt_id, main_id in alts])
 
 for user_id in users:
   # get time in UTC
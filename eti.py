@@ -7,15 +7,28 @@
 """
 
 import __builtin__
+import array
+import base64
+import bisect
 import collections
+import itertools
 import json
+import os
 import pytz
+import threading
+import time
+
+from dbquery import Query
+import postsearch
+
+POSTS_PER_PAGE = 50
 
 def getBuiltIn(name):
   return getattr(__builtin__, name)
 
 def recursiveSerialize(item):
-  resultDict = {}
+  if isinstance(item, BaseObject):
+    return item.dict()
   try:
     items = item.__dict__.iteritems()
   except AttributeError:
@@ -24,6 +37,10 @@ def recursiveSerialize(item):
     except AttributeError:
       # we've passed in a scalar. just return it.
       return item
+  return serializeItems(items)
+
+def serializeItems(items):
+  resultDict = {}
   for k,v in items:
     if isinstance(v, BaseObject):
       v = v.dict()
@@ -47,7 +64,7 @@ class InvalidTopicError(Exception):
       ])
 
 class InvalidUserError(Exception):
-  def __init__(self, topic):
+  def __init__(self, user):
     super(InvalidUserError, self).__init__()
     self.user = user
   def __str__(self):
@@ -93,19 +110,505 @@ class InvalidTagError(Exception):
       "Tag Title: " + unicode(self.tag.name)
       ])
 
+class InvalidCursorError(Exception):
+  def __init__(self, cursor):
+    super(InvalidCursorError, self).__init__()
+    self.cursor = cursor
+  def __str__(self):
+    return "\n".join([
+      super(InvalidCursorError, self).__str__(),
+      "Cursor: " + unicode(self.cursor)
+      ])
+
+class InvalidFieldError(Exception):
+  def __init__(self, field):
+    super(InvalidFieldError, self).__init__()
+    self.field = field
+  def __str__(self):
+    return "\n".join([
+      super(InvalidFieldError, self).__str__(),
+      "Field: " + unicode(self.field)
+      ])
+
+def nullKey(value):
+  """
+  Returns a keyset value for use in a cursor, with NULL as 0.
+  """
+  return 0 if value is None else value
+
+def pageNumber(ordinal):
+  """
+  Returns the page a post is on, given the number of posts preceding it in its topic.
+  """
+  return int(ordinal * 1.0 / POSTS_PER_PAGE) + 1
+
+class TopicOrdinals(object):
+  '''
+  Sorted post IDs of a single topic. A post's position in them is its ordinal.
+  '''
+  def __init__(self):
+    self.ids = array.array('l')
+
+  @property
+  def maxID(self):
+    return self.ids[-1] if self.ids else 0
+
+  def extend(self, postIDs):
+    for postID in postIDs:
+      if postID > self.maxID:
+        self.ids.append(postID)
+
+  def ordinal(self, postID):
+    """
+    Returns the number of posts in this topic with an ID lower than postID.
+    """
+    return bisect.bisect_left(self.ids, postID)
+
+  def __contains__(self, postID):
+    position = bisect.bisect_left(self.ids, postID)
+    return position < len(self.ids) and self.ids[position] == postID
+
+class PostOrdinalIndex(object):
+  '''
+  In-process index mapping each post to its position within its topic, so page lookups are a keyed read.
+  Archived posts are never renumbered, so a topic's post IDs are fetched once and then only extended
+  with newer posts, when a lookup asks for a post past the last known one. That assumes posts are ingested in
+  ll_messageid order within a topic. Whatever ingests one out of order should call add(); failing that, a lookup of a
+  post below a topic's last known one that the index doesn't hold refetches the topic.
+  '''
+  def __init__(self, maxTopics=500):
+    self.maxTopics = maxTopics
+    self._topics = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def __contains__(self, topicID):
+    return topicID in self._topics
+
+  def add(self, topicID, postID):
+    """
+    Records a newly-ingested post. Posts past a topic's last known one are left to be fetched on demand; one before it
+    shifts every later position, so the topic is refetched when it's next needed.
+    """
+    with self._lock:
+      topicOrdinals = self._topics.get(topicID)
+      if topicOrdinals is not None and postID < topicOrdinals.maxID and postID not in topicOrdinals:
+        del self._topics[topicID]
+
+  def invalidate(self, topicID):
+    with self._lock:
+      self._topics.pop(topicID, None)
+
+  def ordinal(self, db, topicID, postID):
+    """
+    Returns the number of posts in topicID that precede postID.
+    """
+    with self._lock:
+      topicOrdinals = self._topics.pop(topicID, None)
+      if topicOrdinals is not None:
+        self._topics[topicID] = topicOrdinals
+    if topicOrdinals is not None and postID < topicOrdinals.maxID and postID not in topicOrdinals:
+      # ingested out of order, without add(); everything after it has moved.
+      self.invalidate(topicID)
+      topicOrdinals = None
+    if topicOrdinals is None or postID > topicOrdinals.maxID:
+      topicOrdinals = self._fetch(db, topicID, topicOrdinals)
+    return topicOrdinals.ordinal(postID)
+
+  def page(self, db, topicID, postID):
+    return pageNumber(self.ordinal(db, topicID, postID))
+
+  def cachedPage(self, topicID, postID):
+    """
+    Returns the page of postID if its topic is indexed and holds it, or None, without fetching anything.
+    """
+    with self._lock:
+      topicOrdinals = self._topics.pop(topicID, None)
+      if topicOrdinals is None:
+        return None
+      self._topics[topicID] = topicOrdinals
+      if postID not in topicOrdinals:
+        return None
+      return pageNumber(topicOrdinals.ordinal(postID))
+
+  def _fetch(self, db, topicID, topicOrdinals):
+    """
+    Fetches the post IDs in topicID that are newer than the ones already indexed.
+    """
+    afterID = topicOrdinals.maxID if topicOrdinals is not None else 0
+    newIDs = Query("posts").fields("ll_messageid").where("ll_messageid > " + str(int(afterID)), ll_topicid=str(int(topicID))).order("ll_messageid ASC").list(db, valField='ll_messageid')
+    with self._lock:
+      topicOrdinals = self._topics.pop(topicID, None) or topicOrdinals or TopicOrdinals()
+      topicOrdinals.extend([int(postID) for postID in newIDs])
+      self._topics[topicID] = topicOrdinals
+      while len(self._topics) > self.maxTopics:
+        self._topics.popitem(last=False)
+    return topicOrdinals
+
+postOrdinals = PostOrdinalIndex()
+
+class CurrentNameIndex(object):
+  '''
+  In-process projection of each user's current (most recent) name, used in place of joining user_names against itself.
+  Users' names are fetched in batches the first time they're looked up, and the least recently looked-up users are
+  evicted past maxUsers. After that, name changes are pulled in incrementally: at most every refreshInterval seconds
+  (never, if it's None), user_names rows dated at or after the newest one a refresh has seen are applied. Rows share
+  dates to the second, so the ones already seen at that date are remembered and skipped.
+  '''
+  def __init__(self, refreshInterval=60, maxUsers=200000):
+    self.refreshInterval = refreshInterval
+    self.maxUsers = maxUsers
+    self._names = collections.OrderedDict()
+    self._highWater = None
+    # (user id, name) of the rows seen dated at the high water mark.
+    self._highWaterRows = set()
+    self._lastRefresh = 0
+    self._lock = threading.Lock()
+
+  def add(self, userID, name, date):
+    """
+    Records a name row, keeping it only if it's newer than the name already known for userID.
+    """
+    with self._lock:
+      current = self._names.get(userID)
+      if current is None or current[0] is None or (date is not None and date >= current[0]):
+        self._names[userID] = (date, name)
+
+  def _advance(self, userID, name, date):
+    """
+    Moves the high water mark up to a row's date, if it's newer. Call while holding the lock.
+    """
+    if date is None:
+      return
+    if self._highWater is None or date > self._highWater:
+      self._highWater = date
+      self._highWaterRows = set()
+    if date == self._highWater:
+      self._highWaterRows.add((userID, name))
+
+  def names(self, db, userIDs):
+    """
+    Returns a dict mapping each of userIDs to its current name. Users without any names are left out.
+    """
+    self.refresh(db)
+    userIDs = set([int(userID) for userID in userIDs])
+    with self._lock:
+      missingIDs = [str(userID) for userID in userIDs if userID not in self._names]
+    if missingIDs:
+      dbNames = Query("user_names").fields("user_id", "name", "date").where(user_id=missingIDs).list(db)
+      with self._lock:
+        for userID in missingIDs:
+          self._names.setdefault(int(userID), (None, None))
+      for name in dbNames:
+        self.add(int(name['user_id']), name['name'], name['date'])
+    currentNames = {}
+    with self._lock:
+      for userID in userIDs:
+        # move each user looked up to the most recently used end.
+        date, name = self._names.pop(userID, (None, None))
+        self._names[userID] = (date, name)
+        if name is not None:
+          currentNames[userID] = name
+      while len(self._names) > self.maxUsers:
+        self._names.popitem(last=False)
+    return currentNames
+
+  def refresh(self, db, force=False):
+    """
+    Applies names added since the newest one seen, if refreshInterval has passed.
+    """
+    now = time.time()
+    if not force and (self.refreshInterval is None or now - self._lastRefresh < self.refreshInterval):
+      return
+    self._lastRefresh = now
+    if self._highWater is None:
+      # rows at this date are read again by the next refresh, which is harmless: applying a row twice changes nothing.
+      self._highWater = Query("user_names").fields("MAX(date) AS date").firstValue(db)
+      return
+    for name in Query("user_names").fields("user_id", "name", "date").where(("date >= %s", self._highWater)).list(db):
+      userID = int(name['user_id'])
+      with self._lock:
+        if name['date'] == self._highWater and (userID, name['name']) in self._highWaterRows:
+          continue
+        self._advance(userID, name['name'], name['date'])
+      if userID in self._names:
+        self.add(userID, name['name'], name['date'])
+
+  def setNames(self, db, rows, userField='userid'):
+    """
+    Sets the name field of each row to the current name of the user in its userField.
+    """
+    currentNames = self.names(db, [row[userField] for row in rows if row.get(userField) is not None])
+    for row in rows:
+      if row.get(userField) is not None and int(row[userField]) in currentNames:
+        row['name'] = currentNames[int(row[userField])]
+    return rows
+
+currentNames = CurrentNameIndex()
+
+class TagGraph(object):
+  '''
+  In-process copy of every tag and the dependent, forbidden, related and staff edges between them, so that tag
+  lookups don't each run a query. It's loaded on first use. After that, at most every refreshInterval seconds (never,
+  if it's None), tags with ids past the highest one seen are added and the edge tables, which are small, are re-read.
+  A tag looked up by a name the graph doesn't have is re-read, which picks up renames; deleted tags stay until the
+  process restarts.
+  '''
+  def __init__(self, refreshInterval=60):
+    self.refreshInterval = refreshInterval
+    self._tags = {}
+    self._ids = {}
+    self._dependencies = {}
+    self._forbiddens = {}
+    self._relateds = {}
+    self._staff = {}
+    self._maxID = None
+    self._lastRefresh = 0
+    self._lock = threading.Lock()
+
+  def tag(self, db, name):
+    """
+    Returns the tags row named name, or None if there isn't one.
+    Names not in the graph are looked up directly, so tags created since the last refresh are still found.
+    """
+    self.refresh(db)
+    tagID = self._ids.get(name)
+    if tagID is not None:
+      return self._tags[tagID]
+    dbTag = Query("tags").where(name=str(name)).firstRow(db)
+    if dbTag:
+      self.addTag(dbTag)
+    return dbTag
+
+  def name(self, db, tagID):
+    self.refresh(db)
+    tag = self._tags.get(int(tagID))
+    return tag['name'] if tag is not None else None
+
+  def dependencies(self, db, tagID):
+    self.refresh(db)
+    return self._dependencies.get(int(tagID), [])
+
+  def forbiddens(self, db, tagID):
+    self.refresh(db)
+    return self._forbiddens.get(int(tagID), [])
+
+  def relateds(self, db, tagID):
+    self.refresh(db)
+    return self._relateds.get(int(tagID), [])
+
+  def staff(self, db, tagID):
+    """
+    Returns (role, user id) pairs for tagID's staff.
+    """
+    self.refresh(db)
+    return self._staff.get(int(tagID), [])
+
+  def addTag(self, dbTag):
+    with self._lock:
+      tagID = int(dbTag['id'])
+      old = self._tags.get(tagID)
+      if old is not None and self._ids.get(old['name']) == tagID:
+        del self._ids[old['name']]
+      self._tags[tagID] = dbTag
+      self._ids[dbTag['name']] = tagID
+      if self._maxID is None or tagID > self._maxID:
+        self._maxID = tagID
+
+  def refresh(self, db, force=False):
+    """
+    Loads every tag if none have been, or otherwise pulls in new ones, then re-reads the edges, if refreshInterval has passed.
+    """
+    now = time.time()
+    if self._maxID is not None and not force and (self.refreshInterval is None or now - self._lastRefresh < self.refreshInterval):
+      return
+    self._lastRefresh = now
+    if self._maxID is None:
+      tags = Query("tags").list(db)
+      self._maxID = 0
+    else:
+      tags = Query("tags").where(("id > %s", self._maxID)).list(db)
+    for tag in tags:
+      self.addTag(tag)
+    self.loadEdges(db)
+
+  def loadEdges(self, db):
+    dependencies = self.edges(Query("tags_dependent").fields("child_tag_id", "parent_tag_id").list(db), 'child_tag_id', 'parent_tag_id')
+    forbiddens = self.edges(Query("tags_forbidden").fields("tag_id", "forbidden_tag_id").list(db), 'tag_id', 'forbidden_tag_id')
+    relateds = self.edges(Query("tags_related").fields("child_tag_id", "parent_tag_id").list(db), 'child_tag_id', 'parent_tag_id')
+    staff = collections.defaultdict(list)
+    for row in Query("tags_users").fields("tag_id", "user_id", "role").list(db):
+      staff[int(row['tag_id'])].append((int(row['role']), int(row['user_id'])))
+    with self._lock:
+      self._dependencies = dependencies
+      self._forbiddens = forbiddens
+      self._relateds = relateds
+      self._staff = dict(staff)
+
+  def edges(self, rows, fromField, toField):
+    edges = collections.defaultdict(list)
+    for row in rows:
+      edges[int(row[fromField])].append(int(row[toField]))
+    return dict([(tagID, sorted(set(toIDs))) for tagID, toIDs in edges.iteritems()])
+
+tagGraph = TagGraph()
+
+# built by running postsearch.py from cron; workers only load it and index the posts made since.
+POST_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "postindex.bin")
+postIndex = postsearch.PostIndex(POST_INDEX_FILE)
+
+class IdentityMap(object):
+  '''
+  Holds at most one model object per class and id, so that rows sharing a topic or user share one object for it.
+  Lists keep one for as long as they live, which for the API server is a single request.
+  '''
+  def __init__(self):
+    self._objects = {}
+
+  def fetch(self, cls, db, id):
+    """
+    Returns (the cls object for id, whether it was just created and still needs populating).
+    """
+    key = (cls, id)
+    obj = self._objects.get(key)
+    if obj is not None:
+      return obj, False
+    obj = self._objects[key] = cls(db, id)
+    return obj, True
+
+def wantsField(fields, key, attr):
+  """
+  Returns whether attr of the object at key (None for the object itself) is among fields, as returned by sparseFields().
+  """
+  return fields.get(key) is None or attr in fields[key]
+
+def fieldSlots(dbFields, *attrs):
+  """
+  Returns the __slots__ for a model class: the attributes its dbFields map onto, plus attrs.
+  """
+  return tuple(sorted(set([attr for typeName, attr in dbFields.itervalues()]).union(attrs)))
+
 class BaseObject(object):
   '''
   Base object with common features.
+  Model subclasses are slotted. Their row converters and serialized attributes are worked out once per class, and
+  read and written through the slots' member descriptors, which also keeps Tag's auto-loading __getattr__ out of the way.
   '''
+  __slots__ = ()
   dbFields = {}
+  # the key this class's objects are side-loaded under in normalized responses, if they are.
+  collection = None
+  # columns selected even when only some fields are requested, because relations, cursors or hydration need them.
+  requiredColumns = ()
   def __str__(self):
     return str(self.dict())
 
-  def dict(self):
+  @classmethod
+  def converters(cls):
+    """
+    Returns (row field, slot descriptor, converter) triples for this class's dbFields.
+    """
+    converters = cls.__dict__.get('_converters')
+    if converters is None:
+      converters = cls._converters = [(dbField, getattr(cls, attr), getBuiltIn(typeName)) for dbField, (typeName, attr) in cls.dbFields.iteritems()]
+    return converters
+
+  @classmethod
+  def nestedClasses(cls):
+    """
+    Returns the classes of the objects this class nests, keyed by the attribute they're nested under.
+    """
+    return {}
+
+  @classmethod
+  def sparseFields(cls, names, includes=None):
+    """
+    Parses requested field names, like ['id', 'date', 'user.name'], into a dict mapping None (for this class's own
+    attributes) or the attribute of an included object to the set of its attributes requested.
+    Raises InvalidFieldError for a field that isn't in its class's dbFields, or belongs to an object not in includes.
+    """
+    includes = includes if includes is not None else []
+    nestedClasses = cls.nestedClasses()
+    fields = {}
+    for name in names:
+      prefix, attr = name.split('.', 1) if '.' in name else (None, name)
+      fieldClass = cls if prefix is None else nestedClasses.get(prefix) if prefix in includes else None
+      if fieldClass is None or attr not in [fieldAttr for typeName, fieldAttr in fieldClass.dbFields.itervalues()]:
+        raise InvalidFieldError(name)
+      fields.setdefault(prefix, set()).add(attr)
+    return fields
+
+  @classmethod
+  def columns(cls, table, attrs=None, required=(), known=()):
+    """
+    Returns the columns of table to select for attrs of this class (all of them, if attrs is None) and the required
+    columns. Attributes in known are left out, for when the row has them already.
+    """
+    if attrs is None:
+      return [table + '.*']
+    columns = set(required)
+    columns.update([dbField for dbField, (typeName, attr) in cls.dbFields.iteritems() if attr in attrs and attr not in known])
+    return [table + '.' + column for column in sorted(columns)]
+
+  @classmethod
+  def serializedSlots(cls):
+    """
+    Returns (attribute, slot getter, scalar) triples for this class's public attributes, where scalar is true for
+    attributes set from dbFields, whose values never need serializing themselves.
+    Returns None for unslotted subclasses (like the lists), which keep their attributes in __dict__.
+    """
+    if '_serializedSlots' not in cls.__dict__:
+      if any(['__slots__' not in klass.__dict__ for klass in cls.__mro__[:-1]]):
+        cls._serializedSlots = None
+      else:
+        names = [name for klass in cls.__mro__ for name in klass.__dict__.get('__slots__', ())]
+        scalars = set([attr for typeName, attr in cls.dbFields.itervalues()])
+        cls._serializedSlots = [(name, getattr(cls, name).__get__, name in scalars) for name in names if name != 'db' and not name.startswith('_')]
+    return cls._serializedSlots
+
+  def dict(self, included=None, memo=None):
     """
     Filters out all non-serializable attributes of this object.
+    Nested objects with a collection (topics and users) are serialized once each per memo, a dict the caller keeps
+    across the objects it serializes together. With included, they're replaced by their ids instead, and added to
+    included under their collection, keyed by id.
     """
-    return recursiveSerialize(self)
+    serializedSlots = self.serializedSlots()
+    if serializedSlots is None:
+      return serializeItems(self.__dict__.iteritems())
+    resultDict = {}
+    for name, get, scalar in serializedSlots:
+      try:
+        value = get(self)
+      except AttributeError:
+        continue
+      if not scalar:
+        if isinstance(value, BaseObject):
+          if value.collection is None:
+            value = value.dict(included, memo)
+          elif included is not None:
+            value.sideLoad(included)
+            name, value = name + '_id', value.id
+          elif memo is not None:
+            serialized = memo.get(id(value))
+            if serialized is None:
+              serialized = memo[id(value)] = value.dict(memo=memo)
+            value = serialized
+          else:
+            value = value.dict()
+        elif isinstance(value, list):
+          value = [recursiveSerialize(x) for x in value]
+        elif isinstance(value, dict):
+          value = recursiveSerialize(value)
+      resultDict[name] = value
+    return resultDict
+
+  def sideLoad(self, included):
+    """
+    Adds this object's serialization to included, unless it's already there.
+    """
+    collection = included.setdefault(self.collection, {})
+    if self.id not in collection:
+      collection[self.id] = self.dict(included)
 
   def set(self, attrDict):
     """
@@ -119,14 +622,10 @@ class BaseObject(object):
     """
       Sets attributes of this object with database fields found in dict, translated into object attributes using dbFields.
     """
-    translatedDict = {}
-    for dbField in attrDict:
-      if dbField in self.dbFields:
-        if attrDict[dbField] is None:
-          translatedDict[self.dbFields[dbField][1]] = None
-        else:
-          translatedDict[self.dbFields[dbField][1]] = getBuiltIn(self.dbFields[dbField][0])(attrDict[dbField])
-    self.set(translatedDict)
+    for dbField, slot, convert in self.converters():
+      if dbField in attrDict:
+        value = attrDict[dbField]
+        slot.__set__(self, None if value is None else convert(value))
     return self
 
 class Post(BaseObject):
@@ -139,6 +638,8 @@ class Post(BaseObject):
     'messagetext': ('unicode', 'html'),
     'sig': ('unicode', 'sig')
   }
+  __slots__ = fieldSlots(dbFields, 'db', 'topic', 'user', 'page', '_topicUser')
+  requiredColumns = ('ll_messageid', 'll_topicid', 'userid', 'date')
   def __init__(self, db, id):
     self.db = db
     self.id = id
@@ -159,39 +660,77 @@ class Post(BaseObject):
   def __eq__(self, post):
     return self.id == post.id
 
-  def setDB(self, attrDict):
+  @classmethod
+  def nestedClasses(cls):
+    return {'topic': Topic, 'user': User}
+
+  def setDB(self, attrDict, identities=None):
+    """
+    Sets this post's attributes, topic and user from a post row, joined with its topic and user rows if they were included.
+    Topics and users already in identities are reused as they are.
+    """
     if 'sig' in attrDict:
       attrDict['sig'] = attrDict['sig'] if attrDict['sig'] != 'False' else None
-    postTopic = Topic(self.db, int(attrDict['ll_topicid']))
-    postUser = User(self.db, int(attrDict['userid']))
+    if identities is None:
+      identities = IdentityMap()
+    postTopic, newTopic = identities.fetch(Topic, self.db, int(attrDict['ll_topicid']))
+    postUser, newUser = identities.fetch(User, self.db, int(attrDict['userid']))
+    if newTopic:
+      # the row's userid is this post's author, and the topic's shared between posts, so skip Topic.setDB(); dict()
+      # gives each post's topic its user instead.
+      BaseObject.setDB(postTopic, attrDict)
+    if newUser:
+      postUser.setDB(attrDict)
     self.set({
-      'topic': postTopic.setDB(attrDict),
-      'user': postUser.setDB(attrDict)
+      'topic': postTopic,
+      'user': postUser
     })
     return super(Post, self).setDB(attrDict)
 
-  def load(self, includes=None):
+  def dict(self, included=None, memo=None):
+    """
+    As BaseObject.dict(). Posts have always nested their author as their topic's user too, unless a sparse fieldset
+    for the topic leaves it out; normalized responses side-load topics without it.
+    """
+    resultDict = super(Post, self).dict(included, memo)
+    if 'topic' in resultDict and 'user' in resultDict and getattr(self, '_topicUser', True):
+      # the topic's serialization can be shared with other posts, so this post's gets a copy.
+      resultDict['topic'] = dict(resultDict['topic'], user=resultDict['user'])
+    return resultDict
+
+  def omitTopicUser(self):
+    self._topicUser = False
+    return self
+
+  def load(self, includes=None, fields=None):
     """
     Fetches post info.
+    fields, as returned by sparseFields(), restricts the columns fetched to the ones its fields need.
     """
-    self.db.table("posts").fields("posts.*").where(ll_messageid=self.id)
+    fields = fields if fields is not None else {}
+    postQuery = Query("posts").fields(*self.columns('posts', fields.get(None), required=self.requiredColumns)).where(ll_messageid=self.id)
     if includes is not None:
       for obj in includes:
         if obj == 'topic':
-          self.db.fields('topics.*')
-          self.db.join('topics ON topics.ll_topicid=posts.ll_topicid')
+          topicColumns = Topic.columns('topics', fields.get('topic'), known=('id',))
+          if topicColumns:
+            postQuery = postQuery.fields(*topicColumns)
+            postQuery = postQuery.join('topics ON topics.ll_topicid=posts.ll_topicid')
         elif obj == 'user':
-          self.db.fields('users.*', 'user_names.name')
-          self.db.join('users ON users.id=posts.userid')
-          self.db.join('user_names ON user_names.user_id=users.id')
-          self.db.join('user_names un2 ON un2.user_id=users.id AND user_names.date < un2.date', joinType="LEFT OUTER")
-          self.db.where("un2.date IS NULL")
+          userColumns = User.columns('users', fields.get('user'), known=User.indexedFields)
+          if userColumns:
+            postQuery = postQuery.fields(*userColumns)
+            postQuery = postQuery.join('users ON users.id=posts.userid')
 
-    dbPost = self.db.firstRow(newCursor=True)
+    dbPost = postQuery.firstRow(self.db)
     if not dbPost:
       raise InvalidPostError(self)
+    if includes is not None and 'user' in includes and wantsField(fields, 'user', 'name'):
+      currentNames.setNames(self.db, [dbPost])
 
     self.setDB(dbPost)
+    if fields.get('topic') is not None:
+      self.omitTopicUser()
 
     # this needs to be after the topic is set.
     foo = self.getPage()
@@ -200,9 +739,7 @@ class Post(BaseObject):
   def getPage(self):
     if not hasattr(self, 'topic'):
       self.load()
-    # get number of posts in this topic up to this post.
-    numPosts = int(self.db.table("posts").fields("COUNT(*)").where("ll_messageid < " + str(int(self.id)), ll_topicid=str(self.topic.id)).firstValue(newCursor=True))
-    pageNum = int(numPosts * 1.0 / 50) + 1
+    pageNum = postOrdinals.page(self.db, self.topic.id, self.id)
     self.set({
       'page': pageNum
     })
@@ -212,9 +749,16 @@ class BaseList(BaseObject):
   '''
   Base list object for ETI unofficial API.
   '''
-  def __init__(self, db):
+  # (column, row field, object attribute) pairs that uniquely order this list, most significant first.
+  # Lists that define one can be paged by cursor, and are streamed in chunks by seeking rather than by offset.
+  keyset = None
+  def __init__(self, db, identities=None):
     self.db = db
+    # the topics and users built for this list's items, shared between items.
+    self._identities = identities if identities is not None else IdentityMap()
     self._table = self._user = self._topic = self._order = None
+    self._after = self._before = None
+    self._fields = {}
     self._start = 0
     self._limit = 50
   def user(self, user):
@@ -232,48 +776,255 @@ class BaseList(BaseObject):
   def limit(self, limit):
     self._limit = int(limit)
     return self
-  def search(self, query=None):
-    self.db.table(self._table)
+  def after(self, cursor):
+    """
+    Restricts this list to items following the one cursor was made from.
+    """
+    self._after = self.decodeCursor(cursor)
+    return self
+  def before(self, cursor):
+    """
+    Restricts this list to items preceding the one cursor was made from.
+    """
+    self._before = self.decodeCursor(cursor)
+    return self
+  def cursor(self, item):
+    """
+    Returns an opaque cursor pointing at item, for use with after() and before().
+    NULL values are encoded as 0, which sorts with them at the low end of the keyset order.
+    """
+    return base64.urlsafe_b64encode(json.dumps([nullKey(getattr(item, attr)) for column, field, attr in self.keyset]))
+  def nextCursor(self, lastItem, count):
+    """
+    Returns the cursor for the page following one that ended with lastItem and held count items, or None if there isn't one.
+    """
+    if self.keyset is None or lastItem is None or count < self._limit:
+      return None
+    return self.cursor(lastItem)
+  def decodeCursor(self, cursor):
+    if self.keyset is None:
+      raise InvalidCursorError(cursor)
+    try:
+      values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeEncodeError):
+      raise InvalidCursorError(cursor)
+    if not isinstance(values, list) or len(values) != len(self.keyset) or not all(value is None or isinstance(value, (int, long)) for value in values):
+      raise InvalidCursorError(cursor)
+    return [nullKey(value) for value in values]
+  def keysetOrder(self, ascending=False):
+    direction = " ASC" if ascending else " DESC"
+    return ", ".join([column + direction for column, field, attr in self.keyset])
+  def seek(self, listQuery, values, ascending=False):
+    """
+    Restricts listQuery to rows strictly past the given keyset values, in keyset order.
+    A sort value of 0 stands for NULL, which MySQL sorts before every value ascending, and after them descending.
+    """
+    (sortColumn, sortField, sortAttr), (idColumn, idField, idAttr) = self.keyset
+    comparison = ">" if ascending else "<"
+    if values[0] == 0:
+      if ascending:
+        return listQuery.where(("((" + sortColumn + " IS NULL AND " + idColumn + " > %s) OR " + sortColumn + " IS NOT NULL)", values[1]))
+      return listQuery.where((sortColumn + " IS NULL AND " + idColumn + " < %s", values[1]))
+    # the leading inclusive bound on the sort column is redundant, but lets MySQL range-scan the index instead of filtering every row.
+    clause = sortColumn + " " + comparison + "= %s AND (" + sortColumn + " " + comparison + " %s OR " + idColumn + " " + comparison + " %s)"
+    if not ascending:
+      clause = "((" + clause + ") OR " + sortColumn + " IS NULL)"
+    return listQuery.where((clause, values[0], values[0], values[1]))
+  def select(self):
+    """
+    Returns the query selecting this list's rows.
+    """
+    listQuery = Query(self._table)
     if self._user is not None:
-      self.db.where(userid=str(int(self._user.id)))
+      listQuery = listQuery.where((self._table + '.userid=%s', int(self._user.id)))
     if self._topic is not None:
-      self.db.where(ll_topicid=str(int(self._topic.id)))
-    if self._order is not None:
-      self.db.order(self._order)
-    self.db.start(self._start).limit(self._limit)
-    return self
+      listQuery = listQuery.where((self._table + '.ll_topicid=%s', int(self._topic.id)))
+    if self._after is not None:
+      listQuery = self.seek(listQuery, self._after).order(self.keysetOrder())
+    elif self._before is not None:
+      listQuery = self.seek(listQuery, self._before, ascending=True).order(self.keysetOrder(ascending=True))
+    elif self._order is not None:
+      listQuery = listQuery.order(self._order)
+    return listQuery.start(self._start).limit(self._limit)
+  def tagFilter(self, column, operator, tags):
+    """
+    Returns a where clause restricting column, a topic id, to be operator (IN or NOT IN) the topics carrying any of tags.
+    """
+    tagIDs = [int(tag.id) for tag in tags]
+    return (column + " " + operator + " (SELECT topic_id FROM tags_topics WHERE tag_id IN (" + ", ".join(["%s"] * len(tagIDs)) + "))",) + tuple(tagIDs)
+  def chunks(self, listQuery, chunkSize=100):
+    """
+    Yields the rows of listQuery within this list's start and limit, fetching at most chunkSize rows at a time.
+    Lists in keyset order seek past the previous chunk's last row instead of re-skipping an offset, so rows
+    inserted mid-stream can't be repeated or skipped. Other lists read their whole window from one query's cursor,
+    for the same reason.
+    """
+    seekable = self.keyset is not None and (self._after is not None or self._before is not None or self._order == self.keysetOrder())
+    if not seekable:
+      rows = iter(listQuery.query(self.db))
+      while True:
+        chunk = list(itertools.islice(rows, chunkSize))
+        if not chunk:
+          return
+        yield chunk
+    ascending = self._before is not None
+    chunkQuery = listQuery
+    fetched = 0
+    seenRows = []
+    while fetched < self._limit:
+      requested = min(chunkSize, self._limit - fetched)
+      rows = chunkQuery.limit(requested).list(self.db)
+      if rows:
+        chunkQuery = self.seek(listQuery.start(0), [int(nullKey(rows[-1][field])) for column, field, attr in self.keyset], ascending=ascending)
+      if ascending:
+        # pages before a cursor are fetched oldest-first; hand them back in list order.
+        seenRows.extend(rows)
+      elif rows:
+        yield rows
+      if len(rows) < requested:
+        break
+      fetched += len(rows)
+    if seenRows:
+      seenRows.reverse()
+      for offset in range(0, len(seenRows), chunkSize):
+        yield seenRows[offset:offset + chunkSize]
 
 class PostList(BaseList):
   '''
   Post list object for ETI unofficial API.
   '''
-  def __init__(self, db):
-    super(PostList, self).__init__(db)
+  keyset = (('posts.date', 'date', 'date'), ('posts.ll_messageid', 'll_messageid', 'id'))
+  def __init__(self, db, identities=None):
+    super(PostList, self).__init__(db, identities=identities)
     self._table = "posts"
-    self._order = "date DESC"
-  def search(self, query=None, includes=None):
-    super(PostList, self).search(query=query)
-    self.db.fields('posts.*')
+    self._order = self.keysetOrder()
+    self._tags = []
+    self._dateStart = self._dateEnd = None
+    self._query = None
+  def tags(self, tags):
+    """
+    Restricts this list to posts in topics carrying any of tags.
+    """
+    self._tags = tags
+    return self
+  def dates(self, start=None, end=None):
+    """
+    Restricts this list to posts made between the unix times start and end, inclusive.
+    """
+    self._dateStart = start
+    self._dateEnd = end
+    return self
+  def nextCursor(self, lastItem, count):
+    if self._query is not None:
+      # search results are ranked by relevance, which no keyset captures; they're paged by start instead.
+      return None
+    return super(PostList, self).nextCursor(lastItem, count)
+  def search(self, query=None, includes=None, fields=None):
+    return list(self.iterate(query=query, includes=includes, fields=fields, chunkSize=max(self._limit, 1)))
+
+  def iterate(self, query=None, includes=None, fields=None, chunkSize=100):
+    """
+    Returns a generator of matching posts, holding at most chunkSize of them in memory at a time.
+    With a query, posts containing all of its terms are found in the post index and ranked by relevance.
+    fields, as returned by Post.sparseFields(), restricts the columns fetched to the ones its fields need.
+    """
+    self._fields = fields if fields is not None else {}
+    postQuery = self.searchQuery(includes=includes)
+    self._query = query
+    if query is not None:
+      if self._after is not None or self._before is not None:
+        raise InvalidCursorError(None)
+      return self._iterateMatches(postQuery, query, includes, chunkSize)
+    return self._iterate(postQuery, includes, chunkSize)
+
+  def _iterate(self, postQuery, includes, chunkSize):
+    for rows in self.chunks(postQuery, chunkSize=chunkSize):
+      for post in self.hydrate(rows, includes=includes):
+        yield post
+
+  def _iterateMatches(self, postQuery, query, includes, chunkSize):
+    """
+    Ranks the matching posts up front, so that an unavailable index raises before any are yielded, then hydrates them.
+    """
+    topicIDs = None
+    if self._topic is not None:
+      topicIDs = set([int(self._topic.id)])
+    if self._tags:
+      tagTopicIDs = Query("tags_topics").fields("topic_id").where(tag_id=[str(int(tag.id)) for tag in self._tags]).list(self.db, valField='topic_id')
+      tagTopicIDs = set([int(topicID) for topicID in tagTopicIDs])
+      topicIDs = tagTopicIDs if topicIDs is None else topicIDs & tagTopicIDs
+    userIDs = [int(self._user.id)] if self._user is not None else None
+    matches = postIndex.search(self.db, query, topicIDs=topicIDs, userIDs=userIDs, start=self._dateStart, end=self._dateEnd, offset=self._start, limit=self._limit)
+    return self._hydrateMatches(postQuery, [postID for postID, score in matches], includes, chunkSize)
+
+  def _hydrateMatches(self, postQuery, postIDs, includes, chunkSize):
+    for offset in range(0, len(postIDs), chunkSize):
+      chunkIDs = postIDs[offset:offset + chunkSize]
+      chunkQuery = postQuery.where(ll_messageid=[str(postID) for postID in chunkIDs]).start(0).limit(len(chunkIDs))
+      rows = dict([(int(row['ll_messageid']), row) for row in chunkQuery.list(self.db)])
+      for post in self.hydrate([rows[postID] for postID in chunkIDs if postID in rows], includes=includes):
+        yield post
+
+  def hydrate(self, rows, includes=None):
+    """
+    Turns post rows into Posts, resolving includes and page numbers.
+    """
+    if includes is not None and 'user' in includes and wantsField(self._fields, 'user', 'name'):
+      currentNames.setNames(self.db, rows)
+    posts = [Post(self.db, post['ll_messageid']).setDB(post, identities=self._identities) for post in rows]
+    if self._fields.get('topic') is not None:
+      for post in posts:
+        post.omitTopicUser()
+    return self.getPages(posts)
+
+  def searchQuery(self, includes=None):
+    postQuery = self.select().fields(*Post.columns('posts', self._fields.get(None), required=Post.requiredColumns))
+    if self._tags:
+      postQuery = postQuery.where(self.tagFilter("posts.ll_topicid", "IN", self._tags))
+    if self._dateStart is not None:
+      postQuery = postQuery.where(("posts.date >= %s", int(self._dateStart)))
+    if self._dateEnd is not None:
+      postQuery = postQuery.where(("posts.date <= %s", int(self._dateEnd)))
     if includes is not None:
       for include in includes:
         if include == 'user':
-          self.db.fields('users.*', 'user_names.name')
-          self.db.join('users ON posts.userid=users.id')
-          self.db.join('user_names ON user_names.user_id=users.id')
-          self.db.join('user_names un2 ON un2.user_id=users.id AND user_names.date < un2.date', joinType="LEFT OUTER")
-          self.db.where("un2.date IS NULL")
+          userColumns = User.columns('users', self._fields.get('user'), known=User.indexedFields)
+          if userColumns:
+            postQuery = postQuery.fields(*userColumns)
+            postQuery = postQuery.join('users ON posts.userid=users.id')
         elif include == 'topic':
-          self.db.fields('topics.*')
-          self.db.join('topics ON posts.ll_topicid=topics.ll_topicid')
+          topicColumns = Topic.columns('topics', self._fields.get('topic'), known=('id',))
+          if topicColumns:
+            postQuery = postQuery.fields(*topicColumns)
+            postQuery = postQuery.join('topics ON posts.ll_topicid=topics.ll_topicid')
+    return postQuery
 
-    resultPosts = []
-    for post in self.db.query():
-      newPost = Post(self.db, post['ll_messageid'])
-      resultPosts.append(newPost.setDB(post))
-
-    # needs to be outside of the query() loop since getPage() pulls from the db
-    [post.getPage() for post in resultPosts]
-    return resultPosts
+  def getPages(self, posts):
+    """
+    Sets page numbers for a list of posts: from the post ordinal index for posts in topics it holds, and for the rest
+    by counting each post's predecessors in one grouped query, rather than fetching every topic they're in.
+    Matches what Post.getPage() would set on each post.
+    """
+    uncachedPosts = []
+    for post in posts:
+      page = postOrdinals.cachedPage(post.topic.id, post.id)
+      if page is None:
+        uncachedPosts.append(post)
+      else:
+        post.set({
+          'page': page
+        })
+    if not uncachedPosts:
+      return posts
+    postIDs = ",".join([str(int(post.id)) for post in uncachedPosts])
+    priorQuery = Query("posts").fields("posts.ll_messageid", "COUNT(prior.ll_messageid) AS prior_posts")
+    priorQuery = priorQuery.join("posts prior ON prior.ll_topicid=posts.ll_topicid AND prior.ll_messageid < posts.ll_messageid", joinType="LEFT OUTER")
+    priorCounts = priorQuery.where("posts.ll_messageid IN (" + postIDs + ")").group("posts.ll_messageid").dict(self.db, keyField='ll_messageid', valField='prior_posts')
+    for post in uncachedPosts:
+      post.set({
+        'page': pageNumber(int(priorCounts[post.id]))
+      })
+    return posts
 
 class Topic(BaseObject):
   '''
@@ -285,6 +1036,9 @@ class Topic(BaseObject):
     'postCount': ('int', 'post_count'),
     'lastPostTime': ('int', 'last_post_time')
   }
+  __slots__ = fieldSlots(dbFields, 'db', 'user', 'tags')
+  collection = 'topics'
+  requiredColumns = ('ll_topicid', 'userid', 'lastPostTime')
   def __init__(self, db, id):
     self.db = db
     self.id = id
@@ -306,20 +1060,29 @@ class Topic(BaseObject):
   def __eq__(self, topic):
     return self.id == topic.id
 
-  def setDB(self, attrDict):
+  def setDB(self, attrDict, identities=None):
     if 'userid' in attrDict:
-      topicUser = User(self.db, int(attrDict['userid']))
+      if identities is None:
+        identities = IdentityMap()
+      topicUser, newUser = identities.fetch(User, self.db, int(attrDict['userid']))
+      if newUser:
+        topicUser.setDB(attrDict)
       self.set({
-        'user': topicUser.setDB(attrDict)
+        'user': topicUser
       })
     return super(Topic, self).setDB(attrDict)
 
-  def load(self, includes=None):
+  @classmethod
+  def nestedClasses(cls):
+    return {'user': User}
+
+  def load(self, includes=None, fields=None):
     """
     Fetches topic info.
+    fields, as returned by sparseFields(), restricts the columns fetched to the ones its fields need.
     """
-
-    self.db.table("topics").fields('topics.*').where(ll_topicid=str(self.id))
+    fields = fields if fields is not None else {}
+    topicQuery = Query("topics").fields(*self.columns('topics', fields.get(None), required=self.requiredColumns)).where(ll_topicid=str(self.id))
 
     includeTags = False    
     if includes is not None:
@@ -327,15 +1090,16 @@ class Topic(BaseObject):
         if include == 'tags':
           includeTags = True
         elif include == 'user':
-          self.db.fields('users.*', 'user_names.name')
-          self.db.join('users ON users.id=topics.userid')
-          self.db.join('user_names ON user_names.user_id=users.id')
-          self.db.join('user_names un2 ON un2.user_id=users.id AND user_names.date < un2.date', joinType="LEFT OUTER")
-          self.db.where("un2.date IS NULL")
+          userColumns = User.columns('users', fields.get('user'), known=User.indexedFields)
+          if userColumns:
+            topicQuery = topicQuery.fields(*userColumns)
+            topicQuery = topicQuery.join('users ON users.id=topics.userid')
 
-    dbTopic = self.db.firstRow(newCursor=True)
+    dbTopic = topicQuery.firstRow(self.db)
     if not dbTopic:
       raise InvalidTopicError(self)
+    if includes is not None and 'user' in includes and wantsField(fields, 'user', 'name'):
+      currentNames.setNames(self.db, [dbTopic])
     self.setDB(dbTopic)
 
     if includeTags:
@@ -349,7 +1113,7 @@ class Topic(BaseObject):
     """
     Fetches topic tags.
     """
-    dbTopicTags = self.db.table("tags_topics").fields("name").join("tags ON tags.id = tags_topics.tag_id").where(topic_id=str(self.id)).order("name ASC").query()
+    dbTopicTags = Query("tags_topics").fields("name").join("tags ON tags.id = tags_topics.tag_id").where(topic_id=str(self.id)).order("name ASC").query(self.db)
     return [Tag(self.db, topic['name']) for topic in dbTopicTags]
 
   @property
@@ -357,28 +1121,32 @@ class Topic(BaseObject):
     """
     Fetches topic posts.
     """
-    dbTopicPosts = self.db.table("posts").where(ll_topicid=str(self.id)).order("ll_messageid ASC").query()
-    return [Post(self.db, int(dbPost['ll_messageid'])).setDB(dbPost) for dbPost in dbTopicPosts]
+    dbTopicPosts = Query("posts").where(ll_topicid=str(self.id)).order("ll_messageid ASC").query(self.db)
+    identities = IdentityMap()
+    return [Post(self.db, int(dbPost['ll_messageid'])).setDB(dbPost, identities=identities) for dbPost in dbTopicPosts]
 
   @property
   def users(self):
     """
     Fetches topic users.
     """
-    dbTopicUsers = self.db.fields("userid", "COUNT(*) AS count").table("posts").where(ll_topicid=str(self.id)).group("userid").order("count DESC").query()
-    return [{'user': User(self.db, int(dbUser['userid'])), 'posts': int(dbUser['count'])} for dbUser in dbTopicUsers]
+    dbTopicUsers = Query("posts").fields("userid", "COUNT(*) AS count").where(ll_topicid=str(self.id)).group("userid").order("count DESC").list(self.db)
+    topicUsers = UserList(self.db, [int(dbUser['userid']) for dbUser in dbTopicUsers]).load()
+    return [{'user': user, 'posts': int(dbUser['count'])} for user, dbUser in zip(topicUsers, dbTopicUsers)]
 
 class TopicList(BaseList):
   '''
   Topic list object for ETI unofficial API.
   '''
-  def __init__(self, db, tags=None, topics=None):
-    super(TopicList, self).__init__(db)
+  keyset = (('topics.lastPostTime', 'lastPostTime', 'last_post_time'), ('topics.ll_topicid', 'll_topicid', 'id'))
+  def __init__(self, db, tags=None, topics=None, identities=None):
+    super(TopicList, self).__init__(db, identities=identities)
     self._table = "topics"
     self._includeTags = []
     self._excludeTags = []
+    self._topics = None
     self._firstPost = True
-    self._order = "lastPostTime DESC"
+    self._order = self.keysetOrder()
     if tags is not None:
       self.tags(tags)
     if topics is not None:
@@ -393,47 +1161,113 @@ class TopicList(BaseList):
     self._includeTags = tags
     return self
   def topics(self, topics):
-    self._topics = topics
+    """
+    Restricts this list to the topics with the given ids, in the order given.
+    """
+    self._topics = [int(topicID) for topicID in topics]
     return self
   def firstPost(self, firstPost):
     self._firstPost = bool(firstPost)
     return self
-  def search(self, query=None, includes=None):
-    if self._includeTags:
-      includeTagIDs = [str(int(tag.id)) for tag in self._includeTags]
-    super(TopicList, self).search(query=query)
+  def decodeCursor(self, cursor):
+    if self._topics is not None:
+      # lists of given topics are ordered by their ids' position, which no keyset captures; page them by start instead.
+      raise InvalidCursorError(cursor)
+    return super(TopicList, self).decodeCursor(cursor)
+  def nextCursor(self, lastItem, count):
+    if self._topics is not None:
+      return None
+    return super(TopicList, self).nextCursor(lastItem, count)
+  def search(self, query=None, includes=None, fields=None):
+    return list(self.iterate(query=query, includes=includes, fields=fields, chunkSize=max(self._limit, 1)))
+
+  def iterate(self, query=None, includes=None, fields=None, chunkSize=100):
+    """
+    Returns a generator of matching topics, holding at most chunkSize of them in memory at a time.
+    Tags are resolved up front, so an InvalidTagError is raised here rather than mid-iteration.
+    fields, as returned by Topic.sparseFields(), restricts the columns fetched to the ones its fields need.
+    """
+    self._fields = fields if fields is not None else {}
+    topicQuery = self.searchQuery(query=query, includes=includes)
+    if self._topics is not None:
+      return self._iterateTopics(topicQuery, includes, chunkSize)
+    return self._iterate(topicQuery, includes, chunkSize)
+
+  def _iterate(self, topicQuery, includes, chunkSize):
+    for rows in self.chunks(topicQuery, chunkSize=chunkSize):
+      for topic in self.hydrate(rows, includes=includes):
+        yield topic
+
+  def _iterateTopics(self, topicQuery, includes, chunkSize):
+    """
+    Yields the given topics within this list's start and limit, fetching chunkSize of them per query and keeping their given order.
+    """
+    topicIDs = self._topics[self._start:self._start + self._limit]
+    for offset in range(0, len(topicIDs), chunkSize):
+      chunkIDs = topicIDs[offset:offset + chunkSize]
+      chunkQuery = topicQuery.where(ll_topicid=[str(topicID) for topicID in chunkIDs]).start(0).limit(len(chunkIDs))
+      rows = dict([(int(row['ll_topicid']), row) for row in chunkQuery.list(self.db)])
+      for topic in self.hydrate([rows[topicID] for topicID in chunkIDs if topicID in rows], includes=includes):
+        yield topic
+
+  def searchQuery(self, query=None, includes=None):
+    topicQuery = self.select().fields(*Topic.columns('topics', self._fields.get(None), required=Topic.requiredColumns))
+    # tag filters are subqueries, so they're applied before the limit and a topic with several included tags appears once.
     if self._includeTags:
-      self.db.table("tags_topics").fields('tags_topics.*').join("topics ON topics.ll_topicid=tags_topics.topic_id").where(tag_id=includeTagIDs)
-    self.db.fields('topics.*')
+      topicQuery = topicQuery.where(self.tagFilter("topics.ll_topicid", "IN", self._includeTags))
+    if self._excludeTags:
+      topicQuery = topicQuery.where(self.tagFilter("topics.ll_topicid", "NOT IN", self._excludeTags))
 
-    includeTags = False    
     if includes is not None:
       for include in includes:
-        if include == 'tags':
-          includeTags = True
-        elif include == 'user':
-          self.db.fields('users.*')
-          self.db.join('users ON userid=users.id')
+        if include == 'user':
+          userColumns = User.columns('users', self._fields.get('user'), known=User.indexedFields)
+          if userColumns:
+            topicQuery = topicQuery.fields(*userColumns)
+            topicQuery = topicQuery.join('users ON userid=users.id')
 
     if query is not None:
-      self.db.match(['topics.title'], query)
+      topicQuery = topicQuery.match(['topics.title'], query)
+    return topicQuery
 
-    resultTopics = []
-    topics = self.db.list()
-    for topic in topics:
-      newTopic = Topic(self.db, topic['ll_topicid']).setDB(topic)
-      if includes:
-        newTopic.load(includes=includes)
-      resultTopics.append(newTopic)
+  def hydrate(self, topics, includes=None):
+    """
+    Turns topic rows into Topics, resolving includes.
+    """
+    includes = includes if includes is not None else []
+    resultTopics = [Topic(self.db, topic['ll_topicid']).setDB(topic, identities=self._identities) for topic in topics]
 
-    if includeTags or self._excludeTags:
-      [topic.set({'tags': topic.getTags()}) for topic in resultTopics]
+    if 'user' in includes and wantsField(self._fields, 'user', 'name'):
+      self.loadUserNames(resultTopics)
+    if 'tags' in includes:
+      self.loadTags(resultTopics)
+    return resultTopics
 
-    if self._excludeTags:
-      [tag.load() for tag in self._excludeTags]
-      resultTopics = [topic for topic in resultTopics if not any([excludeTag in topic.tags for excludeTag in self._excludeTags])]
+  def loadUserNames(self, topics):
+    """
+    Sets the current name of each topic's creator, from the current name index.
+    """
+    userNames = currentNames.names(self.db, [topic.user.id for topic in topics if hasattr(topic, 'user')])
+    for topic in topics:
+      if hasattr(topic, 'user') and topic.user.id in userNames:
+        topic.user.setDB({'name': userNames[topic.user.id]})
+    return topics
 
-    return resultTopics
+  def loadTags(self, topics):
+    """
+    Sets the tags of each topic, with one query for all of them.
+    """
+    topicTags = dict([(topic.id, []) for topic in topics])
+    if not topicTags:
+      return topics
+    tagQuery = Query("tags_topics").fields("topic_id", "name").join("tags ON tags.id = tags_topics.tag_id").where(topic_id=[str(int(topicID)) for topicID in topicTags]).order("name ASC")
+    for tag in tagQuery.query(self.db):
+      topicTags[tag['topic_id']].append(Tag(self.db, tag['name']))
+    for topic in topics:
+      topic.set({
+        'tags': topicTags[topic.id]
+      })
+    return topics
 
 class User(BaseObject):
   '''
@@ -454,6 +1288,11 @@ class User(BaseObject):
     'picture': ('unicode', 'picture'),
     'status': ('int', 'status')
   }
+  __slots__ = fieldSlots(dbFields, 'db', 'names')
+  collection = 'users'
+  requiredColumns = ('id',)
+  # fields a nested user gets without joining the users table: its id from the row nesting it, its name from currentNames.
+  indexedFields = ('id', 'name')
   def __init__(self, db, id):
     self.db = db
     self.id = id
@@ -490,21 +1329,37 @@ class User(BaseObject):
       attrDict['name'] = attrDict['name'] if attrDict['name'] != 'NULL' else None
     return super(User, self).setDB(attrDict)
 
-  def load(self):
+  def load(self, fields=None):
     """
     Fetches user info.
+    fields, as returned by sparseFields(), restricts the columns fetched to the ones its fields need. The name
+    history is only fetched along with the name.
     """
+    fields = fields if fields is not None else {}
+    loadNames = wantsField(fields, None, 'name')
     if self.id == 0:
       # Anonymous user.
       dbUser = collections.defaultdict(int)
       names = [{'name': 'Human', 'date': None}]
     else:
-      dbUser = self.db.table("users").where(id=str(self.id)).firstRow(newCursor=True)
+      dbUser = Query("users").fields(*self.columns('users', fields.get(None), required=self.requiredColumns, known=('name',))).where(id=str(self.id)).firstRow(self.db)
       if not dbUser:
         raise InvalidUserError(self)
-      dbNames = self.db.table("user_names").where(user_id=str(self.id)).order("date DESC").query()
-      names = [{'name': name['name'], 'date': int(pytz.utc.localize(name['date']).strftime('%s'))} for name in dbNames if name['date'] is not None]
+      if loadNames:
+        dbNames = Query("user_names").where(user_id=str(self.id)).order("date DESC").query(self.db)
+        names = self.parseNames(dbNames)
     self.setDB(dbUser)
+    if loadNames:
+      self.setNames(names)
+    return self
+
+  def parseNames(self, dbNames):
+    return [{'name': name['name'], 'date': int(pytz.utc.localize(name['date']).strftime('%s'))} for name in dbNames if name['date'] is not None]
+
+  def setNames(self, names):
+    """
+    Sets this user's name history, and their current name from it.
+    """
     self.set({
       'names': names,
       'name': max(names, key=lambda x: x['date'])['name'] if names else u''
@@ -528,7 +1383,7 @@ class User(BaseObject):
     """
     Fetches user posts.
     """
-    dbUserPosts = self.db.table("posts").fields("ll_messageid").where(userid=str(self.id)).order("date DESC").query()
+    dbUserPosts = Query("posts").fields("ll_messageid").where(userid=str(self.id)).order("date DESC").query(self.db)
     return [Post(self.db, int(dbPost['ll_messageid'])) for dbPost in dbUserPosts]
 
   @property
@@ -536,9 +1391,46 @@ class User(BaseObject):
     """
     Fetches user topics.
     """
-    dbUserTopics = self.db.table("topics").fields("ll_topicid").where(userid=str(self.id)).order("lastPostTime DESC").query()
+    dbUserTopics = Query("topics").fields("ll_topicid").where(userid=str(self.id)).order("lastPostTime DESC").query(self.db)
     return [Topic(self.db, int(dbTopic['ll_topicid'])) for dbTopic in dbUserTopics]
 
+class UserList(BaseList):
+  '''
+  User list object for ETI unofficial API.
+  '''
+  def __init__(self, db, users=None):
+    super(UserList, self).__init__(db)
+    self._table = "users"
+    self._users = []
+    if users is not None:
+      self.users(users)
+  def users(self, userIDs):
+    self._users = [int(userID) for userID in userIDs]
+    return self
+  def load(self):
+    """
+    Fetches the listed users and their name histories in two queries, returning them in the order they were given.
+    Matches what User.load() would set on each user.
+    """
+    resultUsers = dict([(userID, User(self.db, userID)) for userID in self._users])
+    knownIDs = [str(userID) for userID in resultUsers if userID != 0]
+    dbUsers = {}
+    userNames = collections.defaultdict(list)
+    if knownIDs:
+      dbUsers = Query("users").where(id=knownIDs).dict(self.db, keyField='id')
+      for name in Query("user_names").where(user_id=knownIDs).order("date DESC").query(self.db):
+        userNames[int(name['user_id'])].append(name)
+
+    for userID in resultUsers:
+      if userID == 0:
+        resultUsers[userID].load()
+        continue
+      if userID not in dbUsers:
+        raise InvalidUserError(resultUsers[userID])
+      resultUsers[userID].setDB(dbUsers[userID])
+      resultUsers[userID].setNames(resultUsers[userID].parseNames(userNames[userID]))
+    return [resultUsers[userID] for userID in self._users]
+
 class Tag(BaseObject):
   '''
   Tag-loading object for ETI unofficial API.
@@ -552,6 +1444,7 @@ class Tag(BaseObject):
     'name': ('unicode', 'name'),
     'description': ('unicode', 'description')
   }
+  __slots__ = fieldSlots(dbFields, 'db', '_staff', '_dependents', '_forbiddens', '_relateds')
   def __init__(self, db, title):
     self.db = db
     self.name = title
@@ -579,9 +1472,9 @@ class Tag(BaseObject):
 
   def load(self):
     """
-    Fetches topic info.
+    Fetches tag info.
     """
-    dbTag = self.db.table("tags").where(name=str(self.name)).firstRow(newCursor=True)
+    dbTag = tagGraph.tag(self.db, self.name)
     if not dbTag:
       raise InvalidTagError(self)
     self.setDB(dbTag)
@@ -589,19 +1482,21 @@ class Tag(BaseObject):
     return self
 
   def getId(self):
-    tagID = self.db.table("tags").fields("id").where(name=str(self.name)).firstValue(newCursor=True)
-    if not tagID:
+    dbTag = tagGraph.tag(self.db, self.name)
+    if not dbTag:
       raise InvalidTagError(self)
-    return int(tagID)
+    return int(dbTag['id'])
 
   def getStaff(self):
     if not hasattr(self, 'id'):
       self.load()
-    dbTagStaff = self.db.table("tags_users").fields(*(["user_id", "role", 'users.*'])).join("users ON user_id = id").where(tag_id=self.id).order("role DESC, username ASC")
+    staff = tagGraph.staff(self.db, self.id)
+    # ordered by role, then username as MySQL collates it.
+    staffUsers = Query("users").where(id=[str(userID) for role, userID in staff]).order("username ASC").list(self.db) if staff else []
+    positions = dict([(int(user['id']), position) for position, user in enumerate(staffUsers)])
     resultStaff = []
-    for user in dbTagStaff.query():
-      newUser = User(self.db, user['user_id'])
-      resultStaff.append({"role": int(user['role']), "user": newUser.setDB(user)})
+    for role, userID in sorted([member for member in staff if member[1] in positions], key=lambda member: (-member[0], positions[member[1]])):
+      resultStaff.append({"role": role, "user": User(self.db, userID).setDB(staffUsers[positions[userID]])})
     return resultStaff
 
   @property
@@ -610,15 +1505,18 @@ class Tag(BaseObject):
       self._staff = self.getStaff()
     return self._staff
 
+  def tagsFromIDs(self, tagIDs):
+    resultTags = []
+    for tagID in tagIDs:
+      name = tagGraph.name(self.db, tagID)
+      if name is not None:
+        resultTags.append(Tag(self.db, name).load())
+    return resultTags
+
   def getDependencies(self):
     if not hasattr(self, 'id'):
       self.load()
-    dbDependencies = self.db.table("tags_dependent").fields("name").join("tags ON tags_dependent.parent_tag_id = tags.id").where(child_tag_id=str(self.id))
-    resultTags = []
-    for tag in dbDependencies.query():
-      newTag = Tag(self.db, tag['parent_tag_id'])
-      resultTags.append(newTag.setDB(tag))
-    return resultTags
+    return self.tagsFromIDs(tagGraph.dependencies(self.db, self.id))
 
   @property
   def dependent(self):
@@ -629,12 +1527,7 @@ class Tag(BaseObject):
   def getForbiddens(self):
     if not hasattr(self, 'id'):
       self.load()
-    dbForbiddens = self.db.table("tags_forbidden").fields("name").join("tags ON tags_forbidden.forbidden_tag_id = tags.id").where(tag_id=str(self.id))
-    resultTags = []
-    for tag in dbForbiddens.query():
-      newTag = Tag(self.db, tag['forbidden_tag_id'])
-      resultTags.append(newTag.setDB(tag))
-    return resultTags
+    return self.tagsFromIDs(tagGraph.forbiddens(self.db, self.id))
 
   @property
   def forbidden(self):
@@ -645,12 +1538,7 @@ class Tag(BaseObject):
   def getRelateds(self):
     if not hasattr(self, 'id'):
       self.load()
-    dbRelateds = self.db.table("tags_related").fields("name").join("tags ON tags_related.parent_tag_id = tags.id").where(child_tag_id=str(self.id))
-    resultTags = []
-    for tag in dbRelateds.query():
-      newTag = Tag(self.db, tag['parent_tag_id'])
-      resultTags.append(newTag.setDB(tag))
-    return resultTags
+    return self.tagsFromIDs(tagGraph.relateds(self.db, self.id))
 
   @property
   def related(self):
@@ -665,5 +1553,5 @@ class Tag(BaseObject):
     """
     if not hasattr(self, 'id'):
       self.load()
-    dbTagTopics = self.db.table("tags_topics").fields("topic_id").join("topics ON topics.ll_topicid = tags_topics.topic_id").where(tag_id=str(self.id)).order("topics.lastPostTime DESC").list("topic_id")
+    dbTagTopics = Query("tags_topics").fields("topic_id").join("topics ON topics.ll_topicid = tags_topics.topic_id").where(tag_id=str(self.id)).order("topics.lastPostTime DESC").list(self.db, "topic_id")
     return [Topic(self.db, int(topicID)) for topicID in dbTagTopics]
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""
+  Cooperative (gevent) serving mode for the ETI unofficial API.
+  Serves the same Flask app as server.py, but each request runs in a greenlet, so a worker keeps serving
+  other requests while one waits on MySQL, redis or the tagd socket. MySQLdb's C driver would block the whole
+  worker, so the pure-Python PyMySQL driver is installed in its place before DbConn is imported.
+  Uses gevent and PyMySQL.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import pymysql
+pymysql.install_as_MySQLdb()
+
+import server
+
+# greenlets share the worker's connection pool, so it needs to be larger than under sync workers.
+GEVENT_DB_POOL_SIZE = 20
+server.dbPool.size = GEVENT_DB_POOL_SIZE
+
+app = server.app
+
+if __name__ == '__main__':
+  from gevent.pywsgi import WSGIServer
+  WSGIServer(('127.0.0.1', 16723), app).serve_forever()
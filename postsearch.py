@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+  In-process inverted index over the text of posts, for ranked full-text post search.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  Posts are archived and never edited, so the index only ever grows: it pulls in posts past the highest
+  ll_messageid it's seen, in batches. Each term maps to parallel arrays of document numbers and term counts;
+  a post's document number is its position in the index, so postings stay sorted as posts are appended.
+
+  Workers never index the whole archive themselves. Running this module (from cron) loads the saved index, indexes
+  the posts made since and saves it again; workers memory-map that file, decoding each term's postings the first time
+  it's searched for, and only index the few posts made since it was saved.
+  Usage: python postsearch.py [path]
+"""
+
+import array
+import bisect
+import collections
+import heapq
+import HTMLParser
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from dbquery import Query
+
+TAG_PATTERN = re.compile(r'<[^>]*>')
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 40
+
+# Okapi BM25 parameters.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+FILE_MAGIC = 'POSTIDX1'
+FILE_HEADER = struct.Struct('=8sIQI')
+TERM_ENTRY = struct.Struct('=BQI')
+
+htmlParser = HTMLParser.HTMLParser()
+
+class IndexUnavailableError(Exception):
+  def __init__(self, path):
+    super(IndexUnavailableError, self).__init__()
+    self.path = path
+  def __str__(self):
+    return "\n".join([
+      super(IndexUnavailableError, self).__str__(),
+      "Path: " + unicode(self.path)
+      ])
+
+def stripHTML(html):
+  """
+  Returns the text of html, without its tags and with entities decoded.
+  """
+  if isinstance(html, str):
+    html = html.decode('utf-8', 'replace')
+  return htmlParser.unescape(TAG_PATTERN.sub(u' ', html))
+
+def tokenize(text):
+  return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) <= MAX_TERM_LENGTH]
+
+class Postings(object):
+  '''
+  Document numbers containing a term, ascending, with the term's count in each.
+  '''
+  __slots__ = ('docs', 'counts')
+  def __init__(self):
+    self.docs = array.array('i')
+    self.counts = array.array('H')
+
+  def count(self, doc):
+    position = bisect.bisect_left(self.docs, doc)
+    if position < len(self.docs) and self.docs[position] == doc:
+      return self.counts[position]
+    return 0
+
+class PostIndex(object):
+  '''
+  Inverted index of post text, with each post's topic, author, date and length kept alongside for filtering and ranking.
+  It's loaded from path, which build() and save() write. After that, at most every refreshInterval seconds (never, if
+  it's None), it's re-loaded if a newer file has replaced path, then up to batchSize posts past the highest ll_messageid
+  indexed are added.
+  '''
+  def __init__(self, path=None, refreshInterval=60, batchSize=1000):
+    self.path = path
+    self.refreshInterval = refreshInterval
+    self.batchSize = batchSize
+    self._terms = {}
+    self._directory = {}
+    self._map = None
+    self._postIDs = array.array('l')
+    self._topicIDs = array.array('i')
+    self._userIDs = array.array('i')
+    self._dates = array.array('l')
+    self._lengths = array.array('H')
+    self._totalLength = 0
+    self._lastRefresh = 0
+    self._ready = False
+    self._fileTime = None
+    self._lock = threading.RLock()
+    self._refreshLock = threading.Lock()
+
+  def __len__(self):
+    return len(self._postIDs)
+
+  @property
+  def highWater(self):
+    return self._postIDs[-1] if self._postIDs else 0
+
+  def postings(self, term, create=False):
+    """
+    Returns term's postings, decoding them from the index file if they haven't been. Without create, None if no post has term.
+    """
+    with self._lock:
+      postings = self._terms.get(term)
+      if postings is None:
+        if term in self._directory:
+          offset, count = self._directory.pop(term)
+          postings = Postings()
+          postings.docs.fromstring(self._map[offset:offset + postings.docs.itemsize * count])
+          offset += postings.docs.itemsize * count
+          postings.counts.fromstring(self._map[offset:offset + postings.counts.itemsize * count])
+        elif create:
+          postings = Postings()
+        else:
+          return None
+        self._terms[term] = postings
+      return postings
+
+  def add(self, postID, topicID, userID, date, html):
+    """
+    Indexes a post. Posts must be added in ll_messageid order; ones at or below the high-water mark are ignored.
+    """
+    terms = collections.Counter(tokenize(stripHTML(html or u'')))
+    with self._lock:
+      if postID <= self.highWater:
+        return
+      doc = len(self._postIDs)
+      self._postIDs.append(postID)
+      self._topicIDs.append(topicID)
+      self._userIDs.append(userID)
+      self._dates.append(date)
+      length = min(sum(terms.itervalues()), 65535)
+      self._lengths.append(length)
+      self._totalLength += length
+      for term, count in terms.iteritems():
+        postings = self.postings(term, create=True)
+        postings.docs.append(doc)
+        postings.counts.append(min(count, 65535))
+
+  def refresh(self, db, force=False):
+    """
+    Loads the index from path if it hasn't been or a newer file has replaced it, then indexes up to batchSize posts
+    added since, if refreshInterval has passed. Never indexes the whole archive; until path exists, there's nothing to refresh.
+    """
+    with self._refreshLock:
+      now = time.time()
+      if self._ready and not force and (self.refreshInterval is None or now - self._lastRefresh < self.refreshInterval):
+        return
+      self._lastRefresh = now
+      if self.path is not None:
+        try:
+          fileTime = os.stat(self.path).st_mtime
+        except OSError:
+          fileTime = None
+        if fileTime is not None and fileTime != self._fileTime:
+          self.load()
+      if not self._ready:
+        return
+      if self.addPosts(db) == self.batchSize:
+        # more are waiting; the next search takes the next batch, rather than this one waiting on all of them.
+        self._lastRefresh = 0
+
+  def addPosts(self, db):
+    """
+    Indexes up to batchSize posts past the high-water mark, returning how many there were.
+    """
+    posts = Query("posts").fields("ll_messageid", "ll_topicid", "userid", "date", "messagetext").where(("ll_messageid > %s", self.highWater)).order("ll_messageid ASC").limit(self.batchSize).list(db)
+    for post in posts:
+      self.add(int(post['ll_messageid']), int(post['ll_topicid']), int(post['userid']), int(post['date']), post['messagetext'])
+    return len(posts)
+
+  def build(self, db):
+    """
+    Indexes every post past the high-water mark: the whole archive for a new index, or the posts made since a loaded
+    file was saved. Run offline, by main(); workers only load() what it save()s.
+    """
+    while self.addPosts(db) == self.batchSize:
+      pass
+    self._ready = True
+    return self
+
+  def save(self, path=None):
+    """
+    Writes the index to path, replacing any previous file atomically. Each writer has its own temporary file, so
+    concurrent saves can't interleave.
+    """
+    path = path or self.path
+    with self._lock:
+      for term in list(self._directory):
+        self.postings(term)
+      terms = sorted(self._terms)
+      arrays = [self._postIDs, self._topicIDs, self._userIDs, self._dates, self._lengths]
+      header = FILE_HEADER.pack(FILE_MAGIC, len(self._postIDs), self._totalLength, len(terms))
+      offset = FILE_HEADER.size + sum([values.itemsize * len(values) for values in arrays])
+      offset += sum([TERM_ENTRY.size + len(term.encode('utf-8')) for term in terms])
+      descriptor, temporaryPath = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+      os.fchmod(descriptor, 0644)
+      with os.fdopen(descriptor, 'wb') as indexFile:
+        indexFile.write(header)
+        for values in arrays:
+          indexFile.write(values.tostring())
+        for term in terms:
+          encodedTerm = term.encode('utf-8')
+          postings = self._terms[term]
+          indexFile.write(TERM_ENTRY.pack(len(encodedTerm), offset, len(postings.docs)))
+          indexFile.write(encodedTerm)
+          offset += postings.docs.itemsize * len(postings.docs) + postings.counts.itemsize * len(postings.counts)
+        for term in terms:
+          indexFile.write(self._terms[term].docs.tostring())
+          indexFile.write(self._terms[term].counts.tostring())
+    os.rename(temporaryPath, path)
+
+  def load(self, path=None):
+    """
+    Maps the index file at path, reading its posts and term directory. Postings are decoded as they're searched for.
+    """
+    path = path or self.path
+    with open(path, 'rb') as indexFile:
+      fileTime = os.fstat(indexFile.fileno()).st_mtime
+      indexMap = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, numDocs, totalLength, numTerms = FILE_HEADER.unpack_from(indexMap, 0)
+    if magic != FILE_MAGIC:
+      raise ValueError("not a post index file: " + path)
+    position = FILE_HEADER.size
+    arrays = [array.array(typecode) for typecode in ('l', 'i', 'i', 'l', 'H')]
+    for values in arrays:
+      values.fromstring(indexMap[position:position + values.itemsize * numDocs])
+      position += values.itemsize * numDocs
+    directory = {}
+    for i in xrange(numTerms):
+      termLength, offset, count = TERM_ENTRY.unpack_from(indexMap, position)
+      position += TERM_ENTRY.size
+      directory[indexMap[position:position + termLength].decode('utf-8')] = (offset, count)
+      position += termLength
+    with self._lock:
+      self._map = indexMap
+      self._directory = directory
+      self._terms = {}
+      self._postIDs, self._topicIDs, self._userIDs, self._dates, self._lengths = arrays
+      self._totalLength = totalLength
+      self._lastRefresh = 0
+      self._ready = True
+      self._fileTime = fileTime
+    return self
+
+  def search(self, db, query, topicIDs=None, userIDs=None, start=None, end=None, offset=0, limit=50):
+    """
+    Returns (post id, score) pairs for posts containing every term in query, best match first.
+    Results can be restricted to posts in topicIDs, by userIDs, or dated between start and end (inclusive).
+    Raises IndexUnavailableError until the index file's been built.
+    """
+    self.refresh(db)
+    if not self._ready:
+      raise IndexUnavailableError(self.path)
+    terms = list(set(tokenize(stripHTML(query))))
+    if not terms:
+      return []
+    topicIDs = set(topicIDs) if topicIDs is not None else None
+    userIDs = set(userIDs) if userIDs is not None else None
+    with self._lock:
+      postings = [self.postings(term) for term in terms]
+      if not all(postings):
+        return []
+      postings.sort(key=lambda termPostings: len(termPostings.docs))
+      numDocs = len(self._postIDs)
+      averageLength = self._totalLength * 1.0 / numDocs
+      weights = [math.log(1 + (numDocs - len(termPostings.docs) + 0.5) / (len(termPostings.docs) + 0.5)) for termPostings in postings]
+      results = []
+      rarest = postings[0]
+      for position, doc in enumerate(rarest.docs):
+        if topicIDs is not None and self._topicIDs[doc] not in topicIDs:
+          continue
+        if userIDs is not None and self._userIDs[doc] not in userIDs:
+          continue
+        if (start is not None and self._dates[doc] < start) or (end is not None and self._dates[doc] > end):
+          continue
+        counts = [rarest.counts[position]]
+        for termPostings in postings[1:]:
+          count = termPostings.count(doc)
+          if not count:
+            break
+          counts.append(count)
+        else:
+          norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc] / averageLength)
+          score = sum([weight * count * (BM25_K1 + 1) / (count + norm) for weight, count in zip(weights, counts)])
+          results.append((score, self._postIDs[doc]))
+    # ties go to the newer post.
+    return [(postID, score) for score, postID in heapq.nlargest(offset + limit, results)[offset:]]
+
+def main(path):
+  import DbConn
+  with open("config.txt", 'r') as f:
+    username, password, database = f.readline().strip().split(',')
+  db = DbConn.DbConn(username, password, database)
+  index = PostIndex(path, batchSize=10000)
+  if os.path.exists(path):
+    index.load()
+  previousCount = len(index)
+  index.build(db)
+  index.save()
+  print "%d posts indexed, %d in %s" % (len(index) - previousCount, len(index), path)
+
+if __name__ == '__main__':
+  main(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "postindex.bin"))
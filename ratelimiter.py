@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+  Sliding-window request rate limiting for the ETI unofficial API, backed by redis.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  Each limited key (an endpoint and client, say) has a sorted set in redis holding the times of its hits in the
+  current window. One script call prunes the set, counts it, and records the hit if it's allowed, so every check is a
+  single atomic round trip, and there's no window edge for a client to burst across.
+"""
+
+import collections
+import hashlib
+import random
+import threading
+import time
+
+from redis.exceptions import NoScriptError
+
+import cache
+
+# KEYS[1]: the key's hit log. ARGV: now and window length in ms, limit, a unique member for this hit.
+# Returns {1 if the hit is allowed, hits in the window counting it, ms time the oldest of them leaves the window}.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+local allowed = 0
+if count < limit then
+  redis.call('ZADD', KEYS[1], now, ARGV[4])
+  count = count + 1
+  allowed = 1
+end
+redis.call('PEXPIRE', KEYS[1], window)
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+local reset = now + window
+if oldest[2] then
+  reset = tonumber(oldest[2]) + window
+end
+return {allowed, count, reset}
+"""
+
+class SlidingWindowLimiter(object):
+  '''
+  Allows each key at most limit hits in any per seconds. Turned-away hits aren't counted.
+  Keys found over their limit are remembered in a local LRU until their oldest hit leaves the window, since until then
+  they can't be allowed; their hits are turned away without a trip to redis.
+  If redis is unreachable, hits are allowed.
+  '''
+  def __init__(self, redis, localSize=10000, prefix='rate-limit/'):
+    self.redis = redis
+    self.prefix = prefix
+    self.scriptSHA = hashlib.sha1(SLIDING_WINDOW_SCRIPT).hexdigest()
+    # blocked keys, mapped to the unix time they're next allowed a hit.
+    self.blocked = cache.LRUCache(size=localSize, ttl=86400)
+    self._stats = collections.defaultdict(int)
+    self._statsLock = threading.Lock()
+
+  def hit(self, key, limit, per):
+    """
+    Records a hit on key if it's allowed. Returns (allowed, hits in the window, unix time the window's oldest hit expires).
+    """
+    now = time.time()
+    found, reset = self.blocked.get(key)
+    if found and reset > now:
+      self._count('local_rejections')
+      return False, limit, reset
+    nowMS = int(now * 1000)
+    try:
+      allowed, count, resetMS = self.run(self.prefix + key, nowMS, int(per * 1000), limit, "%d/%x" % (nowMS, random.getrandbits(48)))
+    except Exception:
+      self._count('redis_errors')
+      return True, 0, now + per
+    reset = resetMS / 1000.0
+    if not allowed:
+      self._count('redis_rejections')
+      self.blocked.set(key, reset, ttl=reset - now)
+    else:
+      self._count('allowed')
+    return bool(allowed), int(count), reset
+
+  def run(self, key, *args):
+    """
+    Runs the script by its SHA1, sending the script itself only when redis doesn't have it cached. Clients that can't
+    run scripts by SHA1 (like fakeredis) send it every time.
+    """
+    if hasattr(self.redis, 'evalsha'):
+      try:
+        return self.redis.evalsha(self.scriptSHA, 1, key, *args)
+      except NoScriptError:
+        pass
+    return self.redis.eval(SLIDING_WINDOW_SCRIPT, 1, key, *args)
+
+  def stats(self):
+    with self._statsLock:
+      stats = dict(self._stats)
+    stats['blocked_keys'] = len(self.blocked)
+    return stats
+
+  def _count(self, stat):
+    with self._statsLock:
+      self._stats[stat] += 1
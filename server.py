@@ -6,20 +6,31 @@
   Released under WTFPL <http://www.wtfpl.net/txt/copying>
 """
 
-from flask import Flask, request, jsonify, g, redirect, url_for, abort, render_template, flash
+from flask import Flask, request, jsonify, g, redirect, url_for, abort, render_template, flash, Response, stream_with_context
 import flask_login
+import calendar
+import collections
 import functools
+import hashlib
 import json
+import math
 import redis
-import socket
 import sys, os
+import threading
 import time
 import traceback
 import urllib2
 import urllib
 
 import DbConn
-from eti import InvalidTopicError, InvalidPostError, InvalidUserError, InvalidTagError, Topic, Post, User, TopicList, PostList, Tag
+import cache
+import dbpool
+import postsearch
+import ratelimiter
+import tagd
+import tagindex
+from dbquery import Query
+from eti import postIndex, InvalidTopicError, InvalidPostError, InvalidUserError, InvalidTagError, InvalidCursorError, InvalidFieldError, Topic, Post, User, TopicList, PostList, Tag
 
 # database, secret token config
 app = Flask(__name__)
@@ -33,27 +44,72 @@ LIMIT_REQUEST_NUM = 100
 LIMIT_REQUEST_SEC = 60
 redis = redis.StrictRedis(host='localhost', port=6379, db=0)
 
+# sliding-window rate limits in redis, with clients over their limit turned away locally until they're under it.
+RATE_LIMIT_LOCAL_SIZE = 10000
+rateLimiter = ratelimiter.SlidingWindowLimiter(redis, localSize=RATE_LIMIT_LOCAL_SIZE)
+
+# read-through cache of serialized objects, in seconds per kind.
+CACHE_TTLS = {
+  'post': 3600,
+  'topic': 60,
+  'user': 600,
+  'tag': 3600
+}
+CACHE_LOCAL_SIZE = 5000
+CACHE_LOCAL_TTL = 30
+objectCache = cache.ObjectCache(redis, ttls=CACHE_TTLS, localSize=CACHE_LOCAL_SIZE, localTTL=CACHE_LOCAL_TTL)
+
+# cached topics change when they're posted in, and users when they're renamed; every worker watches for both.
+# posts embed their topic and user too, but can't be found by either, so they're left to expire.
+CACHE_WATCH_INTERVAL = 10
+CACHE_WATCH_SOURCES = [
+  ('topic', 'topics', 'll_topicid', 'lastPostTime', ['postCount']),
+  ('user', 'user_names', 'user_id', 'date', ['name'])
+]
+cacheWatcher = cache.ChangeWatcher(objectCache, CACHE_WATCH_SOURCES, interval=CACHE_WATCH_INTERVAL)
+
+# per-worker database connection pool.
+DB_POOL_SIZE = 2
+DB_POOL_TIMEOUT = 10
+DB_POOL_RECYCLE = 60
+dbPool = dbpool.DbPool(lambda: DbConn.DbConn(app.config['MYSQL_USERNAME'], app.config['MYSQL_PASSWORD'], app.config['MYSQL_DB']), size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE)
+
+# pooled client for the tag -> topics daemon. set TAGD_FRAMED to True once the daemon speaks the framed protocol;
+# until then, it can only be asked for one tag's topics.
+TAGD_SOCKET = "/home/shaldengeki/tagd.sock"
+TAGD_FRAMED = False
+TAGD_POOL_SIZE = 4
+TAGD_TIMEOUT = 5
+tagdClient = tagd.TagdClient(TAGD_SOCKET, size=TAGD_POOL_SIZE, timeout=TAGD_TIMEOUT, framed=TAGD_FRAMED)
+
+# in-process tag -> topics bitmap index, which replaces tagd unless TAG_TOPICS_FROM_TAGD is set.
+# workers only load TAG_INDEX_FILE; it's rebuilt by running tagindex.py hourly, from cron.
+TAG_TOPICS_FROM_TAGD = False
+TAG_INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tagindex.bin")
+TAG_INDEX_REFRESH = 60
+tagIndex = tagindex.TagIndex(TAG_INDEX_FILE, refreshInterval=TAG_INDEX_REFRESH)
+
+# per-endpoint counts of conditional requests answered with a 304 (hits) or in full (misses).
+conditionalStats = collections.defaultdict(int)
+conditionalStatsLock = threading.Lock()
+
 # initialize flask-login
 login_manager = flask_login.LoginManager()
 login_manager.session_protection = "strong"
 login_manager.init_app(app)
 
 class RateLimit(object):
-  expiration_window = 10
-
-  def __init__(self, key_prefix, limit, per, send_x_headers):
-    self.reset = (int(time.time()) // per) * per + per
-    self.key = key_prefix + str(self.reset)
+  def __init__(self, key, limit, per, send_x_headers):
+    self.key = key
     self.limit = limit
     self.per = per
     self.send_x_headers = send_x_headers
-    p = redis.pipeline()
-    p.incr(self.key)
-    p.expireat(self.key, self.reset + self.expiration_window)
-    self.current = min(p.execute()[0], limit)
+    allowed, self.current, reset = rateLimiter.hit(key, limit, per)
+    # when the oldest request in the window expires, freeing a slot.
+    self.reset = int(math.ceil(reset))
+    self.over_limit = not allowed
 
   remaining = property(lambda x: x.limit - x.current)
-  over_limit = property(lambda x: x.current >= x.limit)
 
 def get_view_rate_limit():
   return getattr(g, '_view_rate_limit', None)
@@ -67,7 +123,7 @@ def ratelimit(limit, per=300, send_x_headers=True,
               key_func=lambda: request.endpoint):
   def decorator(f):
     def rate_limited(*args, **kwargs):
-      key = 'rate-limit/%s/%s/' % (key_func(), scope_func())
+      key = '%s/%s' % (key_func(), scope_func())
       rlimit = RateLimit(key, limit, per, send_x_headers)
       g._view_rate_limit = rlimit
       if over_limit is not None and rlimit.over_limit:
@@ -86,11 +142,108 @@ def inject_x_rate_headers(response):
     h.add('X-RateLimit-Reset', str(limit.reset))
   return response
 
+def count_conditional(endpoint, stat):
+  with conditionalStatsLock:
+    conditionalStats[(endpoint, stat)] += 1
+
+def conditional_stats():
+  with conditionalStatsLock:
+    stats = {}
+    for (endpoint, stat), count in conditionalStats.iteritems():
+      stats.setdefault(endpoint, {'hits': 0, 'misses': 0, 'unconditional': 0})[stat] = count
+  for endpointStats in stats.itervalues():
+    conditionalRequests = endpointStats['hits'] + endpointStats['misses']
+    endpointStats['hit_rate'] = endpointStats['hits'] * 1.0 / conditionalRequests if conditionalRequests else None
+  return stats
+
+def conditional(version):
+  """
+  Decorator for routes whose output only changes when version(**kwargs) does.
+  version returns (a string that changes whenever the output can, the output's last-modified unix time or None), or
+  None to skip the check, e.g. for a topic that doesn't exist. It runs before the route, so it must be cheap; and since
+  it runs first, a response can only ever be tagged with an older version than its data, never a newer one.
+  Requests whose If-None-Match (or, lacking one, If-Modified-Since) still matches get an empty 304 without running the
+  route. Other 200s get ETag and Last-Modified headers.
+  Last-Modified has one-second resolution, so until the second it names is over, more can change within it: it's
+  neither sent nor used to answer a 304 until then, and those requests rely on the ETag alone.
+  """
+  def decorator(f):
+    @functools.wraps(f)
+    def conditional_view(*args, **kwargs):
+      current = version(**kwargs)
+      if current is None:
+        return f(*args, **kwargs)
+      versionString, lastModified = current
+      if lastModified is not None and lastModified >= int(time.time()):
+        lastModified = None
+      # one route serves many listings, so the request params are part of the tag.
+      etag = hashlib.sha1(request.full_path.encode('utf-8') + '\0' + versionString).hexdigest()
+      if request.if_none_match:
+        notModified = request.if_none_match.contains_weak(etag)
+      elif request.if_modified_since is not None:
+        notModified = lastModified is not None and lastModified <= calendar.timegm(request.if_modified_since.utctimetuple())
+      else:
+        notModified = None
+      if notModified:
+        count_conditional(request.endpoint, 'hits')
+        response = Response(status=304)
+      else:
+        count_conditional(request.endpoint, 'unconditional' if notModified is None else 'misses')
+        response = app.make_response(f(*args, **kwargs))
+        if response.status_code != 200:
+          return response
+      response.set_etag(etag)
+      if lastModified is not None:
+        response.last_modified = lastModified
+      return response
+    return conditional_view
+  return decorator
+
+def topic_version(topicid, **kwargs):
+  """
+  Changes whenever a post is added to the topic.
+  """
+  topic = Query("topics").fields("lastPostTime", "postCount").where(ll_topicid=str(topicid)).firstRow(g.db)
+  if not topic:
+    return None
+  return "%s/%s" % (topic['lastPostTime'], topic['postCount']), int(topic['lastPostTime'] or 0)
+
+def topics_version(**kwargs):
+  """
+  Changes whenever a topic is made or posted in.
+  """
+  latest = Query("topics").fields("MAX(lastPostTime) AS lastPostTime", "MAX(ll_topicid) AS ll_topicid").firstRow(g.db)
+  return "%s/%s" % (latest['lastPostTime'], latest['ll_topicid']), int(latest['lastPostTime'] or 0)
+
+def tag_topics_version(**kwargs):
+  """
+  Changes whenever a topic is made or posted in, or the tag index takes either in. tagd's state can't be seen, so its
+  results are never validated.
+  """
+  if TAG_TOPICS_FROM_TAGD:
+    return None
+  versionString, lastModified = topics_version()
+  # until the index catches up, its results are only as new as its newest post.
+  return versionString + "/" + tagIndex.version, min(lastModified, tagIndex.lastPostTime) or None
+
+def posts_version(**kwargs):
+  """
+  Changes whenever a post is made, or for searches, whenever the post index takes one in. Posts are never edited.
+  """
+  maxID = Query("posts").fields("MAX(ll_messageid)").firstValue(g.db)
+  if 'query' in request.args:
+    return "%s/%s" % (maxID, postIndex.highWater), None
+  return str(maxID), None
+
 # flask user functions.
 @login_manager.user_loader
 def load_user(userid):
+  # requests turned away by before_request() for want of a pooled connection don't have one.
+  db = getattr(g, 'db', None)
+  if db is None:
+    return None
   try:
-    return User(DbConn.DbConn(app.config['MYSQL_USERNAME'], app.config['MYSQL_PASSWORD'], app.config['MYSQL_DB']), int(userid))
+    return User(db, int(userid))
   except InvalidUserError, e:
     return None
 
@@ -124,11 +277,102 @@ def current_user_required(f):
   return decorated_function
 
 # output response shorthand functions.
-def jsonify_list(outputList, key):
-  resp = jsonify({key: outputList})
+def jsonify_list(outputList, key, **extra):
+  extra[key] = outputList
+  resp = jsonify(extra)
   resp.status_code = 200
   return resp
 
+def stream_list(outputObjects, key, resultList=None, normalized=False):
+  """
+  Takes an iterable of objects and returns a response that serializes and sends them one at a time.
+  If the objects came from a list with a keyset, the cursor of the following page is sent as next.
+  If normalized, their topics and users are sent once each after them, keyed by id.
+  """
+  def generate():
+    yield '{"' + key + '": ['
+    separator = ''
+    count = 0
+    outputObj = None
+    included = {} if normalized else None
+    memo = {}
+    for outputObj in outputObjects:
+      yield separator + json.dumps(outputObj.dict(included=included, memo=memo))
+      separator = ', '
+      count += 1
+    yield ']'
+    if resultList is not None and resultList.keyset is not None:
+      yield ', "next": ' + json.dumps(resultList.nextCursor(outputObj, count))
+    for collection in sorted(included or {}):
+      yield ', "' + collection + '": ' + json.dumps(included[collection])
+    yield '}'
+  return Response(stream_with_context(generate()), status=200, mimetype='application/json')
+
+def wants_stream():
+  """
+  Listings are buffered by default; pass stream=1 to have their items serialized and sent as they're fetched.
+  """
+  return request.args.get('stream') == '1'
+
+def wants_normalized():
+  """
+  Listings nest each item's topic and user by default; pass shape=normalized to get their ids instead, with the topics
+  and users themselves sent once each alongside the items, keyed by id.
+  """
+  return request.args.get('shape') == 'normalized'
+
+def list_response(resultList, key, **searchArgs):
+  """
+  Searches a PostList or TopicList, returning its results and the cursor of the following page as next.
+  """
+  normalized = wants_normalized()
+  if wants_stream():
+    return stream_list(resultList.iterate(**searchArgs), key, resultList, normalized=normalized)
+  results = resultList.search(**searchArgs)
+  nextCursor = resultList.nextCursor(results[-1] if results else None, len(results))
+  included = {} if normalized else None
+  memo = {}
+  outputList = [result.dict(included=included, memo=memo) for result in results]
+  return jsonify_list(outputList, key, next=nextCursor, **(included or {}))
+
+def page_window(defaultLimit=50):
+  """
+  Returns the (start, limit) requested by the start and limit request params.
+  """
+  start, limit = 0, defaultLimit
+  if 'limit' in request.args:
+    requestedLimit = int(request.args['limit'])
+    limit = 1000 if requestedLimit > 1000 or requestedLimit < 1 else requestedLimit
+  if 'start' in request.args:
+    requestedStart = int(request.args['start'])
+    start = 0 if requestedStart < 0 else requestedStart
+  return start, limit
+
+def page_list(resultList):
+  """
+  Applies the start, limit, after and before request params to a list.
+  """
+  start, limit = page_window()
+  resultList.start(start).limit(limit)
+  if 'after' in request.args:
+    resultList.after(request.args['after'])
+  if 'before' in request.args:
+    resultList.before(request.args['before'])
+  return resultList
+
+def requested_fields(cls, includes=None):
+  """
+  Returns the sparse fieldsets the fields request param asks for from cls objects and their includes, e.g.
+  fields=id,date,user.name, or None if it's absent. ids, and the attributes lists page by, are always sent.
+  Raises InvalidFieldError for fields cls or its includes don't have.
+  """
+  if 'fields' not in request.args:
+    return None
+  return cls.sparseFields([name.strip() for name in request.args['fields'].split(',') if name.strip()], includes=includes)
+
+def invalid_field(e):
+  return bad_request("Invalid field: " + e.field)
+
 def jsonify_object(outputObj):
   """
   Takes an object (or None) and returns a proper json response object.
@@ -143,12 +387,53 @@ def jsonify_object(outputObj):
   resp.status_code = status
   return resp
 
+def jsonify_cached(kind, key, loader, fields=None):
+  """
+  Returns a json response for the object loader() loads, going through the object cache.
+  Objects loaded with sparse fieldsets are cached as variants of whole ones, so invalidating an object drops them too.
+  """
+  variant = None
+  if fields is not None:
+    variant = 'fields=' + ','.join(sorted([attr if prefix is None else prefix + '.' + attr for prefix, attrs in fields.iteritems() for attr in attrs]))
+  resp = jsonify(objectCache.get(kind, key, lambda: loader().dict(), variant=variant))
+  resp.status_code = 200
+  return resp
+
 def eti_down():
   message = {'message': "ETI is down. Cannot authenticate you."}
   resp = jsonify(message)
   resp.status_code = 502
   return resp
 
+def db_unavailable():
+  message = {'message': "No database connections are available. Try again shortly."}
+  resp = jsonify(message)
+  resp.status_code = 503
+  return resp
+
+def tagd_unavailable():
+  message = {'message': "The tag service is unavailable. Try again shortly."}
+  resp = jsonify(message)
+  resp.status_code = 503
+  return resp
+
+def tag_index_unavailable():
+  message = {'message': "The tag index hasn't been built yet. Try again shortly."}
+  resp = jsonify(message)
+  resp.status_code = 503
+  return resp
+
+def post_index_unavailable():
+  message = {'message': "The post search index hasn't been built yet. Try again shortly."}
+  resp = jsonify(message)
+  resp.status_code = 503
+  return resp
+
+def bad_request(message):
+  resp = jsonify({'message': message})
+  resp.status_code = 400
+  return resp
+
 def not_found():
   message = {'message': "The resource you requested could not be found."}
   resp = jsonify(message)
@@ -157,22 +442,30 @@ def not_found():
 
 @app.before_request
 def before_request():
-  g.db = DbConn.DbConn(app.config['MYSQL_USERNAME'], app.config['MYSQL_PASSWORD'], app.config['MYSQL_DB'])
+  try:
+    g.db = dbPool.get()
+  except dbpool.PoolTimeoutError:
+    return db_unavailable()
+  cacheWatcher.poll(g.db)
 
 @app.teardown_request
 def teardown_request(exception):
   try:
-    g.db.close()
+    db = g.db
   except AttributeError, e:
-    pass
+    return
+  # a request that errored may have left a half-built query on its connection.
+  dbPool.put(db, discard=exception is not None)
 
 @app.route('/topics')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
+@conditional(topics_version)
 def api_topics():
   """
-  Topic listing. Request params: query, tag, start, limit
+  Topic listing. Request params: query, tag, fields, start, limit, after, before, stream, shape
   """
   try:
+    fields = requested_fields(Topic, includes=['user', 'tags'])
     topicList = TopicList(g.db)
     query = request.args['query'] if 'query' in request.args else None
     if 'tag' in request.args:
@@ -182,39 +475,44 @@ def api_topics():
           topicList.excludeTag(Tag(g.db, name[1:]))
         else:
           topicList.includeTag(Tag(g.db, name))
-    if 'start' in request.args:
-      requestedStart = int(request.args['start'])
-      topicList.start(0 if requestedStart < 0 else requestedStart)
-    if 'limit' in request.args:
-      topicLimit = 1000 if int(request.args['limit']) > 1000 or int(request.args['limit']) < 1 else int(request.args['limit'])
-      topicList.limit(topicLimit)
-    searchTopics = [topic.dict() for topic in topicList.search(query=query, includes=['user', 'tags'])]
-    return jsonify_list(searchTopics, 'topics')
+    page_list(topicList)
+    return list_response(topicList, 'topics', query=query, includes=['user', 'tags'], fields=fields)
   except InvalidTagError:
     return not_found()
+  except InvalidCursorError:
+    return bad_request("Invalid cursor.")
+  except InvalidFieldError, e:
+    return invalid_field(e)
 
 @app.route('/topics/<int:topicid>')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
 def api_topic(topicid):
   """
-  Display a single topic.
+  Display a single topic. Request params: fields
   """
   try:
-    topicObj = Topic(g.db, topicid).load(includes=['user', 'tags'])
+    fields = requested_fields(Topic, includes=['user', 'tags'])
+    return jsonify_cached('topic', topicid, lambda: Topic(g.db, topicid).load(includes=['user', 'tags'], fields=fields), fields=fields)
   except InvalidTopicError:
     return not_found()
-  return jsonify_object(topicObj)
+  except InvalidFieldError, e:
+    return invalid_field(e)
 
 @app.route('/topics/<int:topicid>/posts')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
+@conditional(topic_version)
 def api_topic_posts(topicid):
   """
-  Display a single topic's posts. Request params: user, limit, start
+  Display a single topic's posts. Request params: user, fields, limit, start, after, before, stream, shape
   """
   try:
     topicObj = Topic(g.db, topicid)
   except InvalidUserError:
     return not_found()
+  try:
+    fields = requested_fields(Post, includes=['user'])
+  except InvalidFieldError, e:
+    return invalid_field(e)
   postList = PostList(g.db).topic(topicObj)
   if 'user' in request.args:
     try:
@@ -222,14 +520,11 @@ def api_topic_posts(topicid):
     except InvalidUserError, e:
       return not_found()
     postList.user(filterUser)
-  if 'limit' in request.args:
-    requestedLimit = int(request.args['limit'])
-    postList.limit(1000 if requestedLimit > 1000 or requestedLimit < 1 else requestedLimit)
-  if 'start' in request.args:
-    requestedStart = int(request.args['start'])
-    postList.start(0 if requestedStart < 0 else requestedStart)
-  searchPosts = [post.dict() for post in postList.search(includes=['user'])]
-  return jsonify_list(searchPosts, 'posts')
+  try:
+    page_list(postList)
+  except InvalidCursorError:
+    return bad_request("Invalid cursor.")
+  return list_response(postList, 'posts', includes=['user'], fields=fields)
 
 @app.route('/topics/<int:topicid>/users')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
@@ -238,31 +533,54 @@ def api_topic_users(topicid):
   Display a single topic's users with post-counts.
   """
   try:
-    users = [{'user': user['user'].load().dict(), 'posts': int(user['posts'])} for user in Topic(g.db, topicid).users]
+    users = [{'user': user['user'].dict(), 'posts': int(user['posts'])} for user in Topic(g.db, topicid).users]
   except InvalidTopicError:
     return not_found()
   return jsonify_list(users, 'users')
 
 @app.route('/posts')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
+@conditional(posts_version)
 def api_posts():
   """
-  Display all posts. Not yet implemented.
+  Post listing and search. Request params: query, topic, user, tag, since, until, fields, limit, start, after, before, stream, shape
   """
-  return 'List of ' + url_for('api_posts')
+  try:
+    fields = requested_fields(Post, includes=['topic', 'user'])
+    postList = PostList(g.db)
+    query = request.args['query'] if 'query' in request.args else None
+    if 'topic' in request.args:
+      postList.topic(Topic(g.db, int(request.args['topic'])))
+    if 'user' in request.args:
+      postList.user(User(g.db, int(request.args['user'])))
+    if 'tag' in request.args:
+      postList.tags([Tag(g.db, name) for name in request.args.getlist('tag')])
+    if 'since' in request.args or 'until' in request.args:
+      postList.dates(start=int(request.args['since']) if 'since' in request.args else None, end=int(request.args['until']) if 'until' in request.args else None)
+    page_list(postList)
+    return list_response(postList, 'posts', query=query, includes=['topic', 'user'], fields=fields)
+  except (InvalidTopicError, InvalidUserError, InvalidTagError):
+    return not_found()
+  except InvalidCursorError:
+    return bad_request("Invalid cursor.")
+  except InvalidFieldError, e:
+    return invalid_field(e)
+  except postsearch.IndexUnavailableError:
+    return post_index_unavailable()
 
 @app.route('/posts/<int:postid>')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
 def api_post(postid):
   """
-  Display a single post.
+  Display a single post. Request params: fields
   """
   try:
-    postObj = Post(g.db, postid).load(includes=['user', 'topic'])
-    postObj.topic = postObj.topic.dict()
+    fields = requested_fields(Post, includes=['user', 'topic'])
+    return jsonify_cached('post', postid, lambda: Post(g.db, postid).load(includes=['user', 'topic'], fields=fields), fields=fields)
   except InvalidPostError:
     return not_found()
-  return jsonify_object(postObj)
+  except InvalidFieldError, e:
+    return invalid_field(e)
 
 @app.route('/users')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
@@ -276,54 +594,59 @@ def api_users():
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
 def api_user(userid):
   """
-  Display a single user.
+  Display a single user. Request params: fields
   """
   try:
-    userObj = User(g.db, userid).load()
+    fields = requested_fields(User)
+    return jsonify_cached('user', userid, lambda: User(g.db, userid).load(fields=fields), fields=fields)
   except InvalidUserError:
     return not_found()
-  return jsonify_object(userObj)
+  except InvalidFieldError, e:
+    return invalid_field(e)
 
 @app.route('/users/<int:userid>/posts')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
 @current_user_required
+@conditional(posts_version)
 def api_user_posts(userid):
   """
-  Display a single user's posts. Requires authentication. Request params: topic, limit, start
+  Display a single user's posts. Requires authentication. Request params: topic, fields, limit, start, after, before, stream, shape
   """
   try:
     userObj = User(g.db, userid)
   except InvalidUserError:
     return not_found()
-  postList = PostList(g.db)
-  postList.db.where(('posts.userid=%s', userObj.id))
+  try:
+    fields = requested_fields(Post, includes=['topic', 'user'])
+  except InvalidFieldError, e:
+    return invalid_field(e)
+  postList = PostList(g.db).user(userObj)
   if 'topic' in request.args:
     try:
       filterTopic = Topic(g.db, int(request.args['topic']))
     except InvalidUserError, e:
       return not_found()
     postList.topic(filterTopic)
-  if 'limit' in request.args:
-    requestedLimit = int(request.args['limit'])
-    postList.limit(1000 if requestedLimit > 1000 or requestedLimit < 1 else requestedLimit)
-  if 'start' in request.args:
-    requestedStart = int(request.args['start'])
-    postList.start(0 if requestedStart < 0 else requestedStart)
-  searchPosts = [post.dict() for post in postList.search(includes=['topic', 'user'])]
-  return jsonify_list(searchPosts, 'posts')
+  try:
+    page_list(postList)
+  except InvalidCursorError:
+    return bad_request("Invalid cursor.")
+  return list_response(postList, 'posts', includes=['topic', 'user'], fields=fields)
 
 @app.route('/users/<int:userid>/topics')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
 @current_user_required
+@conditional(topics_version)
 def api_user_topics(userid):
   """
-  Display a single user's topics. Requires authentication. Request params: query, tag, limit, start
+  Display a single user's topics. Requires authentication. Request params: query, tag, fields, limit, start, after, before, stream, shape
   """
   try:
     userObj = User(g.db, userid)
   except InvalidUserError:
     return not_found()
   try:
+    fields = requested_fields(Topic, includes=['user', 'tags'])
     topicList = TopicList(g.db).user(userObj)
     query = request.args['query'] if 'query' in request.args else None
     if 'tag' in request.args:
@@ -333,16 +656,14 @@ def api_user_topics(userid):
           topicList.excludeTag(Tag(g.db, name[1:]))
         else:
           topicList.includeTag(Tag(g.db, name))
-    if 'limit' in request.args:
-      requestedLimit = int(request.args['limit'])
-      topicList.limit(1000 if requestedLimit > 1000 or requestedLimit < 1 else requestedLimit)
-    if 'start' in request.args:
-      requestedStart = int(request.args['start'])
-      topicList.start(0 if requestedStart < 0 else requestedStart)
-    searchTopics = [post.dict() for post in topicList.search(query=query, includes=['user', 'tags'])]
+    page_list(topicList)
+    return list_response(topicList, 'topics', query=query, includes=['user', 'tags'], fields=fields)
   except InvalidTagError:
     return not_found()
-  return jsonify_list(searchTopics, 'topics')
+  except InvalidCursorError:
+    return bad_request("Invalid cursor.")
+  except InvalidFieldError, e:
+    return invalid_field(e)
 
 @app.route('/tags')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
@@ -359,40 +680,53 @@ def api_tag(title):
   Display a single tag.
   """
   try:
-    tagObj = Tag(g.db, title).load()
+    return jsonify_cached('tag', title, lambda: Tag(g.db, title).load())
   except InvalidTagError:
     return not_found()
-  return jsonify_object(tagObj)
 
 @app.route('/tags/<title>/topics')
 @ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
+@conditional(tag_topics_version)
 def api_tag_topics(title):
   """
-  Display a single tag's topics. Request params: query, limit, start
+  Display a single tag's topics. Request params: tag (further tags to include, or exclude when prefixed with -), fields, limit, start, stream, shape
   """
+  try:
+    fields = requested_fields(Topic, includes=['tags'])
+  except InvalidFieldError, e:
+    return invalid_field(e)
   try:
     tagObj = Tag(g.db, title).load()
+    includeIDs = [tagObj.id]
+    excludeIDs = []
+    for name in request.args.getlist('tag'):
+      if name.startswith("-"):
+        excludeIDs.append(Tag(g.db, name[1:]).load().id)
+      else:
+        includeIDs.append(Tag(g.db, name).load().id)
   except InvalidTagError:
     return not_found()
 
-  # send a query.
-  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-  sock.connect("/home/shaldengeki/tagd.sock")
-  sock.send(str(tagObj.id))
-  data = sock.recv(1024)
-  sock.close()
-  tag_topics = json.loads(data)
-  searchTopics = [Topic(g.db, topic_id).load(includes=['tags']).dict() for topic_id in tag_topics]
-  # topicList = TopicList(g.db).topics(tag_topics)
-  # query = request.args['query'] if 'query' in request.args else None
-  # if 'limit' in request.args:
-  #   requestedLimit = int(request.args['limit'])
-  #   topicList.limit(1000 if requestedLimit > 1000 or requestedLimit < 1 else requestedLimit)
-  # if 'start' in request.args:
-  #   requestedStart = int(request.args['start'])
-  #   topicList.start(0 if requestedStart < 0 else requestedStart)
-  # searchTopics = [topic.dict() for topic in topicList.search(query=query, includes=['user', 'tags'])]
-  return jsonify_list(searchTopics, 'topics')
+  if TAG_TOPICS_FROM_TAGD:
+    if not tagdClient.framed and (len(includeIDs) > 1 or excludeIDs):
+      return bad_request("Filtering by further tags isn't supported yet.")
+    try:
+      tag_topics = tagdClient.topics(includeIDs, exclude=excludeIDs)
+    except tagd.TagdError:
+      return tagd_unavailable()
+  else:
+    # only the topics up to the end of the requested page need ranking.
+    start, limit = page_window()
+    try:
+      tag_topics = tagIndex.topics(g.db, include=includeIDs, exclude=excludeIDs, limit=start + limit)
+    except tagindex.IndexUnavailableError:
+      return tag_index_unavailable()
+  topicList = TopicList(g.db).topics(tag_topics)
+  try:
+    page_list(topicList)
+  except InvalidCursorError:
+    return bad_request("Cursors are not supported here; use start.")
+  return list_response(topicList, 'topics', includes=['tags'], fields=fields)
 
 @app.route('/login')
 @ratelimit(limit=5, per=60)
@@ -411,7 +745,7 @@ def api_login():
   if checkAuth == '0':
     return unauthorized()
   else:
-    userID = int(g.db.table("user_names").fields("user_id").where(name=request.args['user']).firstValue())
+    userID = int(Query("user_names").fields("user_id").where(name=request.args['user']).firstValue(g.db))
     if not userID:
       return unauthorized()
     flask_login.login_user(User(g.db, userID))
@@ -427,6 +761,14 @@ def api_logout():
   flask_login.logout_user()
   return redirect(url_for('api_root'))
 
+@app.route('/stats')
+@ratelimit(limit=LIMIT_REQUEST_NUM, per=LIMIT_REQUEST_SEC)
+def api_stats():
+  """
+  Server statistics for this worker.
+  """
+  return jsonify({'db_pool': dbPool.stats(), 'cache': objectCache.stats(), 'conditional': conditional_stats(), 'rate_limit': rateLimiter.stats()})
+
 @app.route('/ip')
 def api_ip():
   return jsonify({'ip': request.remote_addr}), 200
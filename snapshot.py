@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+"""
+  Columnar on-disk snapshots of the posts archive, so analytics can read it without querying the production database.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  A snapshot is a directory holding a raw file per column of each exported table, read back as memory maps, and a
+  manifest.json of each table's columns, row count and high water mark. Integer columns are native-endian arrays, with NULLs
+  stored as the type's minimum; text columns are a file of UTF-8 bytes, a file of the int64 offset each row ends at, and
+  a file of a uint8 per row that's 1 where the value is NULL.
+  posts are appended to by ll_messageid and user_names by date, so re-exporting only fetches rows newer than the
+  snapshot's newest; since dates tie, user_names re-reads rows at its newest date, skipping the ones it already has.
+  topics and users, whose rows change, are rewritten in full, as a new generation of files.
+  Files are written before the manifest is replaced, so an interrupted export leaves the snapshot as it was.
+  Usage: python snapshot.py directory [table ...]  (exports from the database in config.txt)
+"""
+
+import calendar
+import collections
+import datetime
+import glob
+import itertools
+import json
+import os
+import sys
+
+import numpy
+
+from dbquery import Query
+import activity
+import eti
+
+MANIFEST_FORMAT = 2
+TEXT = 'text'
+DATETIME = 'datetime'
+
+# the columns of each table exported, and their types: a numpy dtype, TEXT, or DATETIME (stored as int64 unix time).
+TABLES = collections.OrderedDict([
+  ('posts', [('ll_messageid', 'int32'), ('ll_topicid', 'int32'), ('userid', 'int32'), ('date', 'int32')]),
+  ('topics', [('ll_topicid', 'int32'), ('userid', 'int32'), ('title', TEXT), ('postCount', 'int32'), ('lastPostTime', 'int32')]),
+  ('users', [('id', 'int32'), ('created', 'int32'), ('lastactive', 'int32'), ('good_tokens', 'int32'), ('bad_tokens', 'int32'),
+             ('contrib_tokens', 'int32'), ('signature', TEXT), ('quote', TEXT), ('email', TEXT), ('im', TEXT), ('picture', TEXT),
+             ('status', 'int32')]),
+  ('user_names', [('user_id', 'int32'), ('name', TEXT), ('date', DATETIME)])
+])
+# rows are stored in order of these, so tables can be searched by them.
+PRIMARY_KEYS = {
+  'posts': 'll_messageid',
+  'topics': 'll_topicid',
+  'users': 'id'
+}
+# tables appended to past the newest value of a column. the others are rewritten on each export.
+APPEND_KEYS = {
+  'posts': 'll_messageid',
+  'user_names': 'date'
+}
+
+def storageType(columnType):
+  return numpy.dtype('int64' if columnType == DATETIME else columnType)
+
+def toUnixTime(value):
+  return calendar.timegm(value.utctimetuple())
+
+def encodeText(value):
+  return value.encode('utf-8') if isinstance(value, unicode) else str(value)
+
+def truncate(path, size):
+  """
+  Creates path if it doesn't exist, and cuts it to size bytes.
+  """
+  with open(path, 'ab') as f:
+    f.truncate(size)
+
+def mapArray(path, dtype, length):
+  """
+  Returns a read-only memory map of the first length items of the array in path.
+  """
+  if length == 0:
+    return numpy.zeros(0, dtype=dtype)
+  return numpy.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+class TextColumn(object):
+  '''
+  A memory-mapped column of UTF-8 strings, indexed by row. NULLs are None.
+  '''
+  def __init__(self, ends, data, nulls):
+    self.ends = ends
+    self.data = data
+    self.nulls = nulls
+
+  def __len__(self):
+    return len(self.ends)
+
+  def __getitem__(self, row):
+    if self.nulls[row]:
+      return None
+    return self.encoded(row).decode('utf-8', 'replace')
+
+  def encoded(self, row):
+    """
+    Returns the UTF-8 bytes stored for row, which are empty for a NULL.
+    """
+    start = int(self.ends[row - 1]) if row > 0 else 0
+    return self.data[start:int(self.ends[row])].tostring()
+
+class ColumnWriter(object):
+  '''
+  Appends database rows to one generation of a table's column files, which hold rows rows.
+  Anything past those rows, left by an interrupted export, is cut off first.
+  '''
+  def __init__(self, snapshot, table, generation, rows):
+    self.columns = [(name, columnType, snapshot.path(table, generation, name)) for name, columnType in TABLES[table]]
+    self.rows = rows
+    self.textEnds = {}
+    for name, columnType, path in self.columns:
+      if columnType == TEXT:
+        ends = mapArray(path + '.ends', 'int64', rows)
+        self.textEnds[name] = int(ends[-1]) if rows else 0
+        truncate(path + '.ends', rows * 8)
+        truncate(path + '.bytes', self.textEnds[name])
+        truncate(path + '.nulls', rows)
+      else:
+        truncate(path, rows * storageType(columnType).itemsize)
+
+  def write(self, dbRows):
+    for name, columnType, path in self.columns:
+      values = [dbRow[name] for dbRow in dbRows]
+      if columnType == TEXT:
+        encoded = ['' if value is None else encodeText(value) for value in values]
+        ends = self.textEnds[name] + numpy.cumsum([len(value) for value in encoded], dtype=numpy.int64)
+        with open(path + '.bytes', 'ab') as f:
+          f.write(''.join(encoded))
+        with open(path + '.ends', 'ab') as f:
+          ends.tofile(f)
+        with open(path + '.nulls', 'ab') as f:
+          numpy.asarray([value is None for value in values], dtype=numpy.uint8).tofile(f)
+        if len(ends):
+          self.textEnds[name] = int(ends[-1])
+      else:
+        dtype = storageType(columnType)
+        null = numpy.iinfo(dtype).min
+        if columnType == DATETIME:
+          values = [null if value is None else toUnixTime(value) for value in values]
+        else:
+          values = [null if value is None else int(value) for value in values]
+        with open(path, 'ab') as f:
+          numpy.asarray(values, dtype=dtype).tofile(f)
+    self.rows += len(dbRows)
+
+class Snapshot(object):
+  '''
+  A columnar snapshot of posts, topics, users and user_names in directory.
+  Columns are memory-mapped the first time they're read, and can be used as numpy arrays; rows() turns them back into
+  rows shaped like the database's, and topic(), users(), topicUsers() and posts() into eti model objects. Those
+  objects have no database connection, so read anything else about them from the snapshot.
+  '''
+  def __init__(self, directory):
+    self.directory = directory
+    self._columns = {}
+    self._userNames = None
+    try:
+      with open(self.manifestPath(), 'r') as f:
+        self.manifest = json.load(f)
+    except IOError:
+      self.manifest = {'format': MANIFEST_FORMAT, 'tables': {}}
+    if self.manifest['format'] != MANIFEST_FORMAT:
+      raise ValueError("snapshot in %s has format %s, not %s; export a new one" % (directory, self.manifest['format'], MANIFEST_FORMAT))
+
+  def manifestPath(self):
+    return os.path.join(self.directory, 'manifest.json')
+
+  def path(self, table, generation, column):
+    return os.path.join(self.directory, '%s.%d.%s' % (table, generation, column))
+
+  def length(self, table):
+    """
+    Returns the number of rows of table in the snapshot.
+    """
+    return self.manifest['tables'].get(table, {}).get('rows', 0)
+
+  def saveManifest(self):
+    temporaryPath = self.manifestPath() + '.tmp'
+    with open(temporaryPath, 'w') as f:
+      json.dump(self.manifest, f, indent=2, sort_keys=True)
+    os.rename(temporaryPath, self.manifestPath())
+
+  def export(self, db, tables=None, chunkSize=100000):
+    """
+    Brings the snapshot's tables (by default, all of them) up to date with db, saving the manifest after each.
+    Returns a dict of the rows written to each.
+    """
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    written = {}
+    for table in (tables or TABLES.keys()):
+      info = dict(self.manifest['tables'].get(table, {'generation': 0, 'rows': 0, 'highWater': None}))
+      oldGeneration = info['generation'] if table in self.manifest['tables'] else None
+      if table in APPEND_KEYS:
+        writer = ColumnWriter(self, table, info['generation'], info['rows'])
+        info['highWater'] = self._append(db, table, writer, info['highWater'], chunkSize)
+        written[table] = writer.rows - info['rows']
+      else:
+        info['generation'] += 1
+        writer = ColumnWriter(self, table, info['generation'], 0)
+        for dbRows in self._chunks(Query(table).fields(*self.columnNames(table)).order(PRIMARY_KEYS[table] + " ASC").query(db), chunkSize):
+          writer.write(dbRows)
+        written[table] = writer.rows
+      info['rows'] = writer.rows
+      info['columns'] = TABLES[table]
+      self.manifest['tables'][table] = info
+      self.saveManifest()
+      self._forget(table)
+      if oldGeneration is not None and oldGeneration != info['generation']:
+        for path in glob.glob(os.path.join(self.directory, '%s.%d.*' % (table, oldGeneration))):
+          os.remove(path)
+    return written
+
+  def _append(self, db, table, writer, highWater, chunkSize):
+    """
+    Writes the rows of table newer than highWater, returning the new high water mark. Tables whose append key is
+    unique are fetched in keyset chunks of it; others, whose keys can tie across a chunk's end, in one streamed query.
+    That query starts at highWater itself, since rows can still have been added at it after the last export; the ones
+    already stored there are skipped.
+    """
+    key = APPEND_KEYS[table]
+    isDatetime = dict(TABLES[table])[key] == DATETIME
+    chunked = PRIMARY_KEYS.get(table) == key
+    stored = self._storedAt(table, key, highWater) if not chunked and highWater is not None else collections.Counter()
+    while True:
+      tableQuery = Query(table).fields(*self.columnNames(table)).order(key + " ASC")
+      if highWater is not None:
+        tableQuery = tableQuery.where((key + (" > %s" if chunked else " >= %s"), datetime.datetime.utcfromtimestamp(highWater) if isDatetime else highWater))
+      if chunked:
+        tableQuery = tableQuery.limit(chunkSize)
+      numRows = 0
+      for dbRows in self._chunks(tableQuery.query(db), chunkSize):
+        if stored:
+          dbRows = [dbRow for dbRow in dbRows if not self._takeStored(stored, table, dbRow)]
+          if not dbRows:
+            continue
+        writer.write(dbRows)
+        numRows += len(dbRows)
+        lastKey = dbRows[-1][key]
+        if lastKey is not None:
+          highWater = toUnixTime(lastKey) if isDatetime else int(lastKey)
+      if not chunked or numRows < chunkSize:
+        return highWater
+
+  def _rowKey(self, table, values):
+    return tuple([encodeText(value) if value is not None and columnType == TEXT else value for (name, columnType), value in zip(TABLES[table], values)])
+
+  def _storedAt(self, table, key, highWater):
+    """
+    Returns a Counter of the rows of table stored with key at highWater, the last ones in the snapshot.
+    """
+    keys = self.column(table, key)
+    first = int(numpy.searchsorted(keys, highWater))
+    return collections.Counter([self._rowKey(table, [row[name] for name in self.columnNames(table)]) for row in self.rows(table, xrange(first, len(keys)))])
+
+  def _takeStored(self, stored, table, dbRow):
+    """
+    Returns whether dbRow is one of the rows counted in stored, taking it out of them if it is.
+    """
+    rowKey = self._rowKey(table, [dbRow[name] for name in self.columnNames(table)])
+    if not stored[rowKey]:
+      return False
+    stored[rowKey] -= 1
+    return True
+
+  def _chunks(self, rows, chunkSize):
+    rows = iter(rows)
+    while True:
+      chunk = list(itertools.islice(rows, chunkSize))
+      if not chunk:
+        return
+      yield chunk
+
+  def _forget(self, table):
+    for key in [key for key in self._columns if key[0] == table]:
+      del self._columns[key]
+    if table == 'user_names':
+      self._userNames = None
+
+  def columnNames(self, table):
+    return [name for name, columnType in TABLES[table]]
+
+  def column(self, table, name):
+    """
+    Returns a column of table: a read-only memory-mapped numpy array, or a TextColumn.
+    """
+    key = (table, name)
+    if key not in self._columns:
+      info = self.manifest['tables'].get(table, {'generation': 0, 'rows': 0})
+      path = self.path(table, info['generation'], name)
+      columnType = dict(TABLES[table])[name]
+      if columnType == TEXT:
+        ends = mapArray(path + '.ends', 'int64', info['rows'])
+        self._columns[key] = TextColumn(ends, mapArray(path + '.bytes', 'uint8', int(ends[-1]) if len(ends) else 0), mapArray(path + '.nulls', 'uint8', info['rows']))
+      else:
+        self._columns[key] = mapArray(path, storageType(columnType), info['rows'])
+    return self._columns[key]
+
+  def rows(self, table, indices, names=None):
+    """
+    Returns the rows of table at indices as dicts, with values as the database gives them.
+    """
+    names = names if names is not None else self.columnNames(table)
+    types = dict(TABLES[table])
+    columns = [(name, types[name], self.column(table, name)) for name in names]
+    nulls = dict([(name, numpy.iinfo(column.dtype).min) for name, columnType, column in columns if columnType != TEXT])
+    rows = []
+    for index in indices:
+      row = {}
+      for name, columnType, column in columns:
+        value = column[index]
+        if columnType != TEXT:
+          value = None if value == nulls[name] else int(value)
+          if columnType == DATETIME and value is not None:
+            value = datetime.datetime.utcfromtimestamp(value)
+        row[name] = value
+      rows.append(row)
+    return rows
+
+  def find(self, table, ids):
+    """
+    Returns the index of each of ids in table, searching its primary key, or None for ids not in it.
+    """
+    keys = self.column(table, PRIMARY_KEYS[table])
+    ids = numpy.asarray(ids, dtype=numpy.int64)
+    indices = numpy.searchsorted(keys, ids)
+    return [int(index) if index < len(keys) and keys[index] == key else None for index, key in zip(indices, ids)]
+
+  def postIndices(self, start=None, end=None, topicID=None, userID=None):
+    """
+    Returns the indices of the posts dated in [start, end) unix time, in topicID and by userID, where those are given.
+    """
+    selected = numpy.ones(self.length('posts'), dtype=bool)
+    if start is not None:
+      selected &= self.column('posts', 'date') >= start
+    if end is not None:
+      selected &= self.column('posts', 'date') < end
+    if topicID is not None:
+      selected &= self.column('posts', 'll_topicid') == topicID
+    if userID is not None:
+      selected &= self.column('posts', 'userid') == userID
+    return numpy.flatnonzero(selected)
+
+  def activity(self, userIDs=None, start=None, end=None, timezone=None):
+    """
+    Returns the daily activity.ActivityMatrix of userIDs (or every user) over posts dated in [start, end).
+    """
+    indices = self.postIndices(start=start, end=end) if start is not None or end is not None else slice(None)
+    return activity.ActivityMatrix.fromPosts(self.column('posts', 'userid')[indices], self.column('posts', 'date')[indices], userIDs=userIDs, timezone=timezone)
+
+  def userNames(self, userID):
+    """
+    Returns the user_names rows of userID, oldest first.
+    """
+    if self._userNames is None:
+      nameUsers = self.column('user_names', 'user_id')
+      # names are stored by date, so a stable sort by user keeps each user's in date order.
+      order = numpy.argsort(nameUsers, kind='mergesort')
+      self._userNames = (order, numpy.asarray(nameUsers)[order])
+    order, sortedUsers = self._userNames
+    first, last = numpy.searchsorted(sortedUsers, [userID, userID + 1])
+    return self.rows('user_names', order[first:last], names=['name', 'date'])
+
+  def users(self, userIDs):
+    """
+    Returns eti.Users for userIDs, in the order given, set as UserList.load() sets them.
+    """
+    userIDs = [int(userID) for userID in userIDs]
+    resultUsers = []
+    for userID, index in zip(userIDs, self.find('users', userIDs)):
+      user = eti.User(None, userID)
+      if userID == 0:
+        resultUsers.append(user.load())
+        continue
+      if index is None:
+        raise eti.InvalidUserError(user)
+      user.setDB(self.rows('users', [index])[0])
+      # newest name first, as UserList.load() orders them.
+      user.setNames(user.parseNames(self.userNames(userID)[::-1]))
+      resultUsers.append(user)
+    return resultUsers
+
+  def user(self, userID):
+    return self.users([userID])[0]
+
+  def topic(self, topicID):
+    """
+    Returns an eti.Topic, with its user, as Topic.load(includes=['user']) would.
+    """
+    index = self.find('topics', [topicID])[0]
+    if index is None:
+      raise eti.InvalidTopicError(eti.Topic(None, int(topicID)))
+    topicRow = self.rows('topics', [index])[0]
+    userIndex = self.find('users', [topicRow['userid']])[0]
+    if userIndex is not None:
+      topicRow.update(self.rows('users', [userIndex])[0])
+      userNames = self.userNames(topicRow['userid'])
+      if userNames:
+        topicRow['name'] = userNames[-1]['name']
+    return eti.Topic(None, int(topicID)).setDB(topicRow)
+
+  def topicUsers(self, topicID):
+    """
+    Returns the users who posted in topicID with their post counts, most posts first, as Topic.users does.
+    """
+    topicPosters = self.column('posts', 'userid')[self.postIndices(topicID=topicID)]
+    userIDs, counts = numpy.unique(topicPosters, return_counts=True)
+    order = numpy.argsort(-counts, kind='mergesort')
+    topicUsers = self.users(userIDs[order])
+    return [{'user': user, 'posts': int(count)} for user, count in zip(topicUsers, counts[order])]
+
+  def posts(self, start=None, end=None, topicID=None, userID=None):
+    """
+    Returns eti.Posts, with their topics and users, for the posts postIndices() selects, in ll_messageid order.
+    Only the snapshot's post columns are set; topics and users share one object per id.
+    """
+    identities = eti.IdentityMap()
+    return [eti.Post(None, postRow['ll_messageid']).setDB(postRow, identities=identities) for postRow in self.rows('posts', self.postIndices(start=start, end=end, topicID=topicID, userID=userID))]
+
+def main(directory, tables):
+  import DbConn
+  with open("config.txt", 'r') as f:
+    username, password, database = f.readline().strip().split(',')
+  db = DbConn.DbConn(username, password, database)
+  snapshot = Snapshot(directory)
+  for table, numRows in snapshot.export(db, tables=tables or None).iteritems():
+    print "%s: %d rows written, %d in snapshot" % (table, numRows, snapshot.length(table))
+
+if __name__ == '__main__':
+  main(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+  Client for the tagd Unix-socket service, which maps tags to the topics carrying them.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  Protocol: every message in either direction is a frame made of a 4-byte big-endian length followed by that many
+  bytes of JSON. A request is {"include": [tag ids], "exclude": [tag ids]}. The response is a JSON list of the ids of
+  the topics carrying any included tag and no excluded one, or {"error": message}. A connection carries any number
+  of requests. Daemons that predate framing (send a bare tag id, get a JSON list back) are supported with framed=False,
+  for single-tag queries only. They needn't close the connection after replying; the response ends where its JSON does.
+"""
+
+import collections
+import json
+import os
+import socket
+import struct
+import threading
+
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+class TagdError(Exception):
+  def __init__(self, message):
+    super(TagdError, self).__init__(message)
+    self.message = message
+  def __str__(self):
+    return "\n".join([
+      super(TagdError, self).__str__(),
+      "Message: " + unicode(self.message)
+      ])
+
+def recvExactly(sock, size):
+  chunks = []
+  remaining = size
+  while remaining > 0:
+    chunk = sock.recv(min(remaining, 65536))
+    if not chunk:
+      raise EOFError("connection closed with " + str(remaining) + " bytes outstanding")
+    chunks.append(chunk)
+    remaining -= len(chunk)
+  return ''.join(chunks)
+
+def sendFrame(sock, data):
+  sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+def recvFrame(sock):
+  size, = FRAME_HEADER.unpack(recvExactly(sock, FRAME_HEADER.size))
+  if size > MAX_FRAME_SIZE:
+    raise TagdError("frame of " + str(size) + " bytes exceeds the maximum of " + str(MAX_FRAME_SIZE))
+  return recvExactly(sock, size)
+
+class TagdClient(object):
+  '''
+  Keeps up to size idle connections to tagd open between requests.
+  A request that fails on a reused connection (e.g. one the daemon has since closed) is retried once on a fresh one,
+  and the other idle connections, likely closed along with it, are dropped.
+  Speaks the legacy unframed protocol unless framed is set.
+  '''
+  def __init__(self, path, size=4, timeout=5, framed=False):
+    self.path = path
+    self.size = size
+    self.timeout = timeout
+    self.framed = framed
+    self._idle = collections.deque()
+    self._lock = threading.Lock()
+
+  def topics(self, include, exclude=None):
+    """
+    Returns the ids of topics carrying any of the include tag ids and none of the exclude tag ids.
+    """
+    include = [int(tagID) for tagID in include]
+    exclude = [int(tagID) for tagID in exclude] if exclude else []
+    if not self.framed:
+      if len(include) != 1 or exclude:
+        raise TagdError("unframed tagd only supports single-tag queries")
+      return self._legacyRequest(include[0])
+    return self.request({'include': include, 'exclude': exclude})
+
+  def request(self, payload):
+    data = json.dumps(payload)
+    for attempt in range(2):
+      # the retry always gets a fresh connection, so a pool of stale ones can't use up both attempts.
+      sock, reused = self._checkout() if attempt == 0 else (self._connect(), False)
+      try:
+        sendFrame(sock, data)
+        response = json.loads(recvFrame(sock))
+      except socket.timeout:
+        sock.close()
+        raise TagdError("timed out after " + str(self.timeout) + " seconds")
+      except (socket.error, EOFError), e:
+        sock.close()
+        if reused:
+          self.close()
+          continue
+        raise TagdError(str(e))
+      except ValueError, e:
+        sock.close()
+        raise TagdError("malformed response: " + str(e))
+      self._checkin(sock)
+      if isinstance(response, dict):
+        raise TagdError(response.get('error', 'unexpected response'))
+      return response
+    raise TagdError("request failed on a reused connection and its retry")
+
+  def close(self):
+    with self._lock:
+      while self._idle:
+        self._idle.pop().close()
+
+  def _connect(self):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(self.timeout)
+    try:
+      sock.connect(self.path)
+    except socket.error, e:
+      sock.close()
+      raise TagdError(str(e))
+    return sock
+
+  def _checkout(self):
+    with self._lock:
+      if self._idle:
+        return self._idle.pop(), True
+    return self._connect(), False
+
+  def _checkin(self, sock):
+    with self._lock:
+      if len(self._idle) < self.size:
+        self._idle.append(sock)
+        return
+    sock.close()
+
+  def _legacyRequest(self, tagID):
+    sock = self._connect()
+    try:
+      sock.sendall(str(tagID))
+      chunks = []
+      while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+          break
+        chunks.append(chunk)
+        # the daemon may keep the connection open after replying, so stop as soon as the whole list is in.
+        if chunk.rstrip().endswith(']'):
+          try:
+            return json.loads(''.join(chunks))
+          except ValueError:
+            pass
+      return json.loads(''.join(chunks))
+    except socket.timeout:
+      raise TagdError("timed out after " + str(self.timeout) + " seconds")
+    except (socket.error, ValueError), e:
+      raise TagdError(str(e))
+    finally:
+      sock.close()
+
+class StandInServer(object):
+  '''
+  Minimal tagd for local development and testing. Answers requests with lookup(include, exclude).
+  With framed=False, it speaks the legacy protocol instead, and holds each connection open after replying until the
+  client closes it. Stopping it closes its open connections too, as a daemon restart would.
+  '''
+  def __init__(self, path, lookup, framed=True):
+    self.path = path
+    self.lookup = lookup
+    self.framed = framed
+    self._sock = None
+    self._conns = set()
+    self._lock = threading.Lock()
+
+  def start(self):
+    if os.path.exists(self.path):
+      os.unlink(self.path)
+    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self._sock.bind(self.path)
+    self._sock.listen(16)
+    thread = threading.Thread(target=self._accept)
+    thread.daemon = True
+    thread.start()
+    return self
+
+  def stop(self):
+    self._sock.close()
+    with self._lock:
+      for conn in self._conns:
+        try:
+          conn.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+          pass
+    if os.path.exists(self.path):
+      os.unlink(self.path)
+
+  def _accept(self):
+    while True:
+      try:
+        conn, address = self._sock.accept()
+      except socket.error:
+        return
+      thread = threading.Thread(target=self._serve, args=(conn,))
+      thread.daemon = True
+      thread.start()
+
+  def _serve(self, conn):
+    with self._lock:
+      self._conns.add(conn)
+    try:
+      if not self.framed:
+        conn.sendall(json.dumps(list(self.lookup([int(conn.recv(1024))], []))))
+        while conn.recv(1024):
+          pass
+        return
+      while True:
+        try:
+          request = json.loads(recvFrame(conn))
+        except EOFError:
+          return
+        try:
+          response = list(self.lookup(request.get('include', []), request.get('exclude', [])))
+        except Exception, e:
+          response = {'error': str(e)}
+        sendFrame(conn, json.dumps(response))
+    except socket.error:
+      return
+    finally:
+      with self._lock:
+        self._conns.discard(conn)
+      conn.close()
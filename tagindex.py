@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+"""
+  In-process compressed bitmap index from tags to the topics carrying them.
+  Released under WTFPL <http://www.wtfpl.net/txt/copying>
+
+  Like a roaring bitmap, each set of topic ids is split by the ids' high 16 bits into containers holding their low
+  16 bits. A container with at most ARRAY_MAX_SIZE ids is a sorted array('H'); a denser one is a 65536-bit integer,
+  so dense intersections and unions run as single long operations.
+
+  The index is saved to a flat file that workers memory-map on startup. Only the directory of tags is read up front;
+  each tag's bitmap is decoded from the map the first time it's queried. The file is written in native byte order,
+  since it's a local cache rather than an interchange format.
+
+  Workers never build the index themselves: it's built and saved by running this module (hourly, from cron), and each
+  worker re-maps the file whenever a newer one replaces it.
+  Usage: python tagindex.py [path]
+"""
+
+import array
+import binascii
+import bisect
+import collections
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from dbquery import Query
+
+ARRAY_MAX_SIZE = 4096
+BITMAP_BYTES = 8192
+BYTE_BITS = [tuple([bit for bit in range(8) if byte >> bit & 1]) for byte in range(256)]
+
+FILE_MAGIC = 'TAGIDX01'
+FILE_HEADER = struct.Struct('=8siiiII')
+DIRECTORY_ENTRY = struct.Struct('=iQI')
+CONTAINER_HEADER = struct.Struct('=HBI')
+ARRAY_CONTAINER, BITMAP_CONTAINER = 0, 1
+
+class IndexUnavailableError(Exception):
+  def __init__(self, path):
+    super(IndexUnavailableError, self).__init__()
+    self.path = path
+  def __str__(self):
+    return "\n".join([
+      super(IndexUnavailableError, self).__str__(),
+      "Path: " + unicode(self.path)
+      ])
+
+def bytesToBits(data):
+  return long(binascii.hexlify(str(data)[::-1]) or '0', 16)
+
+def bitsToBytes(bits):
+  return binascii.unhexlify(('%x' % bits).zfill(BITMAP_BYTES * 2))[::-1]
+
+def arrayToBits(values):
+  data = bytearray(BITMAP_BYTES)
+  for value in values:
+    data[value >> 3] |= 1 << (value & 7)
+  return bytesToBits(data)
+
+def bitsToArray(bits):
+  values = array.array('H')
+  for index, byte in enumerate(bytearray(bitsToBytes(bits))):
+    if byte:
+      base = index << 3
+      values.extend([base + bit for bit in BYTE_BITS[byte]])
+  return values
+
+def hasBit(data, value):
+  return ord(data[value >> 3]) >> (value & 7) & 1
+
+def normalize(container):
+  """
+  Returns container in its smaller representation, or None if it's empty.
+  """
+  if isinstance(container, array.array):
+    if not container:
+      return None
+    return arrayToBits(container) if len(container) > ARRAY_MAX_SIZE else container
+  if not container:
+    return None
+  return bitsToArray(container) if bin(container).count('1') <= ARRAY_MAX_SIZE else container
+
+def sortedArray(values):
+  return array.array('H', sorted(values))
+
+def containerAnd(a, b):
+  if isinstance(a, array.array) and isinstance(b, array.array):
+    return normalize(sortedArray(set(a).intersection(b)))
+  if isinstance(a, array.array):
+    a, b = b, a
+  if isinstance(b, array.array):
+    data = bitsToBytes(a)
+    return normalize(array.array('H', [value for value in b if hasBit(data, value)]))
+  return normalize(a & b)
+
+def containerOr(a, b):
+  if isinstance(a, array.array) and isinstance(b, array.array):
+    return normalize(sortedArray(set(a).union(b)))
+  a = arrayToBits(a) if isinstance(a, array.array) else a
+  b = arrayToBits(b) if isinstance(b, array.array) else b
+  return normalize(a | b)
+
+def containerAndNot(a, b):
+  if isinstance(a, array.array):
+    if isinstance(b, array.array):
+      return normalize(sortedArray(set(a).difference(b)))
+    data = bitsToBytes(b)
+    return normalize(array.array('H', [value for value in a if not hasBit(data, value)]))
+  b = arrayToBits(b) if isinstance(b, array.array) else b
+  return normalize(a & ~b)
+
+def rankKey(topicID, lastPostTime):
+  """
+  Packs lastPostTime and topicID into one int ordering topics by both, so ties are broken by id without building tuples.
+  """
+  return lastPostTime << 32 | topicID
+
+class Bitmap(object):
+  '''
+  Set of non-negative 32-bit integers, stored as containers keyed by their high 16 bits.
+  '''
+  def __init__(self, containers=None):
+    self.containers = containers if containers is not None else {}
+
+  @classmethod
+  def fromIDs(cls, ids):
+    groups = collections.defaultdict(set)
+    for value in ids:
+      groups[value >> 16].add(value & 0xFFFF)
+    return cls(dict([(key, normalize(sortedArray(values))) for key, values in groups.iteritems()]))
+
+  def __len__(self):
+    return sum([len(container) if isinstance(container, array.array) else bin(container).count('1') for container in self.containers.itervalues()])
+
+  def __iter__(self):
+    for key in sorted(self.containers):
+      container = self.containers[key]
+      base = key << 16
+      for value in (container if isinstance(container, array.array) else bitsToArray(container)):
+        yield base + value
+
+  def __contains__(self, value):
+    container = self.containers.get(value >> 16)
+    if container is None:
+      return False
+    if isinstance(container, array.array):
+      position = bisect.bisect_left(container, value & 0xFFFF)
+      return position < len(container) and container[position] == value & 0xFFFF
+    return bool(container >> (value & 0xFFFF) & 1)
+
+  def add(self, value):
+    key, low = value >> 16, value & 0xFFFF
+    container = self.containers.get(key)
+    if container is None:
+      self.containers[key] = array.array('H', [low])
+    elif isinstance(container, array.array):
+      position = bisect.bisect_left(container, low)
+      if position == len(container) or container[position] != low:
+        # containers are shared with query results, so they're replaced rather than changed in place.
+        container = array.array('H', container)
+        container.insert(position, low)
+        self.containers[key] = normalize(container)
+    else:
+      self.containers[key] = container | (1 << low)
+
+  def discard(self, value):
+    key, low = value >> 16, value & 0xFFFF
+    container = self.containers.get(key)
+    if container is None:
+      return
+    if isinstance(container, array.array):
+      position = bisect.bisect_left(container, low)
+      if position < len(container) and container[position] == low:
+        container = container[:position] + container[position + 1:]
+    else:
+      container &= ~(1 << low)
+    container = normalize(container)
+    if container is None:
+      del self.containers[key]
+    else:
+      self.containers[key] = container
+
+  def combine(self, other, operation, keepOwn, keepOther):
+    containers = {}
+    for key in set(self.containers).union(other.containers):
+      mine, theirs = self.containers.get(key), other.containers.get(key)
+      if mine is not None and theirs is not None:
+        container = operation(mine, theirs)
+      elif mine is not None:
+        container = mine if keepOwn else None
+      else:
+        container = theirs if keepOther else None
+      if container is not None:
+        containers[key] = container
+    return Bitmap(containers)
+
+  def __and__(self, other):
+    return self.combine(other, containerAnd, False, False)
+
+  def __or__(self, other):
+    return self.combine(other, containerOr, True, True)
+
+  def __sub__(self, other):
+    return self.combine(other, containerAndNot, True, False)
+
+  def encode(self):
+    parts = [struct.pack('=I', len(self.containers))]
+    for key in sorted(self.containers):
+      container = self.containers[key]
+      if isinstance(container, array.array):
+        parts.append(CONTAINER_HEADER.pack(key, ARRAY_CONTAINER, len(container)))
+        parts.append(container.tostring())
+      else:
+        parts.append(CONTAINER_HEADER.pack(key, BITMAP_CONTAINER, 0))
+        parts.append(bitsToBytes(container))
+    return ''.join(parts)
+
+  @classmethod
+  def decode(cls, data):
+    containers = {}
+    count, = struct.unpack_from('=I', data, 0)
+    position = 4
+    for i in xrange(count):
+      key, kind, size = CONTAINER_HEADER.unpack_from(data, position)
+      position += CONTAINER_HEADER.size
+      if kind == ARRAY_CONTAINER:
+        container = array.array('H')
+        container.fromstring(data[position:position + size * 2])
+        position += size * 2
+      else:
+        container = bytesToBits(data[position:position + BITMAP_BYTES])
+        position += BITMAP_BYTES
+      containers[key] = container
+    return cls(containers)
+
+class TagIndex(object):
+  '''
+  Bitmap of topic ids for every tag, plus each topic's lastPostTime for ordering results.
+  It's loaded from path, which build() and save() write. After that, at most every refreshInterval seconds (never, if
+  it's None), it's re-loaded if a newer file has replaced path, picking up retagged topics; otherwise tags on topics
+  past the highest topic id seen and topics posted in since the newest lastPostTime seen are pulled in. tags_topics
+  records no change time, so tags added to or removed from topics already seen wait for the next rebuilt file.
+  add(), remove() and touch() apply changes as they happen.
+  '''
+  def __init__(self, path=None, refreshInterval=60):
+    self.path = path
+    self.refreshInterval = refreshInterval
+    self._tags = {}
+    self._directory = {}
+    self._map = None
+    self._times = {}
+    self._ranked = []
+    self._all = Bitmap()
+    self._maxTopicID = None
+    self._timeHighWater = 0
+    self._lastRefresh = self._lastFullRefresh = 0
+    self._fileTime = None
+    self._lock = threading.RLock()
+    self._refreshLock = threading.Lock()
+
+  @property
+  def lastPostTime(self):
+    """
+    The newest lastPostTime the index has taken in.
+    """
+    return self._timeHighWater
+
+  @property
+  def version(self):
+    """
+    Changes whenever the index takes in a new topic or post. Every worker's index converges on the same version.
+    """
+    return "%s/%s" % (self._maxTopicID, self._timeHighWater)
+
+  def bitmap(self, tagID):
+    """
+    Returns the bitmap of topics carrying tagID, decoding it from the index file if it hasn't been yet.
+    """
+    with self._lock:
+      bitmap = self._tags.get(tagID)
+      if bitmap is None:
+        if tagID in self._directory:
+          offset, length = self._directory.pop(tagID)
+          bitmap = Bitmap.decode(self._map[offset:offset + length])
+        else:
+          bitmap = Bitmap()
+        self._tags[tagID] = bitmap
+      return bitmap
+
+  def add(self, tagID, topicID):
+    with self._lock:
+      self.bitmap(int(tagID)).add(int(topicID))
+      self._all.add(int(topicID))
+
+  def remove(self, tagID, topicID):
+    with self._lock:
+      self.bitmap(int(tagID)).discard(int(topicID))
+
+  def touch(self, topicID, lastPostTime):
+    """
+    Records a topic's new lastPostTime.
+    """
+    with self._lock:
+      topicID, lastPostTime = int(topicID), int(lastPostTime)
+      if topicID in self._times:
+        position = bisect.bisect_left(self._ranked, rankKey(topicID, self._times[topicID]))
+        if position < len(self._ranked) and self._ranked[position] == rankKey(topicID, self._times[topicID]):
+          del self._ranked[position]
+      bisect.insort(self._ranked, rankKey(topicID, lastPostTime))
+      self._times[topicID] = lastPostTime
+      self._all.add(int(topicID))
+      if lastPostTime > self._timeHighWater:
+        self._timeHighWater = int(lastPostTime)
+
+  def query(self, db, include=None, exclude=None, require=None):
+    """
+    Returns a bitmap of the topics carrying any of include, all of require and none of exclude (each a list of tag ids).
+    Without include or require, every topic is a candidate. Raises IndexUnavailableError until the index file's been built.
+    """
+    self.refresh(db)
+    if self._maxTopicID is None:
+      raise IndexUnavailableError(self.path)
+    with self._lock:
+      if require:
+        result = self.bitmap(int(require[0]))
+        for tagID in require[1:]:
+          result = result & self.bitmap(int(tagID))
+      if include:
+        included = Bitmap()
+        for tagID in include:
+          included = included | self.bitmap(int(tagID))
+        result = result & included if require else included
+      elif not require:
+        result = self._all
+      for tagID in (exclude or []):
+        result = result - self.bitmap(int(tagID))
+      return result
+
+  def topics(self, db, include=None, exclude=None, require=None, start=0, limit=None):
+    """
+    Returns the ids of matching topics (see query()), most recently posted in first.
+    """
+    matches = self.query(db, include=include, exclude=exclude, require=require)
+    # refreshes reorder the ranking and can add to matches, so neither can change while they're walked.
+    with self._lock:
+      if limit is not None and matches.containers:
+        # when matches are dense, walking every topic from most recently posted in finds a page sooner than ranking all of them.
+        wanted = start + limit
+        ranked = self._ranked
+        matchCount = len(matches)
+        if wanted * len(ranked) < matchCount * matchCount:
+          topicIDs = []
+          for position in xrange(len(ranked) - 1, -1, -1):
+            topicID = ranked[position] & 0xFFFFFFFF
+            if topicID in matches:
+              topicIDs.append(topicID)
+              if len(topicIDs) == wanted:
+                return topicIDs[start:]
+      times = self._times
+      key = lambda topicID: rankKey(topicID, times.get(topicID, 0))
+      if limit is None:
+        return sorted(matches, key=key, reverse=True)[start:]
+      return heapq.nlargest(start + limit, matches, key=key)[start:]
+
+  def refresh(self, db, force=False):
+    """
+    Loads the index from path if it hasn't been or a newer file has replaced it, or otherwise pulls in recent changes.
+    Never builds the index; until path exists, there's nothing to refresh.
+    """
+    with self._refreshLock:
+      now = time.time()
+      if self._maxTopicID is not None and not force and (self.refreshInterval is None or now - self._lastRefresh < self.refreshInterval):
+        return
+      self._lastRefresh = now
+      if self.path is not None:
+        try:
+          fileTime = os.stat(self.path).st_mtime
+        except OSError:
+          fileTime = None
+        if fileTime is not None and fileTime != self._fileTime:
+          self.load()
+          self._lastRefresh = now
+      if self._maxTopicID is None:
+        return
+      newTags = Query("tags_topics").fields("tag_id", "topic_id").where(("topic_id > %s", self._maxTopicID)).list(db)
+      # lastPostTime has one-second resolution, so topics posted in later in the newest second seen are re-read too.
+      postedTopics = Query("topics").fields("ll_topicid", "lastPostTime").where(("lastPostTime >= %s", self._timeHighWater)).list(db)
+      newTopicIDs = set([int(row['topic_id']) for row in newTags]) - set([int(row['ll_topicid']) for row in postedTopics])
+      if newTopicIDs:
+        # newly tagged topics need their own lastPostTime to be ranked, however old it is.
+        postedTopics += Query("topics").fields("ll_topicid", "lastPostTime").where(ll_topicid=[str(topicID) for topicID in newTopicIDs]).list(db)
+      with self._lock:
+        for row in newTags:
+          self.add(row['tag_id'], row['topic_id'])
+          self._maxTopicID = max(self._maxTopicID, int(row['topic_id']))
+        for row in postedTopics:
+          topicID, lastPostTime = int(row['ll_topicid']), int(row['lastPostTime'] or 0)
+          if self._times.get(topicID) != lastPostTime:
+            self.touch(topicID, lastPostTime)
+
+  def build(self, db):
+    """
+    Rebuilds the whole index from the database. Run offline, by main(); workers only load() what it save()s.
+    """
+    now = time.time()
+    topicTags = collections.defaultdict(list)
+    maxTopicID = 0
+    for row in Query("tags_topics").fields("tag_id", "topic_id").query(db):
+      topicTags[int(row['tag_id'])].append(int(row['topic_id']))
+      maxTopicID = max(maxTopicID, int(row['topic_id']))
+    times = {}
+    for row in Query("topics").fields("ll_topicid", "lastPostTime").query(db):
+      times[int(row['ll_topicid'])] = int(row['lastPostTime'] or 0)
+    tags = dict([(tagID, Bitmap.fromIDs(topicIDs)) for tagID, topicIDs in topicTags.iteritems()])
+    with self._lock:
+      self._tags = tags
+      self._directory = {}
+      self._times = times
+      self._ranked = sorted([rankKey(topicID, lastPostTime) for topicID, lastPostTime in times.iteritems()])
+      self._all = Bitmap.fromIDs(times)
+      self._maxTopicID = maxTopicID
+      self._timeHighWater = max(times.itervalues()) if times else 0
+      self._lastRefresh = self._lastFullRefresh = now
+    return self
+
+  def save(self, path=None):
+    """
+    Writes the index to path, replacing any previous file atomically. Each writer has its own temporary file, so
+    concurrent saves can't interleave.
+    """
+    path = path or self.path
+    with self._lock:
+      for tagID in list(self._directory):
+        self.bitmap(tagID)
+      topicIDs = array.array('i', sorted(self._times))
+      times = array.array('i', [self._times[topicID] for topicID in topicIDs])
+      blobs = [(tagID, self._tags[tagID].encode()) for tagID in sorted(self._tags)]
+      header = FILE_HEADER.pack(FILE_MAGIC, self._maxTopicID or 0, self._timeHighWater, int(self._lastFullRefresh), len(topicIDs), len(blobs))
+    offset = FILE_HEADER.size + topicIDs.itemsize * len(topicIDs) * 2 + DIRECTORY_ENTRY.size * len(blobs)
+    directory = []
+    for tagID, blob in blobs:
+      directory.append(DIRECTORY_ENTRY.pack(tagID, offset, len(blob)))
+      offset += len(blob)
+    descriptor, temporaryPath = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    os.fchmod(descriptor, 0644)
+    with os.fdopen(descriptor, 'wb') as indexFile:
+      indexFile.write(header)
+      indexFile.write(topicIDs.tostring())
+      indexFile.write(times.tostring())
+      indexFile.write(''.join(directory))
+      for tagID, blob in blobs:
+        indexFile.write(blob)
+    os.rename(temporaryPath, path)
+
+  def load(self, path=None):
+    """
+    Maps the index file at path, reading its topics and tag directory. Tag bitmaps are decoded as they're queried.
+    """
+    path = path or self.path
+    with open(path, 'rb') as indexFile:
+      fileTime = os.fstat(indexFile.fileno()).st_mtime
+      indexMap = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, maxTopicID, timeHighWater, builtAt, numTopics, numTags = FILE_HEADER.unpack_from(indexMap, 0)
+    if magic != FILE_MAGIC:
+      raise ValueError("not a tag index file: " + path)
+    position = FILE_HEADER.size
+    topicIDs = array.array('i')
+    topicIDs.fromstring(indexMap[position:position + topicIDs.itemsize * numTopics])
+    position += topicIDs.itemsize * numTopics
+    times = array.array('i')
+    times.fromstring(indexMap[position:position + times.itemsize * numTopics])
+    position += times.itemsize * numTopics
+    directory = {}
+    for i in xrange(numTags):
+      tagID, offset, length = DIRECTORY_ENTRY.unpack_from(indexMap, position)
+      directory[tagID] = (offset, length)
+      position += DIRECTORY_ENTRY.size
+    with self._lock:
+      self._map = indexMap
+      self._directory = directory
+      self._tags = {}
+      self._times = dict(zip(topicIDs, times))
+      self._ranked = sorted([rankKey(topicID, lastPostTime) for topicID, lastPostTime in self._times.iteritems()])
+      self._all = Bitmap.fromIDs(topicIDs)
+      self._maxTopicID = maxTopicID
+      self._timeHighWater = timeHighWater
+      self._lastFullRefresh = builtAt
+      self._lastRefresh = 0
+      self._fileTime = fileTime
+    return self
+
+def main(path):
+  import DbConn
+  with open("config.txt", 'r') as f:
+    username, password, database = f.readline().strip().split(',')
+  db = DbConn.DbConn(username, password, database)
+  index = TagIndex(path).build(db)
+  index.save()
+  print "%d topics, %d tags written to %s" % (len(index._times), len(index._tags), path)
+
+if __name__ == '__main__':
+  main(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "tagindex.bin"))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+  Tests for the pooled tagd client, against the stand-in daemon.
+  Usage (from the repository root): python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tagd
+
+TAG_TOPICS = {
+  1: [3, 2, 1],
+  2: [2]
+}
+
+def lookup(include, exclude):
+  topicIDs = set()
+  for tagID in include:
+    topicIDs.update(TAG_TOPICS.get(tagID, []))
+  for tagID in exclude:
+    topicIDs.difference_update(TAG_TOPICS.get(tagID, []))
+  return sorted(topicIDs, reverse=True)
+
+class TagdClientTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'tagd.sock')
+    self.server = tagd.StandInServer(self.path, lookup).start()
+    self.client = tagd.TagdClient(self.path, size=4, timeout=2, framed=True)
+
+  def tearDown(self):
+    self.client.close()
+    self.server.stop()
+    shutil.rmtree(self.directory)
+
+  def poolConnections(self, count):
+    sockets = [self.client._connect() for i in range(count)]
+    for sock in sockets:
+      self.client._checkin(sock)
+
+  def testTopics(self):
+    self.assertEqual(self.client.topics([1], exclude=[2]), [3, 1])
+    self.assertEqual(len(self.client._idle), 1)
+
+  def testTwoStaleConnections(self):
+    self.poolConnections(2)
+    # a restarted daemon has closed every connection the pool holds.
+    self.server.stop()
+    self.server = tagd.StandInServer(self.path, lookup).start()
+    self.assertEqual(self.client.topics([1]), [3, 2, 1])
+    self.assertEqual(self.client.topics([2]), [2])
+
+  def testDaemonDown(self):
+    self.poolConnections(2)
+    self.server.stop()
+    self.assertRaises(tagd.TagdError, self.client.topics, [1])
+
+  def testLegacyByDefault(self):
+    client = tagd.TagdClient(self.path)
+    self.assertFalse(client.framed)
+    self.assertRaises(tagd.TagdError, client.topics, [1, 2])
+
+class LegacyTagdClientTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'tagd.sock')
+    self.server = tagd.StandInServer(self.path, lookup, framed=False).start()
+    self.client = tagd.TagdClient(self.path, timeout=2)
+
+  def tearDown(self):
+    self.client.close()
+    self.server.stop()
+    shutil.rmtree(self.directory)
+
+  def testTopics(self):
+    # the stand-in holds the connection open after replying, so this would time out reading to the end.
+    start = time.time()
+    self.assertEqual(self.client.topics([1]), [3, 2, 1])
+    self.assertEqual(self.client.topics([2]), [2])
+    self.assertTrue(time.time() - start < 1)
+
+  def testDaemonDown(self):
+    self.server.stop()
+    self.assertRaises(tagd.TagdError, self.client.topics, [1])
+
+if __name__ == '__main__':
+  unittest.main()